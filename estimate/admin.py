@@ -1,3 +1,265 @@
+"""
+Admin for estimates at large row counts. List pages stay on the estimate indexes with a capped count
+(utils.admin.CappedCountPaginator), the estimate form edits the lines in an inline that reads them and
+the equipment posted for them with a fixed number of queries, and saves go through EstimateSerializer,
+so totals, rollups, the change feed and the search index are kept as by the API.
+"""
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _, ngettext
+from management.cache import equipment_catalog
+from management.models import Equipment
+from utils.admin import CappedCountPaginator, SoftDeleteListFilter
+from .models import Estimate, EstimateEquipment
+from .search import search_estimates
+from .serializers import EstimateSerializer
 
-# Register your models here.
+
+class PreloadedModelChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField taking the submitted object from ``preloaded`` ({pk: object}) instead of a query."""
+
+    def __init__(self, *args, preloaded=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preloaded = preloaded or {}
+
+    def to_python(self, value):
+        try:
+            pk = self.queryset.model._meta.pk.to_python(value)
+        except ValidationError:
+            pk = None
+        if pk in self.preloaded:
+            return self.preloaded[pk]
+        return super().to_python(value)
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """AutocompleteSelect rendering the selected option from ``labels`` ({str(pk): label}) instead of a query."""
+    labels = {}
+
+    def optgroups(self, name, value, attr=None):
+        selected = [str(v) for v in value if str(v) not in self.choices.field.empty_values]
+        if not all(pk in self.labels for pk in selected):
+            return super().optgroups(name, value, attr)
+        default = (None, [], 0)
+        if not self.is_required and not self.allow_multiple_selected:
+            default[1].append(self.create_option(name, '', '', False, 0))
+        for pk in selected[:None if self.allow_multiple_selected else 1]:
+            default[1].append(self.create_option(name, pk, self.labels[pk], True, len(default[1])))
+        return [default]
+
+
+class EstimateEquipmentForm(forms.ModelForm):
+    def _get_validation_exclusions(self):
+        # The equipment was resolved by PreloadedModelChoiceField; the model's check of the foreign key
+        # would look it up again, once per line
+        return {*super()._get_validation_exclusions(), 'equipment'}
+
+    def validate_unique(self):
+        # estimate_equipment_live_unique is checked for all the lines at once by EstimateEquipmentFormSet.clean()
+        pass
+
+
+class EstimateEquipmentFormSet(BaseInlineFormSet):
+    """
+    The lines of an estimate, read with one query; the equipment posted for them comes from the
+    equipment catalog, at most one more. Django's formset would look up every line's id and equipment.
+    """
+
+    @cached_property
+    def lines(self):
+        return {line.pk: line for line in self.get_queryset()}
+
+    @cached_property
+    def equipment(self):
+        """{pk: Equipment} of the live equipment posted for the lines."""
+        ids = set()
+        if self.is_bound:
+            for index in range(self.total_form_count()):
+                try:
+                    ids.add(Equipment._meta.pk.to_python(self.data.get(f'{self.add_prefix(index)}-equipment')))
+                except ValidationError:
+                    pass  # Reported by the form
+        ids.discard(None)
+        return equipment_catalog.get_many(ids) if ids else {}
+
+    @cached_property
+    def equipment_labels(self):
+        labels = {str(line.equipment_id): str(line.equipment) for line in self.lines.values()}
+        labels.update((str(pk), str(equipment)) for pk, equipment in self.equipment.items())
+        return labels
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        name = self.model._meta.pk.name
+        field = form.fields[name]
+        form.fields[name] = PreloadedModelChoiceField(field.queryset, initial=field.initial, required=False,
+                                                      widget=field.widget, preloaded=self.lines)
+        equipment = form.fields['equipment']
+        equipment.preloaded = self.equipment
+        widget = getattr(equipment.widget, 'widget', equipment.widget)  # Inside RelatedFieldWidgetWrapper
+        if isinstance(widget, PreloadedAutocompleteSelect):
+            widget.labels = self.equipment_labels
+
+    def clean(self):
+        super().clean()
+        seen = set()
+        for form in self.forms:
+            equipment = getattr(form, 'cleaned_data', {}).get('equipment')
+            if equipment is None or form in self.deleted_forms:
+                continue
+            if equipment.pk in seen:
+                raise ValidationError(_("The same equipment can only be added once to an estimate."))
+            seen.add(equipment.pk)
+
+
+class EstimateEquipmentInline(admin.TabularInline):
+    model = EstimateEquipment
+    form = EstimateEquipmentForm
+    formset = EstimateEquipmentFormSet
+    fields = ('equipment', 'quantity', 'price_override')
+    autocomplete_fields = ('equipment',)
+    ordering = ('pk',)
+    extra = 0
+
+    def get_queryset(self, request):
+        # The row labels show the estimate number and the equipment name
+        return super().get_queryset(request).select_related('estimate', 'equipment')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'equipment':
+            kwargs['widget'] = PreloadedAutocompleteSelect(db_field, self.admin_site, using=kwargs.get('using'))
+            kwargs['form_class'] = PreloadedModelChoiceField
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(Estimate)
+class EstimateAdmin(admin.ModelAdmin):
+    list_display = ('estimate_number', 'created_by', 'note', 'is_archived', 'total', 'created_at', 'updated_at')
+    list_select_related = ('created_by',)
+    list_filter = ('is_archived', SoftDeleteListFilter)
+    # estimate_live_created_idx's order; id makes it total, so no other sort key is added
+    ordering = ('-created_at', 'id')
+    search_fields = ('=estimate_number',)
+    search_help_text = _("An estimate number, or words of the note and the equipment names.")
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    autocomplete_fields = ('created_by',)
+    fields = ('estimate_number', 'created_by', 'note', 'is_archived', 'total', 'created_at', 'updated_at',
+              'deleted_at')
+    readonly_fields = ('estimate_number', 'total', 'created_at', 'updated_at', 'deleted_at')
+    inlines = (EstimateEquipmentInline,)
+    actions = ('archive', 'unarchive', 'restore')
+
+    def get_queryset(self, request):
+        # Soft-deleted estimates too, for the restore action; SoftDeleteListFilter lists the live ones by default
+        queryset = Estimate.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        return queryset.order_by(*ordering) if ordering else queryset
+
+    def get_readonly_fields(self, request, obj=None):
+        # Estimates keep their estimator, whose rollups they count in
+        return self.readonly_fields + (('created_by',) if obj is not None else ())
+
+    def has_change_permission(self, request, obj=None):
+        return super().has_change_permission(request, obj) and (obj is None or obj.deleted_at is None)
+
+    def has_delete_permission(self, request, obj=None):
+        return super().has_delete_permission(request, obj) and (obj is None or obj.deleted_at is None)
+
+    def get_search_results(self, request, queryset, search_term):
+        # An estimate number, looked up on its unique index; anything else goes to the full-text search
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        by_number = queryset.filter(estimate_number=search_term)
+        if by_number.exists():
+            return by_number, False
+        return search_estimates(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        # Written together with the lines by save_related()
+        pass
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Save the estimate and its lines through EstimateSerializer, as the API does: lines are written
+        with set-based statements, and the total, the rollups, the change feed and the search index follow.
+        """
+        obj = form.instance
+        lines = next((formset for formset in formsets if formset.model is EstimateEquipment), None)
+        data = {'note': obj.note, 'is_archived': obj.is_archived}
+        if lines is not None and (not change or lines.has_changed()):
+            data['equipments'] = [
+                {'equipment': line.cleaned_data['equipment'].pk, 'quantity': line.cleaned_data['quantity'],
+                 'price_override': line.cleaned_data.get('price_override')}
+                for line in lines.forms if line.cleaned_data and line not in lines.deleted_forms
+            ]
+        # The stored row: the rollups subtract the estimate as it was before this change
+        instance = Estimate.objects.get(pk=obj.pk) if change else None
+        serializer = EstimateSerializer(instance, data=data, partial=change)
+        serializer.is_valid(raise_exception=True)
+        estimate = serializer.save(**({} if change else {'created_by': obj.created_by}))
+        form.save_m2m()
+
+        for field in Estimate._meta.concrete_fields:
+            setattr(obj, field.attname, getattr(estimate, field.attname))
+        obj._state.adding, obj._state.db = False, estimate._state.db
+        if lines is not None:
+            # What construct_change_message() reads from a formset that saved itself
+            kept = [line for line in lines.forms if line.has_changed() and line not in lines.deleted_forms]
+            for line in kept:
+                line.instance.estimate = obj
+            lines.new_objects = [line.instance for line in kept if line.instance.pk is None]
+            lines.changed_objects = [(line.instance, line.changed_data) for line in kept if line.instance.pk is not None]
+            lines.deleted_objects = [line.instance for line in lines.deleted_forms if line.instance.pk is not None]
+
+    def _set_archived(self, request, queryset, archived):
+        # One UPDATE; EstimateQuerySet.update() keeps the rollups and the change feed in step
+        updated = queryset.filter(deleted_at__isnull=True).exclude(is_archived=archived).update(
+            is_archived=archived, updated_at=timezone.now())
+        message = (ngettext("%d estimate was archived.", "%d estimates were archived.", updated) if archived
+                   else ngettext("%d estimate was unarchived.", "%d estimates were unarchived.", updated))
+        self.message_user(request, message % updated)
+
+    @admin.action(description=_("Archive selected estimates"), permissions=['change'])
+    def archive(self, request, queryset):
+        self._set_archived(request, queryset, True)
+
+    @admin.action(description=_("Unarchive selected estimates"), permissions=['change'])
+    def unarchive(self, request, queryset):
+        self._set_archived(request, queryset, False)
+
+    @admin.action(description=_("Restore selected deleted estimates"), permissions=['change'])
+    def restore(self, request, queryset):
+        # Set-based, with the lines deleted together with their estimate
+        _, counts = queryset.restore()
+        restored = counts.get(Estimate._meta.label, 0)
+        self.message_user(request, ngettext("%d estimate was restored.", "%d estimates were restored.",
+                                            restored) % restored)
+
+
+@admin.register(EstimateEquipment)
+class EstimateEquipmentAdmin(admin.ModelAdmin):
+    """Lines across estimates, read-only: they are edited on their estimate, which keeps its total in step."""
+    list_display = ('estimate', 'equipment', 'quantity', 'price_override', 'updated_at')
+    list_select_related = ('estimate', 'equipment')
+    search_fields = ('=estimate__estimate_number',)
+    ordering = ('-pk',)
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, post_save, pre_save
 
 
 class EstimateConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'estimate'
+
+    def ready(self):
+        from management.models import Equipment
+        from management.signals import equipment_renamed, equipment_repriced
+        from . import models, search
+
+        # The search index's FTS5 table and its upkeep on equipment renames (see estimate.search)
+        post_migrate.connect(search.create_index_after_migrate, sender=self)
+        pre_save.connect(search.remember_equipment_name, sender=Equipment)
+        post_save.connect(search.reindex_equipment_estimates, sender=Equipment)
+        equipment_renamed.connect(search.reindex_renamed_equipment, sender=Equipment)
+        # Stored totals quoting the catalog price
+        equipment_repriced.connect(models.refresh_repriced_totals, sender=Equipment)
@@ -0,0 +1,153 @@
+"""
+Archive tier for estimates. archive_estimates moves archived estimates that have not changed for a
+while, with all their lines, from the estimate tables to ArchivedEstimate and ArchivedEstimateEquipment,
+keeping their primary keys, so the tables and indexes every active query runs on only hold estimates
+in use. Each batch is one transaction of set-based INSERT ... SELECT and DELETE statements, so an
+interrupted run loses nothing and the next one carries on with what is left.
+
+Detail lookups fall back to the archive tables (find_archived); writes to an archived estimate,
+un-archiving included, move it back first (restore_estimates). Lists only cover the estimate tables.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from .models import (ArchivedEstimate, ArchivedEstimateEquipment, Estimate, EstimateEquipment, calculate_line_amount,
+                     calculate_total)
+from .search import CHUNK_SIZE, index_estimates
+from .serializers import set_prefetched_lines
+
+# (estimate table model, archive table model, column holding the estimate id), parents first
+TABLES = ((Estimate, ArchivedEstimate, 'id'), (EstimateEquipment, ArchivedEstimateEquipment, 'estimate_id'))
+
+
+def _chunks(pks):
+    for start in range(0, len(pks), CHUNK_SIZE):
+        chunk = pks[start:start + CHUNK_SIZE]
+        yield ', '.join(['%s'] * len(chunk)), chunk
+
+
+def _copy(source, target, shared, column, pks, using, values):
+    """
+    INSERT ... SELECT the ``shared`` columns of the rows of ``source`` whose ``column`` is in ``pks``
+    into ``target``; ``values`` ({column: value}) fills the target's other columns.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    insert_columns = ', '.join(quote(name) for name in [*shared, *values])
+    select_columns = ', '.join([*(quote(name) for name in shared), *['%s'] * len(values)])
+    copied = 0
+    with connection.cursor() as cursor:
+        for placeholders, chunk in _chunks(pks):
+            cursor.execute(f'INSERT INTO {quote(target._meta.db_table)} ({insert_columns}) '
+                           f'SELECT {select_columns} FROM {quote(source._meta.db_table)} '
+                           f'WHERE {quote(column)} IN ({placeholders})', [*values.values(), *chunk])
+            copied += cursor.rowcount
+    return copied
+
+
+def _delete(model, column, pks, using):
+    # Plain DELETEs: the rows were copied, so Django's collector (which loads every row to cascade
+    # and send signals) has nothing to do
+    quote = connections[using].ops.quote_name
+    with connections[using].cursor() as cursor:
+        for placeholders, chunk in _chunks(pks):
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({placeholders})',
+                           chunk)
+
+
+def _move_estimates(pks, using, archived_at=None):
+    """
+    Move the estimates ``pks`` and all their lines to the archive tables, or back from them when
+    ``archived_at`` is None. Returns the number of estimates and lines moved.
+    """
+    moves = []
+    for hot, archive, column in TABLES:
+        # The archive tables have the columns of the estimate tables, plus archived_at for estimates
+        shared = [field.column for field in hot._meta.concrete_fields]
+        if archived_at is None:
+            moves.append((archive, hot, shared, column, {}))
+        else:
+            values = {'archived_at': connections[using].ops.adapt_datetimefield_value(archived_at)} \
+                if archive is ArchivedEstimate else {}
+            moves.append((hot, archive, shared, column, values))
+    # Parents are copied first and deleted last, so foreign keys hold after every statement
+    counts = tuple(_copy(source, target, shared, column, pks, using, values)
+                   for source, target, shared, column, values in moves)
+    for source, _, _, column, _ in reversed(moves):
+        _delete(source, column, pks, using)
+    # Archived estimates drop out of the search index; restored ones are indexed again
+    index_estimates(pks, using=using)
+    return counts
+
+
+def archive_batch(cutoff, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Move up to ``batch_size`` archived estimates last changed before ``cutoff`` (lowest primary keys
+    first) and all their lines to the archive tables, in one transaction. Soft-deleted estimates are
+    left for the purge. Returns the number of estimates and lines moved, (0, 0) when none are left.
+    """
+    with transaction.atomic(using=using):
+        pks = list(Estimate.objects.using(using).filter(is_archived=True, updated_at__lt=cutoff)
+                   .order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return 0, 0
+        return _move_estimates(pks, using, archived_at=timezone.now())
+
+
+def restore_estimates(queryset):
+    """
+    Move the estimates of an ArchivedEstimate queryset and their lines back to the estimate tables, in
+    one transaction, unchanged. Returns the number of estimates restored.
+    """
+    with transaction.atomic(using=queryset.db):
+        pks = list(queryset.values_list('pk', flat=True))
+        if not pks:
+            return 0
+        estimates, _ = _move_estimates(pks, queryset.db)
+    return estimates
+
+
+def to_estimate(archived, lines):
+    """
+    The Estimate an ArchivedEstimate was moved from, for read-only use. ``lines`` (all its archived
+    lines, with their equipment) fill the equipments prefetch cache, and the values with_totals() and
+    with_version() would annotate are computed from them, so EstimateSerializer and the ETags of an
+    archived estimate are the same as before it was moved.
+    """
+    estimate = Estimate(**{field.attname: getattr(archived, field.attname)
+                           for field in Estimate._meta.concrete_fields})
+    estimate._state.adding = False
+    estimate._state.db = archived._state.db
+    live = []
+    for line in lines:
+        if line.deleted_at is None:
+            live.append(EstimateEquipment(**{field.attname: getattr(line, field.attname)
+                                             for field in EstimateEquipment._meta.concrete_fields}))
+            live[-1].equipment = line.equipment
+    set_prefetched_lines(estimate, live)
+    estimate.line_count = len(live)
+    estimate.subtotal = calculate_total(calculate_line_amount(line.quantity, line.price_override, line.equipment.price)
+                                        for line in live)
+    estimate.lines_updated_at = max((line.updated_at for line in lines), default=None)
+    estimate.equipment_updated_at = max((line.equipment.updated_at for line in lines), default=None)
+    return estimate
+
+
+def _archived_lines(archived):
+    return ArchivedEstimateEquipment.all_objects.using(archived._state.db).filter(
+        estimate=archived).select_related('equipment').order_by('pk')
+
+
+def find_archived(**lookup):
+    """The archived estimate matching ``lookup`` (e.g. pk and created_by) as an Estimate, or None; two queries."""
+    archived = ArchivedEstimate.objects.filter(**lookup).first()
+    if archived is None:
+        return None
+    return to_estimate(archived, list(_archived_lines(archived)))
+
+
+async def afind_archived(**lookup):
+    """Async find_archived()."""
+    archived = await ArchivedEstimate.objects.filter(**lookup).afirst()
+    if archived is None:
+        return None
+    return to_estimate(archived, [line async for line in _archived_lines(archived)])
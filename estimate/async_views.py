@@ -0,0 +1,194 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from rest_framework import permissions, status
+from rest_framework.exceptions import NotFound
+from utils.throttling import SharedScopedRateThrottle, SharedUserRateThrottle
+from utils.views import AsyncAPIView
+from .archive import afind_archived, restore_estimates
+from .changes import aget_horizon, changes_after, feed_page, feed_params, gone, to_entry, visible_changes
+from .etags import check_if_match, estimate_etag, etag_matches, instance_etag
+from .filters import filter_estimates
+from .models import ArchivedEstimate, Estimate, EstimateEquipment
+from .pagination import EstimateCursorPagination, EstimateSearchPagination
+from .search import search_estimates
+from .serializers import EstimateListSerializer, EstimateSerializer, set_prefetched_lines
+
+# Async views: reads use the async ORM directly, so a request waiting on the database does not
+# hold a thread. Writes span several statements in one transaction, which the async ORM does not
+# support; they run as a single sync_to_async call on Django's shared thread, as sync views do.
+
+
+class AsyncEstimateListCreateView(AsyncAPIView):
+    """Async EstimateListCreateView."""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
+    throttle_scope = 'user_minute'
+
+    async def get(self, request):
+        queryset = Estimate.objects.all()
+        # Superusers can list every estimate, everyone else only sees their own
+        if not request.user.is_superuser:
+            queryset = queryset.filter(created_by_id=request.user.pk)
+        queryset = filter_estimates(queryset, request.query_params)
+        # ?q= as in EstimateListCreateView
+        query = request.query_params.get('q', '').strip()
+        if query:
+            queryset = search_estimates(queryset, query)
+
+        paginator = EstimateSearchPagination() if query else EstimateCursorPagination()
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+        return self.render({
+            'next': paginator.get_next_link(),
+            'results': EstimateListSerializer(page, many=True).data,
+        })
+
+    async def post(self, request):
+        data = await sync_to_async(self.create)(request)
+        return self.render(data, status=status.HTTP_201_CREATED)
+
+    def create(self, request):
+        serializer = EstimateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(created_by=request.user)
+        return serializer.data
+
+
+class AsyncEstimateDetailView(AsyncAPIView):
+    """Async EstimateDetailView, with the same ETag and If-Match handling."""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
+    throttle_scope = 'user_minute'
+
+    def get_queryset(self):
+        # Allow only the creator to access, update, or delete their estimates
+        return Estimate.objects.filter(created_by_id=self.request.user.pk).with_totals().with_version()
+
+    def archived(self, pk):
+        return ArchivedEstimate.objects.filter(pk=pk, created_by_id=self.request.user.pk)
+
+    async def get(self, request, pk):
+        try:
+            estimate = await self.get_queryset().aget(pk=pk)
+        except Estimate.DoesNotExist:
+            estimate = None
+        archived = estimate is None
+        if archived:
+            # Estimates moved to the archive tables are read from there, lines included
+            estimate = await afind_archived(pk=pk, created_by_id=request.user.pk)
+            if estimate is None:
+                raise NotFound()
+        etag = instance_etag(estimate)
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and etag_matches(if_none_match, etag, weak=True):
+            return self.render(None, status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        if not archived:
+            set_prefetched_lines(estimate, [line async for line in EstimateEquipment.objects.filter(estimate=estimate)])
+        return self.render(EstimateSerializer(estimate).data, headers={'ETag': etag})
+
+    async def put(self, request, pk):
+        return self.render(*await sync_to_async(self.update)(request, pk, partial=False))
+
+    async def patch(self, request, pk):
+        return self.render(*await sync_to_async(self.update)(request, pk, partial=True))
+
+    def update(self, request, pk, partial):
+        with transaction.atomic():
+            estimate = self.get_queryset().prefetch_related('equipments').filter(pk=pk).first()
+            # Writes to an estimate in the archive tables move it back first
+            if estimate is None and restore_estimates(self.archived(pk)):
+                estimate = self.get_queryset().prefetch_related('equipments').filter(pk=pk).first()
+            if estimate is None:
+                raise NotFound()
+            if_match = request.headers.get('If-Match')
+            if if_match:
+                check_if_match(estimate, if_match)
+            serializer = EstimateSerializer(estimate, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        data = serializer.data
+        data['equipment_changes'] = serializer.equipment_changes
+        row = (Estimate.objects.filter(pk=pk).with_version()
+               .values_list('pk', 'updated_at', 'lines_updated_at', 'equipment_updated_at').first())
+        return data, status.HTTP_200_OK, {'ETag': estimate_etag(*row)}
+
+    async def delete(self, request, pk):
+        # One soft delete of the estimate and its lines, restricted to the owner
+        deleted, _ = await Estimate.objects.filter(pk=pk, created_by_id=request.user.pk).adelete()
+        if not deleted and await sync_to_async(restore_estimates)(self.archived(pk)):
+            deleted, _ = await Estimate.objects.filter(pk=pk, created_by_id=request.user.pk).adelete()
+        if not deleted:
+            raise NotFound()
+        return self.render(None, status=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncEstimateChangesView(AsyncAPIView):
+    """
+    Async EstimateChangesView that waits for changes instead of answering an empty page. As a long
+    poll, ``?wait=<seconds>`` (at most ESTIMATE_CHANGES_MAX_WAIT) holds the request until there are
+    entries after ``since``. As server-sent events (``Accept: text/event-stream`` or ``?stream=1``)
+    it streams them as they are recorded, resuming after ``Last-Event-ID``, for
+    ESTIMATE_CHANGES_STREAM_SECONDS; EventSource reconnects on its own. The database is polled every
+    ESTIMATE_CHANGES_POLL_SECONDS, on the event loop, so waiting clients hold no thread.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
+    throttle_scope = 'user_minute'
+
+    async def get(self, request):
+        stream = ('text/event-stream' in request.headers.get('Accept', '')
+                  or request.query_params.get('stream') == '1')
+        params = request.query_params.copy()
+        if stream and request.headers.get('Last-Event-ID'):
+            params['since'] = request.headers['Last-Event-ID']
+        since, limit = feed_params(params)
+        changes = visible_changes(request.user)
+        horizon = await aget_horizon(changes.db)
+        if since < horizon:
+            last = await changes.aaggregate(last=Max('id'))
+            return self.render(gone(horizon, last['last']), status=status.HTTP_410_GONE)
+
+        if stream:
+            response = StreamingHttpResponse(self.events(changes, since, limit), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            # Tells nginx not to buffer the stream
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        try:
+            wait = min(max(float(request.query_params.get('wait', 0)), 0), settings.ESTIMATE_CHANGES_MAX_WAIT)
+        except ValueError:
+            wait = 0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            rows = [row async for row in changes_after(changes, since, limit + 1)]
+            if rows or loop.time() >= deadline:
+                return self.render(feed_page(rows, since, limit, request))
+            await asyncio.sleep(min(settings.ESTIMATE_CHANGES_POLL_SECONDS, deadline - loop.time()))
+
+    async def events(self, changes, since, limit):
+        loop = asyncio.get_running_loop()
+        started = idle_since = loop.time()
+        while True:
+            rows = [row async for row in changes_after(changes, since, limit)]
+            for row in rows:
+                since = row['id']
+                data = self.renderer_class().render(to_entry(row)).decode()
+                yield f'id: {row["id"]}\nevent: {row["action"]}\ndata: {data}\n\n'.encode()
+            now = loop.time()
+            if rows:
+                idle_since = now
+            elif now - idle_since >= settings.ESTIMATE_CHANGES_MAX_WAIT:
+                # A comment, so proxies do not close the idle connection
+                yield b': keep-alive\n\n'
+                idle_since = now
+            if now - started >= settings.ESTIMATE_CHANGES_STREAM_SECONDS:
+                return
+            if len(rows) < limit:
+                await asyncio.sleep(settings.ESTIMATE_CHANGES_POLL_SECONDS)
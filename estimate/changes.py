@@ -0,0 +1,142 @@
+"""
+Change feed of estimates, for clients keeping a local copy (EstimateChangesView and its async, long-poll
+and server-sent events version). Every create, update, soft delete and restore of an estimate and every
+write to its lines appends an EstimateChange in the same transaction; its id is the sequence number
+clients resume from. SQLite serializes writers, so entries become visible in sequence order, and its
+AUTOINCREMENT keeps the ids of compacted entries from being reused.
+
+Writes that do not change what clients see are not recorded: totals and numbers, which are kept in sync
+by the save that is recorded (catalog price changes record the totals they refresh), moves to and from
+the archive tables, purges of rows whose soft delete was recorded, and the rows written by seed_estimates.
+
+compact() keeps the log bounded. Only the newest entry of an estimate is needed to bring a copy up to
+date, so older ones are dropped; deletions are forgotten after settings.ESTIMATE_CHANGES_RETENTION_DAYS,
+which raises the horizon: reads from before it answer 410 Gone, and the client re-syncs from the list.
+"""
+from datetime import timedelta
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Exists, Max, Min, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+
+
+def record_change(estimate, action):
+    """Append an entry for ``estimate``; callers run it in the transaction that changed the estimate."""
+    change_model = apps.get_model('estimate', 'EstimateChange')
+    change_model.objects.using(estimate._state.db).create(estimate_id=estimate.pk,
+                                                          created_by_id=estimate.created_by_id, action=action)
+
+
+def record_changes(queryset, action):
+    """Append an entry for every estimate of an Estimate queryset, with one INSERT ... SELECT."""
+    change_model = apps.get_model('estimate', 'EstimateChange')
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(change_model._meta.get_field(name).column)
+                        for name in ('estimate_id', 'created_by', 'action', 'changed_at'))
+    sql, params = queryset.order_by('pk').values_list('pk', 'created_by_id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(change_model._meta.db_table)} ({columns}) '
+                       f'SELECT changed.*, %s, %s FROM ({sql}) changed',
+                       [action, connection.ops.adapt_datetimefield_value(timezone.now()), *params])
+
+
+def visible_changes(user):
+    """The entries ``user`` may read: superusers see every estimate, everyone else their own."""
+    changes = apps.get_model('estimate', 'EstimateChange').objects.all()
+    if not user.is_superuser:
+        changes = changes.filter(created_by_id=user.pk)
+    return changes
+
+
+def changes_after(changes, since, limit):
+    return changes.filter(id__gt=since).order_by('id').values('id', 'estimate_id', 'action', 'changed_at')[:limit]
+
+
+def feed_params(params):
+    """``since`` and ``limit`` from the query parameters."""
+    values = {}
+    for name, default in (('since', 0), ('limit', DEFAULT_LIMIT)):
+        try:
+            values[name] = int(params.get(name, default))
+        except ValueError:
+            values[name] = -1
+        if values[name] < 0:
+            raise ValidationError({name: ['Must be a non-negative integer.']})
+    return values['since'], max(1, min(values['limit'], MAX_LIMIT))
+
+
+def to_entry(row):
+    return {'seq': row['id'], 'estimate': row['estimate_id'], 'action': row['action'], 'changed_at': row['changed_at']}
+
+
+def feed_page(rows, since, limit, request):
+    """
+    Response body for the ``rows`` (up to ``limit`` + 1) read after ``since``. ``last_seq`` is where
+    the next read starts, ``next`` links to it while more entries are waiting.
+    """
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last_seq = rows[-1]['id'] if rows else since
+    return {
+        'results': [to_entry(row) for row in rows],
+        'last_seq': last_seq,
+        'next': replace_query_param(request.build_absolute_uri(), 'since', last_seq) if more else None,
+    }
+
+
+def gone(horizon, last_seq):
+    """
+    Body of the 410 answered to reads from before the horizon: the client lists its estimates again,
+    then reads the changes after ``last_seq``, the newest entry at the time of the 410.
+    """
+    return {'detail': 'Changes before the horizon were compacted; list the estimates again.',
+            'horizon': horizon, 'last_seq': last_seq or 0}
+
+
+def _horizon_query(using):
+    return apps.get_model('estimate', 'EstimateChangeHorizon').objects.using(using).values_list('seq', flat=True)
+
+
+def get_horizon(using=DEFAULT_DB_ALIAS):
+    return _horizon_query(using).first() or 0
+
+
+async def aget_horizon(using=DEFAULT_DB_ALIAS):
+    """Async get_horizon()."""
+    return await _horizon_query(using).afirst() or 0
+
+
+def compact(retention_days, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Remove the entries followed by a newer one for the same estimate, then the deletions older than
+    ``retention_days``, ``batch_size`` sequence numbers or entries per transaction. Returns the number
+    of entries removed by each step.
+    """
+    change_model = apps.get_model('estimate', 'EstimateChange')
+    changes = change_model.objects.using(using)
+    bounds = changes.aggregate(first=Min('id'), last=Max('id'))
+    superseded = expired = 0
+    if bounds['last'] is not None:
+        newer = changes.filter(estimate_id=OuterRef('estimate_id'), id__gt=OuterRef('id'))
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            with transaction.atomic(using=using):
+                superseded += changes.filter(id__gte=start, id__lt=start + batch_size).filter(Exists(newer)).delete()[0]
+
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    while True:
+        with transaction.atomic(using=using):
+            pks = list(changes.filter(action=change_model.Action.DELETED, changed_at__lt=cutoff)
+                       .order_by('id').values_list('id', flat=True)[:batch_size])
+            if not pks:
+                break
+            expired += changes.filter(pk__in=pks).delete()[0]
+            # Readers that have not seen these entries yet must re-sync
+            apps.get_model('estimate', 'EstimateChangeHorizon').objects.using(using).update_or_create(
+                pk=1, defaults={'seq': pks[-1]})
+    return superseded, expired
@@ -0,0 +1,49 @@
+import hashlib
+from django.utils import timezone
+from django.utils.http import parse_etags
+from utils.exceptions import PreconditionFailed
+from .models import Estimate
+
+
+def estimate_etag(pk, updated_at, lines_updated_at=None, equipment_updated_at=None):
+    """
+    Strong ETag for an estimate representation, built from the estimate's updated_at and the
+    newest updated_at of its lines and their equipment (see EstimateQuerySet.with_version).
+    """
+    parts = [str(pk)] + [value.isoformat() if value else '' for value in
+                         (updated_at, lines_updated_at, equipment_updated_at)]
+    return '"%s"' % hashlib.sha1(':'.join(parts).encode()).hexdigest()
+
+
+def instance_etag(estimate):
+    """ETag of an estimate fetched through EstimateQuerySet.with_version()."""
+    return estimate_etag(estimate.pk, estimate.updated_at,
+                         estimate.lines_updated_at, estimate.equipment_updated_at)
+
+
+def etag_matches(header, etag, weak=False):
+    """
+    Whether an If-Match / If-None-Match header value matches etag. If-None-Match uses the weak
+    comparison (a W/ prefix is ignored), If-Match the strong one.
+    """
+    candidates = parse_etags(header)
+    if '*' in candidates:
+        return True
+    if weak:
+        candidates = [candidate[2:] if candidate.startswith('W/') else candidate for candidate in candidates]
+    return etag in candidates
+
+
+def check_if_match(estimate, if_match):
+    """
+    Optimistic concurrency: raise PreconditionFailed unless the client edited the current version
+    of an estimate fetched through EstimateQuerySet.with_version(). Run it in the write's transaction.
+    """
+    if not etag_matches(if_match, instance_etag(estimate)):
+        raise PreconditionFailed()
+    # Compare-and-swap on updated_at, so a write committed after the estimate was read is
+    # still detected. Every write path saves the estimate, which moves updated_at.
+    claimed = Estimate.objects.filter(pk=estimate.pk, updated_at=estimate.updated_at).update(
+        updated_at=timezone.now())
+    if not claimed:
+        raise PreconditionFailed()
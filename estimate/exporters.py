@@ -0,0 +1,87 @@
+import csv
+from itertools import islice
+from utils.renderers import ORJSONRenderer
+from .models import EstimateEquipment
+from .serializers import EstimateEquipmentSerializer
+
+ESTIMATE_COLUMNS = ('id', 'estimate_number', 'created_at', 'created_by', 'is_archived', 'note', 'total')
+LINE_COLUMNS = ('id', 'equipment', 'quantity', 'price_override', 'created_at')
+CSV_HEADER = [
+    'estimate_id', 'estimate_number', 'created_at', 'created_by', 'is_archived', 'note', 'total',
+    'line_id', 'equipment_id', 'quantity', 'price_override',
+]
+
+
+class Echo:
+    """File-like object whose write() returns the value, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+def iter_estimates(queryset, chunk_size=1000):
+    """
+    Yield (estimate row, line rows) tuples, rows being tuples in ESTIMATE_COLUMNS/LINE_COLUMNS order.
+
+    Estimates are fetched ``chunk_size`` at a time from one cursor (server-side where the database
+    supports it) and the live lines of each chunk with one more query. Plain tuples are used instead
+    of model instances and prefetch_related(), whose per-object overhead dominates large exports.
+    """
+    rows = queryset.order_by('-created_at', 'id').values_list(*ESTIMATE_COLUMNS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        lines = {}
+        for estimate_id, *line in (EstimateEquipment.objects.filter(estimate_id__in=[row[0] for row in chunk])
+                                   .order_by('estimate_id', 'id').values_list('estimate_id', *LINE_COLUMNS)):
+            lines.setdefault(estimate_id, []).append(line)
+        for row in chunk:
+            yield row, lines.get(row[0], ())
+
+
+def export_csv(queryset, chunk_size=1000):
+    """Yield CSV rows, one per line; estimates without lines get a single row with empty line columns."""
+    writer = csv.writer(Echo())
+    # The header goes out before the first query runs
+    yield writer.writerow(CSV_HEADER)
+    for (pk, number, created_at, created_by, is_archived, note, total), lines in iter_estimates(queryset, chunk_size):
+        head = [pk, number, created_at.isoformat(), created_by, is_archived, note or '', total]
+        if not lines:
+            yield writer.writerow(head + [''] * 4)
+        for line_id, equipment_id, quantity, price_override, _ in lines:
+            yield writer.writerow(head + [line_id, equipment_id, quantity,
+                                          '' if price_override is None else price_override])
+
+
+def export_ndjson(queryset, chunk_size=1000):
+    """Yield one JSON document per estimate, with its lines nested as in the detail endpoint."""
+    renderer = ORJSONRenderer()
+    fields = EstimateEquipmentSerializer().fields
+    represent_price, represent_date = fields['price_override'].to_representation, fields['created_at'].to_representation
+    for (pk, number, created_at, created_by, is_archived, note, total), lines in iter_estimates(queryset, chunk_size):
+        yield renderer.render({
+            'id': pk,
+            'estimate_number': number,
+            'note': note,
+            'created_at': represent_date(created_at),
+            'created_by': created_by,
+            'is_archived': is_archived,
+            'total': total,
+            'equipments': [
+                {
+                    'id': line_id,
+                    'equipment': equipment_id,
+                    'quantity': float(quantity),
+                    'price_override': None if price_override is None else represent_price(price_override),
+                    'created_at': represent_date(line_created_at),
+                }
+                for line_id, equipment_id, quantity, price_override, line_created_at in lines
+            ],
+        }) + b'\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,65 @@
+import uuid
+from decimal import Decimal, InvalidOperation
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+# Parameters read by filter_estimates()
+FILTER_PARAMS = ('is_archived', 'created_by', 'created_after', 'created_before', 'min_total', 'max_total')
+
+TRUE_VALUES = {'1', 'true', 'yes'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+
+def _parse_bool(name, value):
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError({name: ['Must be a boolean.']})
+
+
+def _parse_moment(name, value):
+    try:
+        moment = parse_datetime(value) or parse_date(value)
+    except ValueError:  # Well formed, but not a valid date, such as 2020-02-30
+        moment = None
+    if moment is None:
+        raise ValidationError({name: ['Must be an ISO 8601 date or datetime.']})
+    return moment
+
+
+def _parse_uuid(name, value):
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValidationError({name: ['Must be a valid UUID.']})
+
+
+def _parse_decimal(name, value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name: ['Must be a number.']})
+
+
+def filter_estimates(queryset, params):
+    """
+    Apply the query-string filters shared by the estimate list endpoints.
+
+    Supported parameters: is_archived, created_by, created_after, created_before, min_total and
+    max_total. Each one maps to a single indexed column so the filters combine with keyset paging.
+    """
+    if params.get('is_archived'):
+        queryset = queryset.filter(is_archived=_parse_bool('is_archived', params['is_archived']))
+    if params.get('created_by'):
+        queryset = queryset.filter(created_by_id=_parse_uuid('created_by', params['created_by']))
+    if params.get('created_after'):
+        queryset = queryset.filter(created_at__gte=_parse_moment('created_after', params['created_after']))
+    if params.get('created_before'):
+        queryset = queryset.filter(created_at__lt=_parse_moment('created_before', params['created_before']))
+    if params.get('min_total'):
+        queryset = queryset.filter(total__gte=_parse_decimal('min_total', params['min_total']))
+    if params.get('max_total'):
+        queryset = queryset.filter(total__lte=_parse_decimal('max_total', params['max_total']))
+    return queryset
@@ -0,0 +1,159 @@
+import json
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections, router, transaction
+from rest_framework import serializers
+from user.models import User
+from . import rollups
+from .changes import record_changes
+from .models import (Estimate, EstimateChange, EstimateEquipment, calculate_line_amount, calculate_total,
+                     estimate_number_generator)
+from .search import index_on_commit
+from .serializers import EstimateSerializer
+
+
+class EstimateImporter:
+    """
+    Streams NDJSON estimate records into the database.
+
+    Every record is validated with EstimateSerializer; valid ones are written in batches with one
+    bulk_create for the estimates, one bulk_update for their numbers and one bulk_create for their
+    lines, each batch in its own transaction. Input is consumed lazily and results are yielded per
+    record, so memory use depends on the batch size, not on the size of the dump.
+
+    Records may carry ``created_by`` (a user id); otherwise ``default_user`` owns the estimate.
+    """
+
+    def __init__(self, default_user=None, batch_size=500):
+        self.default_user = default_user
+        self.batch_size = batch_size
+        self.counts = {'created': 0, 'failed': 0}
+        self._users = {}
+        # One serializer validates every record: DRF builds the (nested) fields and validators once
+        # instead of once per record, which is most of the cost of a fresh serializer
+        self._serializer = EstimateSerializer(context={})
+        if default_user is not None:
+            self._users[str(default_user.pk)] = default_user
+
+    def run(self, lines):
+        """Yield one result dict per non-blank input line, in input order."""
+        pending = []
+        for line_number, raw in enumerate(lines, start=1):
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8')
+            if not raw.strip():
+                continue
+
+            prepared, error = self.prepare(raw)
+            if error is not None:
+                self.counts['failed'] += 1
+                # Keep results in input order: earlier valid records are written first
+                yield from self.flush(pending)
+                yield {'line': line_number, 'status': 'error', 'errors': error}
+                continue
+
+            pending.append((line_number, prepared))
+            if len(pending) >= self.batch_size:
+                yield from self.flush(pending)
+        yield from self.flush(pending)
+
+    def prepare(self, raw):
+        """Parse and validate one record; returns (validated data, None) or (None, errors)."""
+        try:
+            record = json.loads(raw)
+        except ValueError as exc:
+            return None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+        if not isinstance(record, dict):
+            return None, {'non_field_errors': ['Each line must be a JSON object.']}
+
+        user = self.resolve_user(record.get('created_by'))
+        if user is None:
+            return None, {'created_by': ['Unknown user or no default owner given.']}
+
+        try:
+            validated = self._serializer.run_validation(record)
+        except serializers.ValidationError as exc:
+            return None, exc.detail
+        validated['created_by'] = user
+        return validated, None
+
+    def resolve_user(self, user_id):
+        if user_id is None:
+            return self.default_user
+        key = str(user_id)
+        if key not in self._users:
+            try:
+                self._users[key] = User.objects.filter(pk=user_id).first()
+            except ValidationError:  # Malformed UUID
+                self._users[key] = None
+        return self._users[key]
+
+    def flush(self, pending):
+        if not pending:
+            return
+        batch = list(pending)
+        pending.clear()
+
+        estimates, line_groups = [], []
+        for _, validated in batch:
+            lines = validated.pop('equipments', [])
+            validated['total'] = calculate_total(
+                calculate_line_amount(line['quantity'], line.get('price_override'), line['equipment'].price)
+                for line in lines
+            )
+            estimates.append(Estimate(**validated))
+            line_groups.append(lines)
+
+        try:
+            self.write(estimates, line_groups)
+        except DatabaseError as exc:
+            self.counts['failed'] += len(batch)
+            for line_number, _ in batch:
+                yield {'line': line_number, 'status': 'error', 'errors': {'non_field_errors': [str(exc)]}}
+            return
+
+        self.counts['created'] += len(estimates)
+        for (line_number, _), estimate in zip(batch, estimates):
+            yield {'line': line_number, 'status': 'created', 'id': estimate.id,
+                   'estimate_number': estimate.estimate_number}
+
+    def write(self, estimates, line_groups):
+        # Every statement goes to the database the estimates are written to
+        using = router.db_for_write(Estimate)
+        with transaction.atomic(using=using):
+            self._write(estimates, line_groups, using)
+        index_on_commit([estimate.pk for estimate in estimates], using=using)
+
+    def _write(self, estimates, line_groups, using):
+        connection = connections[using]
+        bulk = connection.features.can_return_rows_from_bulk_insert
+        if bulk:
+            Estimate.objects.using(using).bulk_create(estimates)
+            # Numbers embed the primary keys, which are only known after the INSERT. One prepared
+            # statement run with executemany is much cheaper than bulk_update's CASE expression.
+            for estimate in estimates:
+                estimate.estimate_number = estimate_number_generator(estimate)
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'UPDATE {quote(Estimate._meta.db_table)} SET {quote("estimate_number")} = %s '
+                    f'WHERE {quote("id")} = %s',
+                    [(estimate.estimate_number, estimate.pk) for estimate in estimates],
+                )
+            # save() records the change feed entries of the other branch
+            record_changes(Estimate.all_objects.using(using).filter(pk__in=[estimate.pk for estimate in estimates]),
+                           EstimateChange.Action.CREATED)
+        else:
+            for estimate in estimates:
+                estimate.save(using=using)
+        EstimateEquipment.objects.using(using).bulk_create([
+            EstimateEquipment(estimate=estimate, **line)
+            for estimate, lines in zip(estimates, line_groups)
+            for line in lines
+        ])
+        # save() counted the estimates of the other branch, bulk_create() does not
+        written = Estimate.all_objects.using(using).filter(pk__in=[estimate.pk for estimate in estimates])
+        if bulk:
+            rollups.apply(written)
+        else:
+            rollups.apply_lines(written)
+
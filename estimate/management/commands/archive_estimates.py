@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from estimate.archive import archive_batch
+
+
+class Command(BaseCommand):
+    help = ("Move archived estimates that have not changed for --days, with their lines, from the estimate "
+            "tables to the archive tables. Runs in batches of one transaction each, so it can be stopped "
+            "at any point and run again, e.g. nightly from cron. Archived estimates are still found by "
+            "the detail endpoints, and writing to one moves it back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ESTIMATE_ARCHIVE_AFTER_DAYS,
+                            help="Minimum age, since their last change, of the estimates moved.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of estimates moved per transaction.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database whose estimates are moved.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        started = time.perf_counter()
+        total_estimates = total_lines = 0
+        while True:
+            estimates, lines = archive_batch(cutoff, options['batch_size'], using=options['database'])
+            if not estimates:
+                break
+            total_estimates += estimates
+            total_lines += lines
+            self.stdout.write(f"Moved {total_estimates} estimates, {total_lines} lines")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {total_estimates} estimates and {total_lines} lines moved to the archive tables "
+            f"in {time.perf_counter() - started:.1f}s."))
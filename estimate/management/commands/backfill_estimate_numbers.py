@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from estimate.models import Estimate, estimate_number_generator
+
+
+class Command(BaseCommand):
+    help = "Fill in the stored estimate_number for estimates created before the column existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of estimates updated per transaction.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help="Database to backfill; reads and writes both use it. Defaults to the primary.")
+
+    def handle(self, *args, **options):
+        batch_size, database = options['batch_size'], options['database']
+        # Soft-deleted estimates get a number too, so all_objects is used instead of objects
+        pending = Estimate.all_objects.using(database).filter(estimate_number__isnull=True).order_by('pk')
+        last_pk = 0
+        total = 0
+
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk).only('id', 'created_at', 'created_by_id')[:batch_size])
+            if not batch:
+                break
+
+            for estimate in batch:
+                estimate.estimate_number = estimate_number_generator(estimate)
+            with transaction.atomic(using=database):
+                Estimate.all_objects.using(database).bulk_update(batch, ['estimate_number'])
+
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write(f"Backfilled {total} estimates")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {total} estimates backfilled."))
@@ -0,0 +1,214 @@
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone as dt_timezone
+from unittest.mock import patch
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from estimate.models import Estimate
+from management.models import Equipment
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = ("Benchmark suite for the estimate API. Creates a throwaway test database, fills it with "
+            "seed_estimates, then times create, retrieve, update (small and large line diffs), list, "
+            "export and delete requests through the full middleware stack. Prints the results as JSON "
+            "(latency percentiles, throughput, queries per request); with --baseline, operations that "
+            "became slower than --threshold or run more queries are reported and the command fails.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--estimates', type=int, default=5000, help="Number of seeded estimates.")
+        parser.add_argument('--users', type=int, default=5, help="Number of seeded users.")
+        parser.add_argument('--lines', type=int, default=10, help="Lines on created estimates.")
+        parser.add_argument('--large-lines', type=int, default=200,
+                            help="Lines replaced by the large update.")
+        parser.add_argument('--iterations', type=int, default=100, help="Timed requests per operation.")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed for the data and the requests.")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare against.")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative p50 slowdown reported as a regression, default 0.2 (20%%).")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError("--iterations must be at least 2.")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+        # Same database setup as the test runner, so runs on different commits start from identical data
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with ExitStack() as stack:
+                self.unthrottle(stack)
+                call_command('seed_estimates', users=options['users'], estimates=options['estimates'],
+                             seed=options['seed'], stdout=io.StringIO())
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {'meta': self.meta(options), 'results': results}
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(content + '\n')
+        else:
+            self.stdout.write(content)
+
+        if baseline is not None:
+            regressions = self.compare(baseline['results'], results, options['threshold'])
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+            self.stderr.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    @staticmethod
+    def unthrottle(stack):
+        """Rate limits as high as the throttles allow, counted in a scratch store."""
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(override_settings(THROTTLE_DATABASE=f'{directory}/throttle.sqlite3',
+                                              ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']))
+        stack.enter_context(patch.dict(api_settings.DEFAULT_THROTTLE_RATES,
+                                       {scope: '1000000000/second' for scope in api_settings.DEFAULT_THROTTLE_RATES}))
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        iterations = options['iterations']
+        owner = User.objects.annotate(estimate_count=Count('estimates')).order_by('-estimate_count').first()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(owner).access_token}')
+        equipment_ids = list(Equipment.objects.values_list('pk', flat=True))
+        owned_ids = list(Estimate.objects.filter(created_by=owner).values_list('pk', flat=True))
+
+        def lines(count):
+            return [{'equipment': pk, 'quantity': rng.randint(1, 10)} for pk in rng.sample(equipment_ids, count)]
+
+        list_url = reverse('estimate:estimate-list')
+        detail_url = lambda pk: reverse('estimate:estimate-detail', args=[pk])  # noqa: E731
+        results = {}
+
+        created = []
+        payloads = [{'note': 'Benchmark', 'equipments': lines(options['lines'])} for _ in range(iterations)]
+        results['create'] = self.measure(client, 'post', 201, [(list_url, payload) for payload in payloads],
+                                         on_response=lambda response: created.append(response.data['id']))
+
+        retrieve_ids = [rng.choice(owned_ids) for _ in range(iterations)]
+        results['retrieve'] = self.measure(client, 'get', 200, [(detail_url(pk), None) for pk in retrieve_ids])
+
+        # One line changed out of --lines
+        small = []
+        for pk, payload in zip(created, payloads):
+            changed = [dict(line) for line in payload['equipments']]
+            changed[0]['quantity'] += 1
+            small.append((detail_url(pk), {'equipments': changed}))
+        results['update_small'] = self.measure(client, 'patch', 200, small)
+
+        # Every line replaced by --large-lines new ones
+        large = [(detail_url(pk), {'equipments': lines(options['large_lines'])}) for pk in created]
+        results['update_large'] = self.measure(client, 'patch', 200, large)
+
+        results['list'] = self.measure(client, 'get', 200, [(list_url, None)] * iterations)
+
+        exports = max(2, iterations // 20)
+        results['export'] = self.measure(client, 'get', 200, [(reverse('estimate:estimate-export'),
+                                                               {'format': 'ndjson'})] * exports)
+
+        results['delete'] = self.measure(client, 'delete', 204, [(detail_url(pk), None) for pk in created])
+        return results
+
+    def measure(self, client, method, expected_status, requests, on_response=None):
+        """Send ``requests`` ([(url, data)]) one after another; reads get one untimed warm-up request."""
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        def send(url, data):
+            if method == 'get':
+                response = client.get(url, data)
+            else:
+                response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+
+        if method == 'get':
+            send(*requests[0])
+
+        latencies, query_counts = [], []
+        with connection.execute_wrapper(count):
+            for url, data in requests:
+                queries = 0
+                started = time.perf_counter()
+                response = send(url, data)
+                latencies.append(time.perf_counter() - started)
+                query_counts.append(queries)
+                if response.status_code != expected_status:
+                    raise CommandError(f"{method.upper()} {url} returned {response.status_code}: "
+                                       f"{getattr(response, 'data', '')}")
+                if on_response is not None:
+                    on_response(response)
+
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        return {
+            'requests': len(latencies),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'p50_ms': round(cuts[49] * 1000, 3),
+            'p95_ms': round(cuts[94] * 1000, 3),
+            'p99_ms': round(cuts[98] * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3),
+            'throughput_rps': round(len(latencies) / sum(latencies), 1),
+            'queries': statistics.median_low(query_counts),
+            'queries_max': max(query_counts),
+        }
+
+    def compare(self, baseline, results, threshold):
+        regressions = []
+        for name, current in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            ratio = current['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] else 1
+            line = (f"{name}: p50 {previous['p50_ms']:.2f} -> {current['p50_ms']:.2f} ms ({ratio - 1:+.0%}), "
+                    f"queries {previous['queries']} -> {current['queries']}")
+            if ratio > 1 + threshold or current['queries'] > previous['queries']:
+                regressions.append(name)
+                self.stderr.write(self.style.ERROR(f"REGRESSION {line}"))
+            else:
+                self.stderr.write(line)
+        return regressions
+
+    @staticmethod
+    def meta(options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'options': {name: options[name] for name in
+                        ('estimates', 'users', 'lines', 'large_lines', 'iterations', 'seed')},
+        }
@@ -0,0 +1,73 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = ("HTTP load test: GET requests against a running server with a fixed number of concurrent "
+            "connections, e.g. the sync estimate routes under a WSGI server against the async ones "
+            "under uvicorn (test.asgi). Requests carry an access token for --email.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="URL to request, e.g. http://127.0.0.1:8000/api/v1/estimate/async/")
+        parser.add_argument('--email', required=True, help="User the access token is issued for.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent keep-alive connections.")
+        parser.add_argument('--requests', type=int, default=2000, help="Total number of requests.")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+        token = str(RefreshToken.for_user(user).access_token)
+
+        latencies, statuses, elapsed = asyncio.run(
+            self.run(options['url'], token, options['concurrency'], options['requests']))
+        latencies.sort()
+        self.stdout.write(
+            f"{len(latencies)} requests, concurrency {options['concurrency']}: "
+            f"{len(latencies) / elapsed:,.0f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms, "
+            f"statuses {dict(sorted(statuses.items()))}")
+
+    async def run(self, url, token, concurrency, total):
+        parts = urlsplit(url)
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = (f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                   f'Authorization: Bearer {token}\r\nConnection: keep-alive\r\n\r\n').encode()
+        latencies, statuses = [], {}
+        remaining = iter(range(total))
+
+        async def connection():
+            reader = writer = None
+            for _ in remaining:
+                started = time.perf_counter()
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+                writer.write(request)
+                status = int((await reader.readline()).split()[1])
+                length, close = 0, False
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    name, value = name.lower(), value.strip().lower()
+                    if name == 'content-length':
+                        length = int(value)
+                    elif name == 'connection' and value == 'close':
+                        close = True
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+                # Servers without keep-alive (e.g. gunicorn's sync workers) close after each response
+                if close:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(concurrency)))
+        return latencies, statuses, time.perf_counter() - started
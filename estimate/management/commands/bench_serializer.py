@@ -0,0 +1,59 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from estimate.models import Estimate, EstimateEquipment
+from estimate.serializers import EstimateSerializer, set_prefetched_lines
+from utils.renderers import ORJSONRenderer
+
+
+class Command(BaseCommand):
+    help = ("Micro-benchmark of estimate serialization per 1,000 lines: DRF's default field-by-field "
+            "path and JSONRenderer against the single-pass path and ORJSONRenderer. Uses unsaved "
+            "objects, so no database access is involved.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=1000, help="Number of lines on the estimate.")
+        parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs per variant.")
+
+    def handle(self, *args, **options):
+        estimate = self.build_estimate(options['lines'])
+        serializer = EstimateSerializer(estimate)
+        per_thousand = 1000 / max(options['lines'], 1)
+
+        variants = {
+            'before (DRF fields + JSONRenderer)': (
+                lambda: serializers.ModelSerializer.to_representation(serializer, estimate), JSONRenderer()),
+            'after (single pass + ORJSONRenderer)': (
+                lambda: serializer.to_representation(estimate), ORJSONRenderer()),
+        }
+        for name, (represent, renderer) in variants.items():
+            serialize_ms = self.best_of(represent, options['repeat'])
+            data = represent()
+            render_ms = self.best_of(lambda: renderer.render(data), options['repeat'])
+            self.stdout.write(f"{name}: serialize {serialize_ms * per_thousand:.2f} ms, "
+                              f"render {render_ms * per_thousand:.2f} ms per 1,000 lines")
+
+    @staticmethod
+    def best_of(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    @staticmethod
+    def build_estimate(line_count):
+        now = datetime.now(dt_timezone.utc)
+        estimate = Estimate(id=1, estimate_number='1', note='Benchmark', created_at=now, total=Decimal('0'))
+        estimate.created_by_id = '00000000-0000-0000-0000-000000000000'
+        lines = [
+            EstimateEquipment(id=i, estimate_id=1, equipment_id=i, quantity=i % 7 + 1,
+                              price_override=Decimal('12.50') if i % 2 else None, created_at=now)
+            for i in range(1, line_count + 1)
+        ]
+        set_prefetched_lines(estimate, lines)
+        return estimate
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.throttling import UserRateThrottle
+from utils.throttling import SharedUserRateThrottle, TokenBucketStore
+
+
+def run_store_checks(path, checks, users):
+    """Worker process body: `checks` token bucket checks spread over `users` buckets."""
+    store = TokenBucketStore(path)
+    started = time.perf_counter()
+    for i in range(checks):
+        store.consume(f'throttle_user_{i % users}', capacity=1000000, rate=100)
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ("Throttle checks per second: DRF's UserRateThrottle on the default cache against "
+            "SharedUserRateThrottle, in one process and with several processes sharing the buckets. "
+            "Uses a temporary throttle database, so no configured state is touched.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=20000, help="Checks per process.")
+        parser.add_argument('--users', type=int, default=100, help="Number of distinct users (buckets).")
+        parser.add_argument('--rate', default='100000/day',
+                            help="Rate given to the throttles; DRF keeps one timestamp per request in it.")
+        parser.add_argument('--processes', type=int, default=4, help="Worker processes for the shared run.")
+
+    def handle(self, *args, **options):
+        checks, users = options['checks'], options['users']
+        requests = [SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=i)) for i in range(users)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'throttle.sqlite3')
+            with override_settings(THROTTLE_DATABASE=path):
+                for name, throttle_class in (('UserRateThrottle (default cache)', UserRateThrottle),
+                                             ('SharedUserRateThrottle', SharedUserRateThrottle)):
+                    throttle_class = type(throttle_class.__name__, (throttle_class,), {'rate': options['rate']})
+                    started = time.perf_counter()
+                    for i in range(checks):
+                        throttle_class().allow_request(requests[i % users], None)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"{name}: {checks / elapsed:,.0f} checks/s in one process")
+
+            processes = options['processes']
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                started = time.perf_counter()
+                list(pool.map(run_store_checks, [path] * processes, [checks] * processes, [users] * processes))
+                elapsed = time.perf_counter() - started
+            self.stdout.write(f"SharedUserRateThrottle store: {checks * processes / elapsed:,.0f} checks/s "
+                              f"across {processes} processes")
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from estimate.rollups import check
+
+
+class Command(BaseCommand):
+    help = ("Compare the reporting rollups with the estimate and archive tables and list the rows that "
+            "differ. Exits with an error when any does, so it can alert from cron; rebuild_rollups fixes "
+            "them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help="Number of differing rows listed.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database whose rollups are checked.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        differences = check(using=options['database'])
+        for rollup, key, stored, expected in differences[:options['limit']]:
+            self.stdout.write(f"{rollup.__name__} {', '.join(map(str, key))}: stored {stored}, expected {expected}")
+        if differences:
+            raise CommandError(f"{len(differences)} rollup rows differ from the raw tables.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollups match the raw tables ({time.perf_counter() - started:.1f}s)."))
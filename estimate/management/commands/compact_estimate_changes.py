@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from estimate.changes import compact
+
+
+class Command(BaseCommand):
+    help = ("Keep the estimate change feed bounded: remove the entries followed by a newer one for the same "
+            "estimate, then the deletions older than --days, in batches of one transaction each. Clients "
+            "that have not read the removed deletions get 410 Gone and list their estimates again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ESTIMATE_CHANGES_RETENTION_DAYS,
+                            help="Age after which deletions are removed.")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Number of sequence numbers or entries handled per transaction.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database whose change feed is compacted.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        started = time.perf_counter()
+        superseded, expired = compact(options['days'], options['batch_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {superseded} superseded entries and {expired} expired deletions "
+            f"in {time.perf_counter() - started:.1f}s."))
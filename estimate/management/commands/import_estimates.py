@@ -0,0 +1,42 @@
+import json
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from estimate.importers import EstimateImporter
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = "Stream estimates from an NDJSON file (or - for stdin) into the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to import, or - to read from stdin.")
+        parser.add_argument('--owner', help="Email of the user owning records without created_by.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of estimates written per transaction.")
+        parser.add_argument('--results', action='store_true',
+                            help="Print one NDJSON result per record instead of only the errors.")
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            owner = User.objects.filter(email=options['owner']).first()
+            if owner is None:
+                raise CommandError(f"No user with email {options['owner']}")
+
+        importer = EstimateImporter(default_user=owner, batch_size=options['batch_size'])
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            for result in importer.run(stream):
+                if options['results'] or result['status'] == 'error':
+                    self.stdout.write(json.dumps(result))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        rate = importer.counts['created'] / elapsed if elapsed else 0
+        self.stderr.write(self.style.SUCCESS(
+            f"Created {importer.counts['created']} estimates, {importer.counts['failed']} failed "
+            f"in {elapsed:.2f}s ({rate:.0f} estimates/s)"))
@@ -0,0 +1,65 @@
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+from estimate.purge import enable_incremental_vacuum, purge_batches, release_free_pages
+
+
+class Command(BaseCommand):
+    help = ("Permanently delete soft-deleted rows once they were deleted longer ago than their model's "
+            "retention period (SOFT_DELETE_RETENTION_DAYS), in short primary-key ordered batches, then "
+            "release the freed space on SQLite with incremental vacuum. Progress is checkpointed, so a "
+            "run stopped by --max-seconds or interrupted resumes on the next one; schedule it e.g. nightly.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of rows deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to wait between batches, leaving the database to other writers.")
+        parser.add_argument('--max-seconds', type=float,
+                            help="Stop after this long; the next run carries on from the checkpoint.")
+        parser.add_argument('--no-vacuum', action='store_true', help="Leave the freed pages in the database file.")
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help="SQLite: switch the database to incremental auto_vacuum first. Runs a full "
+                                 "VACUUM, which locks the database until it is done; needed once.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to purge.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        database = options['database']
+        started = time.monotonic()
+        deadline = started + options['max_seconds'] if options['max_seconds'] is not None else None
+        if options['enable_incremental_vacuum']:
+            if connections[database].vendor != 'sqlite':
+                raise CommandError("--enable-incremental-vacuum is for SQLite databases.")
+            enable_incremental_vacuum(database)
+
+        finished = True
+        for label, days in settings.SOFT_DELETE_RETENTION_DAYS.items():
+            model = apps.get_model(label)
+            deleted_before = timezone.now() - timedelta(days=days)
+            total = 0
+            for deleted in purge_batches(model, deleted_before, options['batch_size'], using=database):
+                total += deleted
+                if deadline is not None and time.monotonic() >= deadline:
+                    finished = False
+                    break
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            self.stdout.write(f"{label}: {total} rows deleted (cascades included)")
+            if not finished:
+                self.stdout.write(self.style.WARNING("Stopped at --max-seconds; the next run resumes here."))
+                break
+
+        if not options['no_vacuum']:
+            released = release_free_pages(database)
+            if released is not None:
+                self.stdout.write(f"Released {released} free pages")
+            elif connections[database].vendor == 'sqlite':
+                self.stdout.write(self.style.WARNING(
+                    "The database is not in incremental auto_vacuum mode, so it does not shrink; run once "
+                    "with --enable-incremental-vacuum."))
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - started:.1f}s."))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from estimate.models import EquipmentRollup, EstimateRollup
+from estimate.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = ("Recompute the reporting rollups from the estimate and archive tables, in one transaction, so "
+            "the reports never show a partial result; writes wait until it is done. Needed after loading "
+            "rows behind the write paths' back, or when check_rollups reports differences.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database whose rollups are rebuilt.")
+
+    def handle(self, *args, **options):
+        database = options['database']
+        started = time.perf_counter()
+        rebuild(using=database)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {EstimateRollup.objects.using(database).count()} estimate and "
+            f"{EquipmentRollup.objects.using(database).count()} equipment rollup rows "
+            f"in {time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from estimate.models import Estimate
+from estimate.search import SEARCH_TABLE, create_index, fts_available, index_range
+
+
+class Command(BaseCommand):
+    help = ("Recreate the estimate full-text search index (SQLite FTS5) from the estimates and their "
+            "lines, in batches of consecutive primary keys. Changes made while it runs are indexed by "
+            "the regular upkeep; searches return partial results until it finishes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Number of estimates indexed per transaction.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database whose index is rebuilt.")
+
+    def handle(self, *args, **options):
+        batch_size, database = options['batch_size'], options['database']
+        if not fts_available(database):
+            raise CommandError("The search index needs SQLite with FTS5; other databases search without one.")
+
+        started = time.perf_counter()
+        # Dropped rather than emptied, so changes to the table definition take effect
+        create_index(database, drop=True)
+        live = Estimate.objects.using(database).order_by('pk')
+        last_pk = 0
+        total = 0
+        while True:
+            pks = list(live.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic(using=database):
+                index_range(pks[0], pks[-1], using=database)
+            last_pk = pks[-1]
+            total += len(pks)
+            self.stdout.write(f"Indexed {total} estimates")
+
+        # Merge the b-trees written batch by batch into one, for faster queries
+        with connections[database].cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {total} estimates indexed in {time.perf_counter() - started:.1f}s."))
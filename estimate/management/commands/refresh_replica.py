@@ -0,0 +1,39 @@
+import sqlite3
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from utils.routers import PRIMARY_DATABASE, REPLICA_DATABASE, replica_configured
+
+
+class Command(BaseCommand):
+    help = ("Copy the primary SQLite database onto the replica with SQLite's online backup, the local "
+            "stand-in for replication. Run once, or with --every to keep the replica a few seconds behind.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, help="Keep refreshing, waiting this many seconds in between.")
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError(f"No '{REPLICA_DATABASE}' database configured; set DJANGO_REPLICA_DB.")
+        primary, replica = connections[PRIMARY_DATABASE], connections[REPLICA_DATABASE]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError("Only SQLite databases can be refreshed; other servers replicate on their own.")
+
+        while True:
+            started = time.perf_counter()
+            self.refresh(primary, replica)
+            self.stdout.write(f"Replica refreshed in {(time.perf_counter() - started) * 1000:.0f} ms")
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    @staticmethod
+    def refresh(primary, replica):
+        replica.close()
+        primary.ensure_connection()
+        # A consistent snapshot of the primary, schema included, taken without blocking its writers
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
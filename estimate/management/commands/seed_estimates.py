@@ -0,0 +1,146 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from estimate import rollups
+from estimate.models import (Estimate, EstimateEquipment, calculate_line_amount, calculate_total,
+                             estimate_number_generator)
+from estimate.search import index_range
+from management.cache import bump_catalog_version
+from management.models import Equipment
+from user.models import User
+
+EQUIPMENT_KINDS = ('Camera', 'Light', 'Tripod', 'Microphone', 'Lens', 'Monitor', 'Cable', 'Stand',
+                   'Speaker', 'Projector', 'Mixer', 'Battery', 'Drone', 'Gimbal', 'Screen')
+ESTIMATE_COLUMNS = ('id', 'estimate_number', 'note', 'created_by', 'is_archived', 'total', 'created_at', 'updated_at')
+LINE_COLUMNS = ('estimate', 'equipment', 'quantity', 'price_override', 'created_at', 'updated_at')
+NOTES = ('Wedding', 'Conference', 'Concert', 'Product launch', 'Corporate event', 'Festival', 'Workshop')
+
+
+def insert_rows(model, columns, rows, using):
+    """
+    INSERT ``rows`` (tuples of database-ready values for the fields named in ``columns``) with one
+    executemany(). Skips model instances and per-value field preparation, which dominate bulk_create.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in columns]
+    sql = (f'INSERT INTO {quote(model._meta.db_table)} ({", ".join(quote(field.column) for field in fields)}) '
+           f'VALUES ({", ".join(["%s"] * len(fields))})')
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+class Command(BaseCommand):
+    help = ("Generate synthetic users, an equipment catalog and estimates with lines for load tests and "
+            "benchmarks. Estimates and lines are written with one executemany() INSERT per table and batch, "
+            "with estimate numbers and totals computed up front, so millions of rows take minutes. --seed "
+            "makes the data reproducible.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of users owning the estimates.")
+        parser.add_argument('--equipment', type=int, default=500, help="Size of the equipment catalog.")
+        parser.add_argument('--estimates', type=int, default=10000, help="Number of estimates.")
+        parser.add_argument('--min-lines', type=int, default=1, help="Fewest lines on an estimate.")
+        parser.add_argument('--max-lines', type=int, default=20, help="Most lines on an estimate.")
+        parser.add_argument('--days', type=int, default=365, help="Estimates are spread over this many past days.")
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help="Number of estimates written per transaction.")
+        parser.add_argument('--password', help="Password of the generated users; unusable when omitted.")
+        parser.add_argument('--seed', type=int, help="Random seed, for reproducible data.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to write to.")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['min_lines'] <= options['max_lines'] <= options['equipment']:
+            raise CommandError("Expected 0 <= --min-lines <= --max-lines <= --equipment.")
+        if options['estimates'] and options['users'] < 1:
+            raise CommandError("Estimates need at least one user.")
+        self.rng = random.Random(options['seed'])
+        self.database = options['database']
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        users = self.create_users(options['users'], options['password'])
+        catalog = self.create_equipment(options['equipment'])
+        estimates, lines = self.create_estimates(users, catalog, options)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users, {len(catalog)} equipment, {estimates} estimates and {lines} lines "
+            f"in {elapsed:.1f}s ({(estimates + lines) / elapsed if elapsed else 0:,.0f} rows/s)"))
+
+    def past(self, days):
+        return self.now - timedelta(seconds=self.rng.uniform(0, days * 86400))
+
+    def create_users(self, count, password):
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(password)
+        tag = uuid.uuid4().hex[:8]
+        users = []
+        for number in range(count):
+            users.append(User(email=f'seed-{tag}-{number}@example.com', password=password,
+                              date_joined=self.past(365)))
+        User.objects.using(self.database).bulk_create(users, batch_size=1000)
+        return [user.pk for user in users]
+
+    def create_equipment(self, count):
+        equipment = [
+            Equipment(name=f'{self.rng.choice(EQUIPMENT_KINDS)} {number}',
+                      price=Decimal(self.rng.randrange(500, 500000)) / 100)
+            for number in range(count)
+        ]
+        with transaction.atomic(using=self.database):
+            Equipment.objects.using(self.database).bulk_create(equipment, batch_size=1000)
+            bump_catalog_version(using=self.database)
+        return {item.pk: item.price for item in equipment}
+
+    def create_estimates(self, users, catalog, options):
+        connection = connections[self.database]
+        ops = connection.ops
+        owners = {pk: User._meta.pk.get_db_prep_value(pk, connection) for pk in users}
+        equipment_ids = list(catalog)
+        # Primary keys are assigned here, as the estimate number embeds them and is stored with the row
+        next_id = (Estimate.all_objects.using(self.database).aggregate(last=Max('id'))['last'] or 0) + 1
+        remaining = options['estimates']
+        total_estimates = total_lines = 0
+
+        while remaining:
+            estimates, lines = [], []
+            for estimate_id in range(next_id, next_id + min(remaining, options['batch_size'])):
+                created_by_id = self.rng.choice(users)
+                created_at = self.past(options['days'])
+                timestamp = ops.adapt_datetimefield_value(created_at)
+                number = estimate_number_generator(Estimate(id=estimate_id, created_by_id=created_by_id,
+                                                            created_at=created_at))
+                amounts = []
+                line_count = self.rng.randint(options['min_lines'], options['max_lines'])
+                for equipment_id in self.rng.sample(equipment_ids, line_count):
+                    quantity = float(self.rng.randint(1, 10))
+                    price_override = (Decimal(self.rng.randrange(500, 500000)) / 100
+                                      if self.rng.random() < 0.2 else None)
+                    amounts.append(calculate_line_amount(quantity, price_override, catalog[equipment_id]))
+                    lines.append((estimate_id, equipment_id, quantity,
+                                  ops.adapt_decimalfield_value(price_override, 8, 2), timestamp, timestamp))
+                estimates.append((estimate_id, number, self.rng.choice(NOTES), owners[created_by_id],
+                                  self.rng.random() < 0.1,
+                                  ops.adapt_decimalfield_value(calculate_total(amounts), 12, 2), timestamp, timestamp))
+
+            with transaction.atomic(using=self.database):
+                insert_rows(Estimate, ESTIMATE_COLUMNS, estimates, self.database)
+                insert_rows(EstimateEquipment, LINE_COLUMNS, lines, self.database)
+                index_range(next_id, next_id + len(estimates) - 1, using=self.database)
+                rollups.apply(Estimate.all_objects.using(self.database).filter(
+                    pk__range=(next_id, next_id + len(estimates) - 1)))
+
+            next_id += len(estimates)
+            remaining -= len(estimates)
+            total_estimates += len(estimates)
+            total_lines += len(lines)
+            self.stdout.write(f"Created {total_estimates} estimates, {total_lines} lines")
+        return total_estimates, total_lines
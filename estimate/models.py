@@ -1,30 +1,232 @@
-from django.db import models
+from decimal import Decimal
+from django.db import DEFAULT_DB_ALIAS, models, router, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from management.models import Equipment
 from user.models import User
-from utils.models import BaseModel
+from utils.models import AllObjectsManager, BaseModel, DeletedManager, SoftDeleteManager, SoftDeleteQuerySet
+from . import rollups
+from .changes import record_change, record_changes
+from .search import SEARCH_TABLE, index_estimates, index_on_commit
 
+MONEY_FIELD = DecimalField(max_digits=12, decimal_places=2)
+# Estimate columns whose set-based updates are recorded in the change feed
+FEED_FIELDS = {'note', 'is_archived', 'deleted_at'}
 
-def estimate_number_generator(estimate_id):
-    estimate = Estimate.objects.get(id=estimate_id)
-    estimator_long_id = estimate.created_by.id
+
+def estimate_number_generator(estimate):
+    """
+    Build the human readable estimate number from an already-saved estimate.
+
+    Only local attributes are read (``created_by_id`` instead of ``created_by``),
+    so generating a number never hits the database.
+    """
+    estimator_long_id = estimate.created_by_id
     estimate_date_created = str(estimate.created_at).replace('-', '')[2:8]
     return estimate_date_created + str(estimator_long_id) + str(estimate.id).zfill(3)
 
 
+def line_amount(prefix=''):
+    """SQL expression for one line's amount: quantity * (price_override or the equipment's catalog price)."""
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * Coalesce(F(f'{prefix}price_override'), F(f'{prefix}equipment__price')),
+        output_field=MONEY_FIELD,
+    )
+
+
+def calculate_line_amount(quantity, price_override, price):
+    """Python counterpart of line_amount() for lines that are already in memory; unrounded, like it."""
+    unit_price = price_override if price_override is not None else price
+    return Decimal(str(quantity)) * unit_price
+
+
+def calculate_total(amounts):
+    """
+    Python counterpart of the Sum(line_amount()) aggregates: the line amounts are added unrounded and
+    the sum is rounded to cents once, as MONEY_FIELD does with the aggregate.
+    """
+    return sum(amounts, Decimal('0')).quantize(Decimal('0.01'))
+
+
+class EstimateQuerySet(SoftDeleteQuerySet):
+    def update(self, **kwargs):
+        # Set-based changes clients see (batch updates, soft deletes, restores) go to the change feed,
+        # recorded before the UPDATE, which may take the rows out of the queryset. The other columns
+        # are only updated together with a save, which records its own entry.
+        if not FEED_FIELDS & kwargs.keys():
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            record_changes(self, EstimateChange.Action.DELETED if kwargs.get('deleted_at')
+                           else EstimateChange.Action.UPDATED)
+            if 'is_archived' in kwargs:
+                rollups.apply_archived(self.exclude(is_archived=kwargs['is_archived']), kwargs['is_archived'])
+            # Changes of the note and restores reindex the affected estimates. Soft deletes need
+            # nothing: searches only join live estimates, so the rows left behind are never returned.
+            if 'note' not in kwargs and not ('deleted_at' in kwargs and kwargs['deleted_at'] is None):
+                return super().update(**kwargs)
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+        index_on_commit(pks, using=self.db)
+        return rows
+
+    def hard_delete(self):
+        pks = list(self.values_list('pk', flat=True))
+        # Soft-deleted estimates, all the purge removes, were taken out of the rollups already
+        rollups.apply(self, -1)
+        deleted = super().hard_delete()
+        # Drops their search index rows
+        index_estimates(pks, using=self.db)
+        return deleted
+
+    def _soft_delete(self, now):
+        # Before the UPDATEs, while the estimates and their lines are live
+        rollups.apply(self, -1)
+        return super()._soft_delete(now)
+
+    def _restore(self, now):
+        pks = list(self.filter(deleted_at__isnull=False).values_list('pk', flat=True))
+        restored = super()._restore(now)
+        if pks:
+            rollups.apply(Estimate.all_objects.using(self.db).filter(pk__in=pks))
+        return restored
+
+    def refresh_totals(self):
+        """
+        Recompute the stored total of the live estimates from their live lines with one UPDATE, for writes
+        changing line amounts behind the estimates' back (catalog price changes). The rollups and the
+        change feed follow, and updated_at moves so the estimates' ETags do.
+        """
+        estimates = self.filter(deleted_at__isnull=True)
+        subtotal = (EstimateEquipment.objects.filter(estimate=OuterRef('pk')).order_by().values('estimate')
+                    .annotate(subtotal=Sum(line_amount())).values('subtotal'))
+        with transaction.atomic(using=self.db, savepoint=False):
+            # The lines and their quantities stay as they are, only the totals move
+            rollups.apply_estimates(estimates, -1)
+            rows = estimates.update(
+                total=Coalesce(Round(Subquery(subtotal), 2), Value(Decimal('0')), output_field=MONEY_FIELD),
+                updated_at=timezone.now(),
+            )
+            rollups.apply_estimates(estimates)
+            record_changes(estimates, EstimateChange.Action.UPDATED)
+        return rows
+
+    def with_totals(self):
+        """Annotate line_count and subtotal in the same query, counting only non-deleted lines."""
+        live_lines = Q(equipments__deleted_at__isnull=True)
+        return self.annotate(
+            line_count=Count('equipments', filter=live_lines),
+            subtotal=Coalesce(Sum(line_amount('equipments__'), filter=live_lines), Value(Decimal('0')),
+                              output_field=MONEY_FIELD),
+        )
+
+    def with_version(self):
+        """
+        Annotate the newest updated_at among the lines (soft-deleted ones included, so removals
+        count) and among their equipment, whose price feeds the subtotal. Together with the
+        estimate's own updated_at this identifies the representation; see estimate.etags.
+        """
+        return self.annotate(
+            lines_updated_at=Max('equipments__updated_at'),
+            equipment_updated_at=Max('equipments__equipment__updated_at'),
+        )
+
+
 class Estimate(BaseModel):
+    estimate_number = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False,
+                                       verbose_name=_("Estimate Number"), )
     note = models.TextField(max_length=255, blank=True, null=True, verbose_name=_("Note"), )
     created_by = models.ForeignKey(User, on_delete=models.CASCADE,
                                    blank=False, related_name="estimates", verbose_name=_("Created By"), )
     is_archived = models.BooleanField(default=False, verbose_name=_("Is Archived"), )
+    # Denormalized sum of the line amounts, kept in sync by EstimateSerializer so sorting and
+    # filtering by total is an index scan instead of an aggregate over every line
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'), db_index=True,
+                                editable=False, verbose_name=_("Total"), )
+
+    objects = SoftDeleteManager.from_queryset(EstimateQuerySet)()
+    all_objects = AllObjectsManager.from_queryset(EstimateQuerySet)()
+    deleted_objects = DeletedManager.from_queryset(EstimateQuerySet)()
+    soft_delete_cascade = ('equipments',)
 
     class Meta:
         ordering = ["-created_at"]
+        default_manager_name = "objects"
+        # Partial indexes matching SoftDeleteManager's deleted_at IS NULL filter and the keyset order
+        # used by EstimateCursorPagination, so list pages are index range scans at any depth
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], condition=Q(deleted_at__isnull=True),
+                         name='estimate_live_created_idx'),
+            models.Index(fields=['created_by', '-created_at', 'id'], condition=Q(deleted_at__isnull=True),
+                         name='estimate_owner_created_idx'),
+            models.Index(fields=['is_archived', '-created_at', 'id'], condition=Q(deleted_at__isnull=True),
+                         name='estimate_archived_created_idx'),
+        ]
         verbose_name = _("Estimate")
         verbose_name_plural = _("Estimates")
 
     def __str__(self):
-        return estimate_number_generator(self.id)
+        return self.estimate_number or estimate_number_generator(self)
+
+    def save(self, *args, **kwargs):
+        action = (EstimateChange.Action.CREATED if self._state.adding else
+                  EstimateChange.Action.DELETED if self.deleted_at else EstimateChange.Action.UPDATED)
+        # The change feed entry is written in the transaction of the change. So is the number of a new
+        # estimate: it embeds the primary key, which only exists after the INSERT, so no other connection
+        # can ever observe an estimate without a number, and uniqueness follows from the primary key
+        # itself even under concurrent creates.
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+            if not self.estimate_number:
+                self.estimate_number = estimate_number_generator(self)
+                Estimate.all_objects.using(self._state.db).filter(pk=self.pk).update(
+                    estimate_number=self.estimate_number)
+            if action == EstimateChange.Action.CREATED and self.deleted_at is None:
+                # Symmetric with delete(); the lines are counted by whoever writes them
+                rollup = rollups.RollupDelta()
+                rollup.add(self)
+                rollup.save(using=self._state.db)
+            record_change(self, action)
+        # Reached by every write through the API and by soft deletes and restores of single estimates;
+        # lines written in the same transaction are indexed together with the note
+        index_on_commit([self.pk], using=self._state.db)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or self._state.db
+        with transaction.atomic(using=using):
+            rollups.apply(Estimate.all_objects.using(using).filter(pk=self.pk), -1)
+            return super().delete(using=using, keep_parents=keep_parents)
+
+    def restore(self, using=None):
+        using = using or self._state.db
+        estimates = Estimate.all_objects.using(using).filter(pk=self.pk)
+        # Nothing is subtracted unless the estimate was live, nothing added unless it is restored
+        with transaction.atomic(using=using):
+            rollups.apply(estimates, -1)
+            super().restore(using=using)
+            rollups.apply(estimates)
+
+    def refresh_totals(self):
+        """
+        Recompute line_count/subtotal with one aggregate query and store the result in the total column.
+        Callers are expected to run this inside the transaction that modified the lines.
+        """
+        totals = EstimateEquipment.objects.filter(estimate=self).aggregate(
+            line_count=Count('id'),
+            subtotal=Coalesce(Sum(line_amount()), Value(Decimal('0')), output_field=MONEY_FIELD),
+        )
+        self.line_count = totals['line_count']
+        self.subtotal = totals['subtotal']
+        self.total = totals['subtotal']
+        Estimate.all_objects.filter(pk=self.pk).update(total=self.total)
+        return totals
+
+
+class EstimateEquipmentQuerySet(SoftDeleteQuerySet):
+    def purgeable(self, deleted_before):
+        # Lines of a deleted estimate stay restorable with it and go with its own purge
+        return super().purgeable(deleted_before).filter(estimate__deleted_at__isnull=True)
 
 
 class EstimateEquipment(BaseModel):
@@ -37,11 +239,208 @@ class EstimateEquipment(BaseModel):
     price_override = models.DecimalField(max_digits=8, decimal_places=2,
                                          blank=True, null=True, verbose_name=_("Price Override"), )
 
+    objects = SoftDeleteManager.from_queryset(EstimateEquipmentQuerySet)()
+    all_objects = AllObjectsManager.from_queryset(EstimateEquipmentQuerySet)()
+    deleted_objects = DeletedManager.from_queryset(EstimateEquipmentQuerySet)()
+
     class Meta:
+        default_manager_name = "objects"
         verbose_name = _("Estimate Equipment")
         verbose_name_plural = _("Estimate Equipments")
-        unique_together = (
-        'estimate', 'equipment')  # Ensures the same equipment isn't added multiple times for the same estimate
+        constraints = [
+            # Ensures the same equipment isn't added multiple times for the same estimate; soft-deleted
+            # lines are left out so they can stay in the table as history
+            models.UniqueConstraint(fields=['estimate', 'equipment'], condition=Q(deleted_at__isnull=True),
+                                    name='estimate_equipment_live_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['equipment'], condition=Q(deleted_at__isnull=True),
+                         name='estimate_equipment_live_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.estimate) + " " + self.equipment.name
+
+    def save(self, *args, **kwargs):
+        # Also reached by BaseModel.delete(); bulk writes of lines go with a save of their estimate
+        using = kwargs.get('using') or router.db_for_write(EstimateEquipment, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            # The rollups take all the estimate's lines out and back in, this one as it is now, so a new
+            # line is counted once and the others are not counted again
+            estimate = Estimate.all_objects.using(using).filter(pk=self.estimate_id)
+            rollups.apply_lines(estimate, -1)
+            super().save(*args, **kwargs)
+            rollups.apply_lines(estimate)
+            record_changes(estimate, EstimateChange.Action.UPDATED)
+        index_on_commit([self.estimate_id], using=self._state.db)
+
+
+def refresh_repriced_totals(sender, pks, using=DEFAULT_DB_ALIAS, **kwargs):
+    """equipment_repriced: refresh the totals of the live estimates with lines at the catalog price."""
+    quoting = (EstimateEquipment.objects.using(using).filter(equipment__in=pks, price_override__isnull=True)
+               .values('estimate_id'))
+    Estimate.objects.using(using).filter(pk__in=quoting).refresh_totals()
+
+
+class ArchivedEstimate(BaseModel):
+    """
+    An archived estimate moved out of the estimate table by archive_estimates (see estimate.archive),
+    with the same columns and primary key, so the rows are copied back unchanged when it is restored.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    estimate_number = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False,
+                                       verbose_name=_("Estimate Number"), )
+    note = models.TextField(max_length=255, blank=True, null=True, verbose_name=_("Note"), )
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_estimates",
+                                   verbose_name=_("Created By"), )
+    is_archived = models.BooleanField(default=True, verbose_name=_("Is Archived"), )
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'), editable=False,
+                                verbose_name=_("Total"), )
+    archived_at = models.DateTimeField(verbose_name=_("Archived at"), )
+
+    class Meta:
+        verbose_name = _("Archived Estimate")
+        verbose_name_plural = _("Archived Estimates")
+
+    def __str__(self):
+        return self.estimate_number or str(self.pk)
+
+
+class ArchivedEstimateEquipment(BaseModel):
+    """A line of an ArchivedEstimate, soft-deleted ones included; see ArchivedEstimate."""
+    id = models.BigIntegerField(primary_key=True)
+    estimate = models.ForeignKey(ArchivedEstimate, on_delete=models.CASCADE,
+                                 null=True, related_name="equipments", verbose_name=_("Estimate"), )
+    equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name="archived_estimate_equipments",
+                                  verbose_name=_("Equipment"))
+    quantity = models.FloatField(verbose_name=_("Quantity"), )
+    price_override = models.DecimalField(max_digits=8, decimal_places=2,
+                                         blank=True, null=True, verbose_name=_("Price Override"), )
+
+    class Meta:
+        verbose_name = _("Archived Estimate Equipment")
+        verbose_name_plural = _("Archived Estimate Equipments")
+
+    def __str__(self):
+        return str(self.estimate) + " " + self.equipment.name
+
+
+class PurgeCheckpoint(models.Model):
+    """Primary key of the last row purge_deleted removed from a model, while the model is in progress."""
+    model = models.CharField(max_length=100, primary_key=True, verbose_name=_("Model"), )
+    last_pk = models.CharField(max_length=64, verbose_name=_("Last Primary Key"), )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated at'))
+
+    class Meta:
+        verbose_name = _("Purge Checkpoint")
+        verbose_name_plural = _("Purge Checkpoints")
 
     def __str__(self):
-        return estimate_number_generator(self.estimate.id) + " " + self.equipment.name
+        return f'{self.model} {self.last_pk}'
+
+
+class EstimateChange(models.Model):
+    """
+    Entry of the estimate change feed (see estimate.changes); the id is its sequence number. The
+    estimate is not a foreign key, as entries outlive the rows they describe: archive moves and purges.
+    """
+    class Action(models.TextChoices):
+        CREATED = 'created', _("Created")
+        UPDATED = 'updated', _("Updated")
+        DELETED = 'deleted', _("Deleted")
+
+    estimate_id = models.BigIntegerField(verbose_name=_("Estimate"), )
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", verbose_name=_("Created By"), )
+    action = models.CharField(max_length=16, choices=Action.choices, verbose_name=_("Action"), )
+    changed_at = models.DateTimeField(default=timezone.now, verbose_name=_("Changed at"), )
+
+    class Meta:
+        indexes = [
+            # Reads of one owner's feed, and compaction's lookup of newer entries of an estimate
+            models.Index(fields=['created_by', 'id'], name='estimate_change_owner_idx'),
+            models.Index(fields=['estimate_id', 'id'], name='estimate_change_estimate_idx'),
+        ]
+        verbose_name = _("Estimate Change")
+        verbose_name_plural = _("Estimate Changes")
+
+    def __str__(self):
+        return f'{self.pk} {self.action} {self.estimate_id}'
+
+
+class EstimateChangeHorizon(models.Model):
+    """
+    Single row holding the highest sequence number of the deletions compaction removed; reads of the
+    change feed from before it answer 410 Gone.
+    """
+    seq = models.BigIntegerField(default=0, verbose_name=_("Sequence Number"), )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated at'))
+
+    class Meta:
+        verbose_name = _("Estimate Change Horizon")
+        verbose_name_plural = _("Estimate Change Horizons")
+
+    def __str__(self):
+        return str(self.seq)
+
+
+class EstimateRollup(models.Model):
+    """Live estimates one user created on one day, maintained by the estimate write paths (estimate.rollups)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", verbose_name=_("User"), )
+    day = models.DateField(verbose_name=_("Day"), )
+    estimates = models.IntegerField(default=0, verbose_name=_("Estimates"), )
+    archived = models.IntegerField(default=0, verbose_name=_("Archived"), )
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0'), verbose_name=_("Total"), )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='estimate_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='estimate_rollup_day_idx'),
+        ]
+        verbose_name = _("Estimate Rollup")
+        verbose_name_plural = _("Estimate Rollups")
+
+    def __str__(self):
+        return f'{self.user_id} {self.day}'
+
+
+class EquipmentRollup(models.Model):
+    """Live lines of one equipment on the live estimates created on one day; see EstimateRollup."""
+    equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name="+",
+                                  verbose_name=_("Equipment"), )
+    day = models.DateField(verbose_name=_("Day"), )
+    lines = models.IntegerField(default=0, verbose_name=_("Lines"), )
+    quantity = models.FloatField(default=0, verbose_name=_("Quantity"), )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['equipment', 'day'], name='equipment_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='equipment_rollup_day_idx'),
+        ]
+        verbose_name = _("Equipment Rollup")
+        verbose_name_plural = _("Equipment Rollups")
+
+    def __str__(self):
+        return f'{self.equipment_id} {self.day}'
+
+
+class EstimateSearch(models.Model):
+    """
+    Row of the estimate_search FTS5 table, mapped only so estimate querysets can join it (see
+    estimate.search). The table is created outside migrations and only exists on SQLite.
+    """
+    estimate = models.OneToOneField(Estimate, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                    db_constraint=False, related_name='search_document')
+    note = models.TextField()
+    equipment = models.TextField()
+    # FTS5's hidden columns: the one named after the table takes MATCH queries (`=` is an alias),
+    # rank orders the matches by relevance
+    document = models.TextField(db_column=SEARCH_TABLE)
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = SEARCH_TABLE
@@ -0,0 +1,79 @@
+"""
+Hard deletion of soft-deleted rows once their retention period (settings.SOFT_DELETE_RETENTION_DAYS)
+is over, run by the purge_deleted command.
+
+Rows go in small batches in primary key order, each batch one short transaction, so writers on
+SQLite wait at most one batch. The position is checkpointed in PurgeCheckpoint in the same
+transaction, so a run that is stopped resumes where it left off. Each model's purgeable() keeps
+rows that are still referenced, and models are purged in settings order, rows before the rows they
+reference, so the rows referencing a purged row are gone by the time it is.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from .models import PurgeCheckpoint
+
+# SQLite's auto_vacuum modes
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def purge_batches(model, deleted_before, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Hard-delete the purgeable rows of ``model`` soft-deleted before ``deleted_before``, ``batch_size``
+    rows per transaction, starting after the checkpoint. Yields the number of rows each batch deleted,
+    cascades included; the checkpoint is removed once no rows are left.
+    """
+    label = model._meta.label
+    checkpoint = PurgeCheckpoint.objects.using(using).filter(model=label).first()
+    last_pk = model._meta.pk.to_python(checkpoint.last_pk) if checkpoint else None
+    while True:
+        with transaction.atomic(using=using):
+            candidates = model.deleted_objects.using(using).purgeable(deleted_before)
+            batch = candidates.order_by('pk')
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            pks = list(batch.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                PurgeCheckpoint.objects.using(using).filter(model=label).delete()
+                return
+            # The conditions are checked again by the DELETE, in case a row was restored meanwhile
+            deleted, _ = candidates.filter(pk__in=pks).hard_delete()
+            last_pk = pks[-1]
+            PurgeCheckpoint.objects.using(using).update_or_create(model=label, defaults={'last_pk': str(last_pk)})
+        yield deleted
+
+
+def release_free_pages(using=DEFAULT_DB_ALIAS, step=1000):
+    """
+    Give the pages freed by deletes back to the file system, ``step`` pages per transaction, and
+    truncate the WAL. Only for SQLite databases in incremental auto_vacuum mode (see
+    enable_incremental_vacuum); returns the number of pages released, None for other databases.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return None
+        connection.validate_no_atomic_block()
+        released = 0
+        while True:
+            cursor.execute('PRAGMA freelist_count')
+            free = cursor.fetchone()[0]
+            if not free:
+                break
+            # The pragma releases one page per step of the statement, and execute() only takes the
+            # first step; executescript() runs it to the end
+            connection.connection.executescript(f'PRAGMA incremental_vacuum({min(free, step)})')
+            released += min(free, step)
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return released
+
+
+def enable_incremental_vacuum(using=DEFAULT_DB_ALIAS):
+    """
+    Switch a SQLite database to incremental auto_vacuum. Takes a full VACUUM, which rewrites the whole
+    file under an exclusive lock, so it is done once, when writes can wait.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
@@ -0,0 +1,208 @@
+"""
+Reporting rollups: EstimateRollup (estimates, archived estimates and their total per estimator and day)
+and EquipmentRollup (lines and quantity per equipment and day), read by the reporting endpoints instead
+of aggregating estimates and lines on every load.
+
+Both count the live estimates and their live lines, by the day the estimate was created (in the current
+time zone), whether the estimate is in the estimate tables or was moved to the archive tables, so archive
+moves and restores leave them alone and purges only remove rows already subtracted by their soft delete.
+Every other write adds its difference in its own transaction: set-based writes with one INSERT ...
+SELECT ... ON CONFLICT DO UPDATE per table over the estimates they touch (apply()), EstimateSerializer
+from the rows it has in memory (RollupDelta). Estimate.save() counts the estimates it creates, as
+Estimate.delete() subtracts them, so creators only add the lines they write.
+
+rebuild() recomputes both tables from scratch and check() compares them with the raw tables; see the
+rebuild_rollups and check_rollups commands.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.apps import apps
+from django.core.exceptions import EmptyResultSet
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Longest period, in days, one report covers
+REPORT_MAX_DAYS = 366
+# (rollup column, column of the aggregate query), for the keys and the values of each rollup
+ESTIMATE_KEYS = (('user_id', 'created_by_id'), ('day', 'day'))
+ESTIMATE_VALUES = ('estimates', 'archived', 'total')
+EQUIPMENT_KEYS = (('equipment_id', 'equipment_id'), ('day', 'day'))
+EQUIPMENT_VALUES = ('lines', 'quantity')
+
+
+def _rollup_models():
+    return apps.get_model('estimate', 'EstimateRollup'), apps.get_model('estimate', 'EquipmentRollup')
+
+
+def _upsert(rollup, keys, values, source, params, using):
+    """
+    Add the rows of ``source`` (a SELECT or VALUES statement producing the ``keys`` columns, then one
+    expression per ``values`` column) to the rollup rows with the same keys, creating missing ones.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(rollup._meta.db_table)
+    columns = ', '.join(quote(column) for column in [*keys, *values])
+    updates = ', '.join(f'{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}' for column in values)
+    # WHERE true resolves SQLite's ambiguity between a join's ON and the upsert's ON CONFLICT
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT * FROM ({source}) changes WHERE true '
+                       f'ON CONFLICT ({", ".join(quote(column) for column in keys)}) DO UPDATE SET {updates}',
+                       params)
+
+
+def _estimate_groups(estimates):
+    return (estimates.filter(deleted_at__isnull=True).order_by().annotate(day=TruncDate('created_at'))
+            .values('created_by', 'day')
+            .annotate(estimates=Count('pk'), archived=Count('pk', filter=Q(is_archived=True)), total=Sum('total')))
+
+
+def _line_groups(estimates):
+    line_model = estimates.model._meta.get_field('equipments').related_model
+    live = estimates.filter(deleted_at__isnull=True).values('pk')
+    return (line_model.all_objects.using(estimates.db).filter(deleted_at__isnull=True, estimate__in=live)
+            .order_by().annotate(day=TruncDate('estimate__created_at')).values('equipment', 'day')
+            .annotate(lines=Count('pk'), quantity=Sum('quantity')))
+
+
+def _add_groups(rollup, keys, values, groups, expressions):
+    """Add ``expressions`` ({rollup column: SQL over the columns of ``groups``}) per group to ``rollup``."""
+    quote = connections[groups.db].ops.quote_name
+    try:
+        sql, params = groups.query.sql_with_params()
+    except EmptyResultSet:
+        return
+    select = ', '.join([*(quote(column) for _, column in keys), *(expressions[column] for column in values)])
+    _upsert(rollup, [column for column, _ in keys], values, f'SELECT {select} FROM ({sql}) groups', params,
+            groups.db)
+
+
+def apply(estimates, sign=1):
+    """
+    Add (``sign`` 1) or subtract (-1) the live estimates of a queryset of Estimate or ArchivedEstimate
+    and their live lines to or from the rollups: two statements. Callers subtract before a write that
+    takes estimates or lines out of the rollups and add after one that brings them in.
+    """
+    apply_estimates(estimates, sign)
+    apply_lines(estimates, sign)
+
+
+def apply_estimates(estimates, sign=1):
+    """apply() for the EstimateRollup only, as for writes to estimates that leave their lines alone."""
+    estimate_rollup, _ = _rollup_models()
+    quote = connections[estimates.db].ops.quote_name
+    _add_groups(estimate_rollup, ESTIMATE_KEYS, ESTIMATE_VALUES, _estimate_groups(estimates),
+                {column: f'{sign:d} * {quote(column)}' for column in ESTIMATE_VALUES})
+
+
+def apply_lines(estimates, sign=1):
+    """apply() for the EquipmentRollup only, as for writes to lines that leave the estimates alone."""
+    _, equipment_rollup = _rollup_models()
+    quote = connections[estimates.db].ops.quote_name
+    _add_groups(equipment_rollup, EQUIPMENT_KEYS, EQUIPMENT_VALUES, _line_groups(estimates),
+                {column: f'{sign:d} * {quote(column)}' for column in EQUIPMENT_VALUES})
+
+
+def apply_archived(estimates, archived):
+    """
+    Count the live estimates of an Estimate queryset as archived (``archived`` True) or no longer
+    archived; run before the UPDATE, on the estimates whose is_archived it changes. One statement.
+    """
+    estimate_rollup, _ = _rollup_models()
+    quote = connections[estimates.db].ops.quote_name
+    _add_groups(estimate_rollup, ESTIMATE_KEYS, ESTIMATE_VALUES, _estimate_groups(estimates),
+                {'estimates': '0', 'archived': f'{1 if archived else -1:d} * {quote("estimates")}', 'total': '0'})
+
+
+class RollupDelta:
+    """
+    Rollup changes of estimates whose rows are in memory: add() them as they were before a write with
+    ``sign`` -1 and as they are after it with 1, then save() what is left, at most one statement per
+    rollup. Estimates keep their creator and creation day, so a write only changing the note saves nothing.
+    """
+
+    def __init__(self):
+        self.estimates = defaultdict(lambda: [0, 0, Decimal('0')])
+        self.equipment = defaultdict(lambda: [0, 0.0])
+
+    def add(self, estimate, lines=(), sign=1):
+        """Add a live ``estimate`` and the given live lines (EstimateEquipment rows) of it."""
+        row = self.estimates[(estimate.created_by_id, timezone.localdate(estimate.created_at))]
+        row[0] += sign
+        row[1] += sign * estimate.is_archived
+        row[2] += sign * estimate.total
+        self.add_lines(estimate, lines, sign)
+
+    def add_lines(self, estimate, lines, sign=1):
+        """add() for the lines only, as for an estimate Estimate.save() already counted."""
+        day = timezone.localdate(estimate.created_at)
+        for line in lines:
+            row = self.equipment[(line.equipment_id, day)]
+            row[0] += sign
+            row[1] += sign * line.quantity
+
+    def save(self, using=DEFAULT_DB_ALIAS):
+        estimate_rollup, equipment_rollup = _rollup_models()
+        connection = connections[using]
+        for rollup, keys, values, changes in (
+                (estimate_rollup, ESTIMATE_KEYS, ESTIMATE_VALUES, self.estimates),
+                (equipment_rollup, EQUIPMENT_KEYS, EQUIPMENT_VALUES, self.equipment)):
+            rows = [(*key, *row) for key, row in changes.items() if any(row)]
+            if not rows:
+                continue
+            fields = [rollup._meta.get_field(column.removesuffix('_id')) for column, _ in keys] + \
+                     [rollup._meta.get_field(column) for column in values]
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(rows))
+            params = [field.get_db_prep_save(value, connection) for row in rows for field, value in zip(fields, row)]
+            # VALUES names its columns column1, column2, ...; SELECT * keeps them in order
+            _upsert(rollup, [column for column, _ in keys], values, f'VALUES {placeholders}', params, using)
+        self.__init__()
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Recompute both rollups from the estimate and archive tables, in one transaction."""
+    with transaction.atomic(using=using):
+        for rollup in _rollup_models():
+            rollup.objects.using(using).all().delete()
+        apply(apps.get_model('estimate', 'Estimate').all_objects.using(using).all())
+        apply(apps.get_model('estimate', 'ArchivedEstimate').all_objects.using(using).all())
+
+
+def _normalize(rollup, values):
+    if rollup._meta.model_name == 'estimaterollup':
+        estimates, archived, total = values
+        return estimates, archived, Decimal(total or 0).quantize(Decimal('0.01'))
+    lines, quantity = values
+    return lines, round(quantity or 0, 6)
+
+
+def check(using=DEFAULT_DB_ALIAS):
+    """
+    Compare the rollups with the raw tables. Returns the differences as (rollup, key, stored values,
+    expected values) tuples, empty when they match; rows whose values are all zero count as missing.
+    """
+    estimate_rollup, equipment_rollup = _rollup_models()
+    sources = [apps.get_model('estimate', 'Estimate').all_objects.using(using).all(),
+               apps.get_model('estimate', 'ArchivedEstimate').all_objects.using(using).all()]
+    differences = []
+    for rollup, keys, values, groups in (
+            (estimate_rollup, ESTIMATE_KEYS, ESTIMATE_VALUES, _estimate_groups),
+            (equipment_rollup, EQUIPMENT_KEYS, EQUIPMENT_VALUES, _line_groups)):
+        key_names = [column for column, _ in keys]
+        expected = defaultdict(lambda: [0] * len(values))
+        for source in sources:
+            for row in groups(source):
+                sums = expected[tuple(row[name.removesuffix('_id')] for _, name in keys)]
+                for index, column in enumerate(values):
+                    sums[index] += row[column] or 0
+        expected = {key: _normalize(rollup, sums) for key, sums in expected.items()}
+        stored = {row[:len(keys)]: _normalize(rollup, row[len(keys):])
+                  for row in rollup.objects.using(using).values_list(*key_names, *values).iterator()}
+        for key in sorted(expected.keys() | stored.keys(), key=str):
+            zero = _normalize(rollup, [0] * len(values))
+            found, wanted = stored.get(key, zero), expected.get(key, zero)
+            if found != wanted:
+                differences.append((rollup, key, found, wanted))
+    return differences
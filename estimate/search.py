@@ -0,0 +1,158 @@
+"""
+Full-text search over estimate notes and the names of their line equipment.
+
+On SQLite the text lives in the ``estimate_search`` FTS5 table, one row per live estimate with the
+estimate id as rowid; EstimateSearch maps it for joins. Rows are rewritten from the current data
+after every transaction that saves an estimate (Estimate.save, EstimateQuerySet.update of the note,
+restores, EstimateEquipment.save, renamed equipment, set-based renames included), and
+rebuild_search_index recreates the table.
+Rows of soft-deleted estimates may linger, but searches join live estimates only.
+Other databases, or SQLite builds without FTS5, fall back to unranked LIKE matching.
+"""
+import functools
+import re
+import sqlite3
+from contextlib import closing
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Exists, OuterRef, Q
+
+SEARCH_TABLE = 'estimate_search'
+
+# Note matches weigh twice as much as equipment name matches in the bm25 rank
+RANK = 'bm25(2.0, 1.0)'
+
+# Search terms are the words of the query; each one must match, as a word prefix
+TERM = re.compile(r'\w+')
+
+# pks per statement, below SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+
+@functools.cache
+def _sqlite_has_fts5():
+    # Asked of a private in-memory database, the same library as Django's connections, so the
+    # check is also safe from async code
+    with closing(sqlite3.connect(':memory:')) as connection:
+        return bool(connection.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+
+def fts_available(using=DEFAULT_DB_ALIAS):
+    """Whether the database behind ``using`` is SQLite with FTS5 compiled in."""
+    return connections[using].vendor == 'sqlite' and _sqlite_has_fts5()
+
+
+def create_index(using=DEFAULT_DB_ALIAS, drop=False):
+    """Create the FTS5 table if it does not exist; ``drop`` recreates it empty."""
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        if drop:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            f"note, equipment, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        # Persistent default for the hidden rank column
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', %s)", [RANK])
+
+
+def _document_sql(condition):
+    """INSERT ... SELECT writing the index rows of the live estimates matching ``condition``."""
+    estimate_model = apps.get_model('estimate', 'Estimate')
+    line_model = apps.get_model('estimate', 'EstimateEquipment')
+    equipment_model = apps.get_model('management', 'Equipment')
+    return (
+        f"INSERT INTO {SEARCH_TABLE} (rowid, note, equipment) "
+        f"SELECT e.id, COALESCE(e.note, ''), COALESCE(GROUP_CONCAT(q.name, ' '), '') "
+        f"FROM {estimate_model._meta.db_table} e "
+        f"LEFT JOIN {line_model._meta.db_table} l ON l.estimate_id = e.id AND l.deleted_at IS NULL "
+        f"LEFT JOIN {equipment_model._meta.db_table} q ON q.id = l.equipment_id "
+        f"WHERE e.deleted_at IS NULL AND {condition} "
+        f"GROUP BY e.id"
+    )
+
+
+def index_estimates(pks, using=DEFAULT_DB_ALIAS):
+    """Rewrite the index rows of the estimates ``pks`` from the current data; deleted ones are dropped."""
+    if not fts_available(using):
+        return
+    pks = list(pks)
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(pks), CHUNK_SIZE):
+            chunk = pks[start:start + CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+            cursor.execute(_document_sql(f'e.id IN ({placeholders})'), chunk)
+
+
+def index_range(first_pk, last_pk, using=DEFAULT_DB_ALIAS):
+    """Like index_estimates for every estimate with first_pk <= pk <= last_pk, in two statements."""
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid BETWEEN %s AND %s', [first_pk, last_pk])
+        cursor.execute(_document_sql('e.id BETWEEN %s AND %s'), [first_pk, last_pk])
+
+
+def index_on_commit(pks, using=DEFAULT_DB_ALIAS):
+    """
+    Reindex the estimates ``pks`` once the current transaction commits, from the committed data.
+    A failure is logged instead of failing the write; rebuild_search_index repairs the index.
+    """
+    if pks and fts_available(using):
+        transaction.on_commit(functools.partial(index_estimates, list(pks), using), using=using, robust=True)
+
+
+def search_estimates(queryset, query):
+    """
+    Narrow an Estimate queryset to the estimates matching every word of ``query`` in their note or
+    equipment names, prefix matching included ("cam" finds "Camera"). With FTS5 the result is ordered
+    by relevance, best first; the fallback keeps the newest first.
+    """
+    terms = TERM.findall(query)
+    if not terms:
+        return queryset.none()
+    if fts_available(queryset.db):
+        # Each term quoted, so FTS5 operators in the input are searched for as plain words
+        expression = ' '.join(f'"{term}"*' for term in terms)
+        # `=` on the table's hidden column is FTS5's MATCH
+        return queryset.filter(search_document__document=expression).order_by('search_document__rank', 'id')
+
+    line_model = apps.get_model('estimate', 'EstimateEquipment')
+    for term in terms:
+        lines = line_model.objects.filter(estimate=OuterRef('pk'), equipment__name__icontains=term)
+        queryset = queryset.filter(Q(note__icontains=term) | Exists(lines))
+    return queryset.order_by('-created_at', 'id')
+
+
+def remember_equipment_name(sender, instance, raw=False, using=None, **kwargs):
+    """pre_save of Equipment: note whether the name changes, which changes the estimates' documents."""
+    instance._search_renamed = False
+    if raw or instance.pk is None or not fts_available(using):
+        return
+    previous = sender.all_objects.using(using).filter(pk=instance.pk).values_list('name', flat=True).first()
+    instance._search_renamed = previous is not None and previous != instance.name
+
+
+def _reindex_quoting(equipment_pks, using):
+    """Reindex the estimates with a live line of the given equipment."""
+    line_model = apps.get_model('estimate', 'EstimateEquipment')
+    index_on_commit(line_model.objects.using(using).filter(equipment__in=equipment_pks)
+                    .values_list('estimate_id', flat=True).distinct(), using=using)
+
+
+def reindex_equipment_estimates(sender, instance, created=False, raw=False, using=None, **kwargs):
+    """post_save of Equipment: reindex the estimates with a live line of a renamed equipment."""
+    if getattr(instance, '_search_renamed', False):
+        _reindex_quoting([instance.pk], using)
+
+
+def reindex_renamed_equipment(sender, pks, using=DEFAULT_DB_ALIAS, **kwargs):
+    """equipment_renamed, sent by set-based renames of Equipment: like reindex_equipment_estimates."""
+    if fts_available(using):
+        _reindex_quoting(pks, using)
+
+
+def create_index_after_migrate(using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate: the FTS5 table is not a Django model table, so it is created here."""
+    create_index(using)
@@ -1,33 +1,164 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Estimate, EstimateEquipment
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from management.cache import equipment_catalog
+from management.models import Equipment
+from utils.instrumentation import TimedSerializerMixin
+from .filters import FILTER_PARAMS
+from .models import Estimate, EstimateEquipment, calculate_line_amount, calculate_total
+from .rollups import RollupDelta
+
+# Line attributes that can change on an existing EstimateEquipment row
+LINE_FIELDS = ('quantity', 'price_override')
+# EstimateSerializer keys that both represent the estimate's lines
+LINE_KEYS = ('equipments', 'equipments_list')
+# Most estimates one EstimateBatchView request changes
+BATCH_MAX_ESTIMATES = 10000
+
+
+def set_prefetched_lines(estimate, lines):
+    """Fill the estimate.equipments prefetch cache with lines that are already in memory."""
+    queryset = estimate.equipments.all()
+    queryset._result_cache = list(lines)
+    queryset._prefetch_done = True
+    estimate._prefetched_objects_cache = {'equipments': queryset}
+
+
+class EquipmentField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that resolves equipment from the map EstimateSerializer loads from the
+    equipment catalog cache, instead of running one lookup per line.
+    """
+
+    def to_internal_value(self, data):
+        equipments = self.context.get('equipments_by_id')
+        if equipments is None:
+            return super().to_internal_value(data)
+        try:
+            pk = Equipment._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in equipments:
+            self.fail('does_not_exist', pk_value=data)
+        return equipments[pk]
 
 
 class EstimateEquipmentSerializer(serializers.ModelSerializer):
+    equipment = EquipmentField(queryset=Equipment.objects.all())
+
     class Meta:
         model = EstimateEquipment
         fields = ['id', 'equipment', 'quantity', 'price_override', 'created_at']
         read_only_fields = ['id', 'created_at']
 
+    def represent_many(self, lines):
+        """
+        Read-only fast path for a list of lines: builds plain dicts directly from the model attributes.
+        The output is identical to to_representation(), without the per-field get_attribute/SkipField
+        machinery DRF runs for every line.
+        """
+        price_override = self.fields['price_override'].to_representation
+        created_at = self.fields['created_at'].to_representation
+        return [
+            {
+                'id': line.id,
+                'equipment': line.equipment_id,
+                'quantity': float(line.quantity),
+                'price_override': None if line.price_override is None else price_override(line.price_override),
+                'created_at': created_at(line.created_at),
+            }
+            for line in lines
+        ]
+
 
-class EstimateSerializer(serializers.ModelSerializer):
+class EstimateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     equipments = EstimateEquipmentSerializer(many=True, required=False)
     equipments_list = EstimateEquipmentSerializer(source='equipments', many=True, required=False)
+    # Filled from EstimateQuerySet.with_totals() on reads and from Estimate.refresh_totals() on writes
+    line_count = serializers.IntegerField(read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Estimate
-        fields = ['id', 'note', 'created_at', 'created_by', 'is_archived', 'equipments', 'equipments_list']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'estimate_number', 'note', 'created_at', 'created_by', 'is_archived',
+                  'line_count', 'subtotal', 'total', 'equipments', 'equipments_list']
+        # created_by always comes from the authenticated user in the view
+        read_only_fields = ['id', 'estimate_number', 'created_at', 'created_by', 'total']
+
+    def to_representation(self, instance):
+        # equipments and equipments_list expose the same relation: the lines are turned into dicts once
+        # through the fast path and that result is reused for both keys
+        ret = {}
+        lines = None
+        for field in self._readable_fields:
+            if field.field_name in LINE_KEYS:
+                if lines is None:
+                    lines = field.child.represent_many(instance.equipments.all())
+                ret[field.field_name] = lines
+                continue
+
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
+
+    def to_internal_value(self, data):
+        # Resolve every referenced equipment through the catalog cache (at most one query for the misses)
+        # before the nested lines are validated
+        equipment_ids = set()
+        for key in LINE_KEYS:
+            lines = data.get(key) if hasattr(data, 'get') else None
+            if isinstance(lines, list):
+                for line in lines:
+                    if isinstance(line, dict):
+                        try:
+                            equipment_ids.add(Equipment._meta.pk.to_python(line.get('equipment')))
+                        except DjangoValidationError:
+                            pass  # Reported by EquipmentField
+        self.context['equipments_by_id'] = equipment_catalog.get_many(equipment_ids - {None}) if equipment_ids else {}
+        return super().to_internal_value(data)
 
+    def validate_equipments(self, value):
+        equipment_ids = [line['equipment'].pk for line in value]
+        if len(equipment_ids) != len(set(equipment_ids)):
+            raise serializers.ValidationError("The same equipment can only be added once to an estimate.")
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
         equipments_data = validated_data.pop('equipments', [])
+        # The equipment rows were loaded during validation, so the total of a new estimate is known
+        # before the INSERT and no aggregate query is needed afterwards
+        validated_data['total'] = calculate_total(
+            calculate_line_amount(line['quantity'], line.get('price_override'), line['equipment'].price)
+            for line in equipments_data
+        )
         estimate = Estimate.objects.create(**validated_data)
 
-        self._create_or_update_equipments(estimate, equipments_data)
+        self.equipment_changes = self._create_or_update_equipments(estimate, equipments_data, is_new=True)
 
+        # Estimate.save() counted the estimate itself
+        rollup = RollupDelta()
+        rollup.add_lines(estimate, estimate.equipments.all())
+        rollup.save(using=estimate._state.db)
         return estimate
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        equipments_data = validated_data.pop('equipments', [])
+        # None means the request did not send lines at all (e.g. a PATCH of the note), which leaves them alone
+        equipments_data = validated_data.pop('equipments', None)
+        # The lines only count when they are sent; otherwise they are the same before and after
+        rollup = RollupDelta()
+        if equipments_data is not None:
+            # Loaded once, for the rollups and the diff below
+            set_prefetched_lines(instance, list(instance.equipments.all()))
+        rollup.add(instance, instance.equipments.all() if equipments_data is not None else (), sign=-1)
 
         # Update instance fields
         for attr, value in validated_data.items():
@@ -35,19 +166,105 @@ class EstimateSerializer(serializers.ModelSerializer):
         instance.save()
 
         # Handle equipments
+        self.equipment_changes = {'created': 0, 'updated': 0, 'deleted': 0}
         if equipments_data is not None:
-            instance.equipments.all().delete()
-            self._create_or_update_equipments(instance, equipments_data)
-
-        return instance
+            self.equipment_changes = self._create_or_update_equipments(instance, equipments_data)
 
+        rollup.add(instance, instance.equipments.all() if equipments_data is not None else ())
+        rollup.save(using=instance._state.db)
         return instance
 
-    def _create_or_update_equipments(self, estimate, equipments_data):
+    def _create_or_update_equipments(self, estimate, equipments_data, is_new=False):
         """
         Helper method to create or update equipment instances associated with the estimate.
+
+        Incoming lines are matched to the existing ones by equipment, so at most one INSERT, one UPDATE
+        and one DELETE statement run, and lines whose values did not change are not written at all.
+        Returns the number of rows created, updated and deleted.
         """
-        equipment_instances = [
-            EstimateEquipment(estimate=estimate, **equipment_data) for equipment_data in equipments_data
-        ]
-        EstimateEquipment.objects.bulk_create(equipment_instances)  # Bulk create for efficiency
+        current = [] if is_new else list(estimate.equipments.all())
+        existing = {line.equipment_id: line for line in current}
+        now = timezone.now()
+        to_create, to_update = [], []
+
+        for equipment_data in equipments_data:
+            line = existing.pop(equipment_data['equipment'].pk, None)
+            if line is None:
+                to_create.append(EstimateEquipment(estimate=estimate, **equipment_data))
+                continue
+
+            changed = False
+            for attr in LINE_FIELDS:
+                value = equipment_data.get(attr)
+                if getattr(line, attr) != value:
+                    setattr(line, attr, value)
+                    changed = True
+            if changed:
+                line.updated_at = now  # bulk_update skips auto_now
+                to_update.append(line)
+
+        if to_create:
+            EstimateEquipment.objects.bulk_create(to_create)  # Bulk create for efficiency
+        if to_update:
+            EstimateEquipment.objects.bulk_update(to_update, [*LINE_FIELDS, 'updated_at'])
+        deleted = 0
+        if existing:
+            # Whatever is left in existing was not sent and is removed in a single set-based statement
+            deleted, _ = EstimateEquipment.objects.filter(pk__in=[line.pk for line in existing.values()]).delete()
+
+        changes = {'created': len(to_create), 'updated': len(to_update), 'deleted': deleted}
+        # Serve the response from the rows in memory instead of reading them back
+        removed = {line.pk for line in existing.values()}
+        set_prefetched_lines(estimate, sorted(
+            [line for line in current if line.pk not in removed] + to_create, key=lambda line: line.pk))
+        if is_new:
+            estimate.line_count = len(to_create)
+            estimate.subtotal = estimate.total
+        elif any(changes.values()):
+            # Keep the denormalized total in the same transaction as the line writes
+            estimate.refresh_totals()
+        return changes
+
+
+class EstimateListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Estimate
+        fields = ['id', 'estimate_number', 'note', 'created_at', 'created_by', 'is_archived', 'total']
+        read_only_fields = fields
+
+
+class EstimateBatchChangesSerializer(serializers.ModelSerializer):
+    """Fields EstimateBatchView can set on many estimates at once."""
+
+    class Meta:
+        model = Estimate
+        fields = ['note', 'is_archived']
+
+
+class EstimateBatchSerializer(serializers.Serializer):
+    """
+    Request of EstimateBatchView: an action applied to the estimates listed in ``ids`` or matching
+    ``filter`` (the list endpoint's query parameters), with ``changes`` for updates.
+    """
+    action = serializers.ChoiceField(choices=['update', 'delete'])
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False,
+                                max_length=BATCH_MAX_ESTIMATES)
+    filter = serializers.DictField(required=False, allow_empty=False)
+    changes = EstimateBatchChangesSerializer(required=False)
+
+    def validate_filter(self, value):
+        # Unknown keys would be ignored by filter_estimates(), widening the batch to every estimate
+        unknown = sorted(set(value) - set(FILTER_PARAMS))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown filters: {', '.join(unknown)}. "
+                                              f"Use: {', '.join(FILTER_PARAMS)}.")
+        return {key: str(item) for key, item in value.items()}
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Send either ids or filter.")
+        if attrs['action'] == 'update' and not attrs.get('changes'):
+            raise serializers.ValidationError({'changes': ["Required for updates, with at least one field."]})
+        if attrs['action'] == 'delete' and 'changes' in attrs:
+            raise serializers.ValidationError({'changes': ["Not used by deletes."]})
+        return attrs
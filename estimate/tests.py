@@ -1,8 +1,32 @@
-from estimate.models import Estimate
+import csv
+from django.core.management import call_command
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from datetime import timedelta
+from django.core.management.base import CommandError
+from estimate.models import (ArchivedEstimate, ArchivedEstimateEquipment, EquipmentRollup, Estimate, EstimateChange,
+                             EstimateChangeHorizon, EstimateEquipment, EstimateRollup, EstimateSearch,
+                             PurgeCheckpoint, estimate_number_generator)
+from estimate.rollups import check
+from estimate.serializers import EstimateSerializer
+from io import StringIO
+import json
+import os
+import tempfile
+from management.cache import equipment_catalog
+from management.models import Equipment
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ModelSerializer
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 from unittest.mock import patch
 from user.models import User
+from utils.admin import CappedCountPaginator
+from utils.renderers import ORJSONRenderer
 
 
 # ==========================
@@ -134,3 +158,1279 @@ class EstimateDetailTestCase(APITestCase):
         response = self.client.delete(self.url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Estimate.objects.count(), 0)
+
+
+class EstimateNumberTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+
+    def test_number_assigned_on_create(self):
+        estimate = Estimate.objects.create(note='Numbered', created_by=self.user)
+        estimate.refresh_from_db()
+        self.assertTrue(estimate.estimate_number.endswith(str(estimate.id).zfill(3)))
+        self.assertIn(str(self.user.id), estimate.estimate_number)
+
+    def test_str_does_not_query(self):
+        estimate = Estimate.objects.create(note='Numbered', created_by=self.user)
+        estimate = Estimate.objects.get(pk=estimate.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(estimate), estimate.estimate_number)
+
+    def test_retrieve_by_number(self):
+        estimate = Estimate.objects.create(note='Numbered', created_by=self.user)
+        response = self.client.get(f'/api/v1/estimate/by-number/{estimate.estimate_number}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], estimate.id)
+        self.assertEqual(response.data['estimate_number'], estimate.estimate_number)
+
+    def test_backfill_command(self):
+        estimate = Estimate.objects.create(note='Legacy', created_by=self.user)
+        Estimate.all_objects.filter(pk=estimate.pk).update(estimate_number=None)
+        call_command('backfill_estimate_numbers', batch_size=1, stdout=StringIO())
+        estimate.refresh_from_db()
+        self.assertIsNotNone(estimate.estimate_number)
+
+
+class EstimateTotalsTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('25.50'))
+
+    def test_create_stores_total(self):
+        data = {
+            'note': 'With lines',
+            'created_by': self.user.id,
+            'equipments': [
+                {'equipment': self.drill.id, 'quantity': 3},
+                {'equipment': self.saw.id, 'quantity': 2, 'price_override': '20.00'},
+            ],
+        }
+        response = self.client.post('/api/v1/estimate/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['line_count'], 2)
+        self.assertEqual(Decimal(response.data['total']), Decimal('70.00'))
+        self.assertEqual(Estimate.objects.get(pk=response.data['id']).total, Decimal('70.00'))
+
+    def test_detail_annotates_totals(self):
+        estimate = Estimate.objects.create(created_by=self.user)
+        EstimateEquipment.objects.create(estimate=estimate, equipment=self.saw, quantity=4)
+        estimate.refresh_totals()
+        response = self.client.get(f'/api/v1/estimate/{estimate.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['line_count'], 1)
+        self.assertEqual(Decimal(response.data['subtotal']), Decimal('102.00'))
+        self.assertEqual(Estimate.objects.filter(total__gt=100).count(), 1)
+
+    def test_total_rounds_the_sum_once(self):
+        # Two half cents add up to a cent, as in the SQL aggregate
+        cent = Equipment.objects.create(name='Screw', price=Decimal('0.01'))
+        response = self.client.post('/api/v1/estimate/', {'equipments': [
+            {'equipment': cent.id, 'quantity': 0.5}, {'equipment': self.drill.id, 'quantity': 0.5,
+                                                      'price_override': '0.01'}]}, format='json')
+        estimate = Estimate.objects.with_totals().get(pk=response.data['id'])
+        self.assertEqual((estimate.total, estimate.subtotal), (Decimal('0.01'), Decimal('0.01')))
+
+    def test_price_changes_refresh_totals(self):
+        response = self.client.post('/api/v1/estimate/', {'equipments': [
+            {'equipment': self.drill.id, 'quantity': 2},
+            {'equipment': self.saw.id, 'quantity': 1, 'price_override': '20.00'}]}, format='json')
+        estimate_id, etag = response.data['id'], self.client.get(f'/api/v1/estimate/{response.data["id"]}/')['ETag']
+        overridden = self.client.post('/api/v1/estimate/', {'equipments': [
+            {'equipment': self.saw.id, 'quantity': 1, 'price_override': '20.00'}]}, format='json').data['id']
+
+        self.drill.price = Decimal('50.00')
+        self.drill.save()
+        estimate = Estimate.objects.with_totals().get(pk=estimate_id)
+        self.assertEqual((estimate.total, estimate.subtotal), (Decimal('120.00'), Decimal('120.00')))
+        response = self.client.get('/api/v1/estimate/', {'min_total': 100})
+        self.assertEqual([row['id'] for row in response.data['results']], [estimate_id])
+        self.assertNotEqual(self.client.get(f'/api/v1/estimate/{estimate_id}/')['ETag'], etag)
+
+        # Set-based; the overridden line keeps its price
+        Equipment.objects.filter(pk__in=[self.drill.pk, self.saw.pk]).update(price=Decimal('5.00'))
+        estimate = Estimate.objects.with_totals().get(pk=estimate_id)
+        self.assertEqual((estimate.total, estimate.subtotal), (Decimal('30.00'), Decimal('30.00')))
+        self.assertEqual(Estimate.objects.get(pk=overridden).total, Decimal('20.00'))
+        self.assertEqual(self.client.get('/api/v1/estimate/', {'min_total': 100}).data['results'], [])
+        self.assertEqual(check(), [])
+
+
+class EstimateListTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.other: User = User.objects.create(email='other@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/v1/estimate/'
+
+    def test_pages_follow_cursor_without_gaps(self):
+        created = [Estimate.objects.create(note=f'Estimate {i}', created_by=self.user) for i in range(5)]
+        Estimate.objects.create(note='Not mine', created_by=self.other)
+
+        seen = []
+        url = f'{self.url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [estimate.id for estimate in reversed(created)])
+
+    def test_filters(self):
+        Estimate.objects.create(note='Active', created_by=self.user)
+        archived = Estimate.objects.create(note='Archived', created_by=self.user, is_archived=True)
+        response = self.client.get(self.url, {'is_archived': 'true'})
+        self.assertEqual([row['id'] for row in response.data['results']], [archived.id])
+
+        response = self.client.get(self.url, {'created_after': '2000-01-01', 'created_before': '2000-01-02'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_visibility_by_role(self):
+        mine = Estimate.objects.create(note='Mine', created_by=self.user)
+        theirs = Estimate.objects.create(note='Theirs', created_by=self.other)
+
+        # Everyone else only lists their own estimates, whatever created_by asks for
+        response = self.client.get(self.url)
+        self.assertEqual([row['id'] for row in response.data['results']], [mine.id])
+        response = self.client.get(self.url, {'created_by': self.other.pk})
+        self.assertEqual(response.data['results'], [])
+
+        # Superusers list every estimator's, and created_by narrows them down to one
+        admin = User.objects.create(email='admin@example.com', is_superuser=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(self.url)
+        self.assertEqual([row['id'] for row in response.data['results']], [theirs.id, mine.id])
+        response = self.client.get(self.url, {'created_by': self.other.pk})
+        self.assertEqual([row['id'] for row in response.data['results']], [theirs.id])
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.url, {'created_by': 'not-a-uuid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for value in ('2020-02-30', '2020-02-30T10:00'):
+            response = self.client.get(self.url, {'created_after': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EstimateEquipmentDiffTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('25.50'))
+        self.ladder = Equipment.objects.create(name='Ladder', price=Decimal('5.00'))
+        self.estimate: Estimate = Estimate.objects.create(note='Initial note', created_by=self.user)
+        self.drill_line = EstimateEquipment.objects.create(estimate=self.estimate, equipment=self.drill, quantity=1)
+        self.saw_line = EstimateEquipment.objects.create(estimate=self.estimate, equipment=self.saw, quantity=2)
+        self.url = f'/api/v1/estimate/{self.estimate.id}/'
+
+    def test_only_changed_lines_are_written(self):
+        data = {'equipments': [
+            {'equipment': self.drill.id, 'quantity': 1},
+            {'equipment': self.saw.id, 'quantity': 5},
+            {'equipment': self.ladder.id, 'quantity': 2},
+        ]}
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['equipment_changes'], {'created': 1, 'updated': 1, 'deleted': 0})
+
+        drill_line = EstimateEquipment.objects.get(pk=self.drill_line.pk)
+        self.assertEqual(drill_line.updated_at, self.drill_line.updated_at)
+        self.assertEqual(EstimateEquipment.objects.get(pk=self.saw_line.pk).quantity, 5)
+        self.estimate.refresh_from_db()
+        self.assertEqual(self.estimate.total, Decimal('147.50'))
+
+    def test_missing_lines_are_removed(self):
+        data = {'equipments': [{'equipment': self.drill.id, 'quantity': 1}]}
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.data['equipment_changes'], {'created': 0, 'updated': 0, 'deleted': 1})
+        self.assertEqual(list(self.estimate.equipments.values_list('pk', flat=True)), [self.drill_line.pk])
+
+    def test_patch_without_equipments_keeps_lines(self):
+        response = self.client.patch(self.url, {'note': 'Updated note'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['equipment_changes'], {'created': 0, 'updated': 0, 'deleted': 0})
+        self.assertEqual(self.estimate.equipments.count(), 2)
+
+    def test_duplicate_equipment_rejected(self):
+        data = {'equipments': [
+            {'equipment': self.drill.id, 'quantity': 1},
+            {'equipment': self.drill.id, 'quantity': 2},
+        ]}
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SoftDeleteTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.estimates = [Estimate.objects.create(note=f'Estimate {i}', created_by=self.user) for i in range(3)]
+        for estimate in self.estimates:
+            EstimateEquipment.objects.create(estimate=estimate, equipment=self.drill, quantity=1)
+
+    def test_queryset_delete_cascades_in_one_update_per_model(self):
+        # One UPDATE per model, the INSERT ... SELECT of the change feed entries and one upsert per rollup
+        with self.assertNumQueries(5):
+            count, per_model = Estimate.objects.filter(note__startswith='Estimate').delete()
+        self.assertEqual(count, 6)
+        self.assertEqual(per_model, {'estimate.Estimate': 3, 'estimate.EstimateEquipment': 3})
+        self.assertEqual(Estimate.objects.count(), 0)
+        self.assertEqual(EstimateEquipment.objects.count(), 0)
+        self.assertEqual(Estimate.all_objects.count(), 3)
+
+    def test_restore_only_brings_back_lines_deleted_with_the_estimate(self):
+        estimate = self.estimates[0]
+        saw = Equipment.objects.create(name='Saw', price=Decimal('5.00'))
+        removed_earlier = EstimateEquipment.objects.create(estimate=estimate, equipment=saw, quantity=1)
+        removed_earlier.delete()
+
+        estimate.delete()
+        Estimate.deleted_objects.filter(pk=estimate.pk).restore()
+        self.assertTrue(Estimate.objects.filter(pk=estimate.pk).exists())
+        self.assertEqual(list(estimate.equipments.values_list('equipment', flat=True)), [self.drill.pk])
+
+    def test_user_delete_cascades_to_estimates_and_lines(self):
+        self.user.delete()
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(Estimate.objects.count(), 0)
+        self.assertEqual(EstimateEquipment.objects.count(), 0)
+
+    def test_soft_deleted_line_can_be_added_again(self):
+        estimate = self.estimates[0]
+        estimate.equipments.all().delete()
+        EstimateEquipment.objects.create(estimate=estimate, equipment=self.drill, quantity=2)
+        self.assertEqual(EstimateEquipment.all_objects.filter(estimate=estimate).count(), 2)
+
+
+class QueryBudgetMixin:
+    """Fail when an endpoint runs more queries than its budget, so N+1 regressions break CI."""
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = [query['sql'] for query in context.captured_queries
+                    if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        self.assertLessEqual(len(executed), budget, '\n'.join(executed))
+
+
+class EstimateQueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.catalog = [Equipment.objects.create(name=f'Equipment {i}', price=Decimal('10.00')) for i in range(20)]
+
+    def make_estimate(self, line_count):
+        estimate = Estimate.objects.create(note='Budget', created_by=self.user)
+        EstimateEquipment.objects.bulk_create([
+            EstimateEquipment(estimate=estimate, equipment=equipment, quantity=1)
+            for equipment in self.catalog[:line_count]
+        ])
+        return estimate
+
+    def lines(self, line_count, quantity=1):
+        return [{'equipment': equipment.id, 'quantity': quantity} for equipment in self.catalog[:line_count]]
+
+    def test_create(self):
+        for line_count in (1, 20):
+            with self.assertQueryBudget(7):
+                response = self.client.post('/api/v1/estimate/', {
+                    'note': 'Budget', 'created_by': self.user.id, 'equipments': self.lines(line_count),
+                }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data['equipments']), line_count)
+
+    def test_list(self):
+        for line_count in (1, 20):
+            self.make_estimate(line_count)
+        with self.assertQueryBudget(1):
+            response = self.client.get('/api/v1/estimate/')
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_retrieve(self):
+        for line_count in (1, 20):
+            estimate = self.make_estimate(line_count)
+            with self.assertQueryBudget(2):
+                response = self.client.get(f'/api/v1/estimate/{estimate.id}/')
+            self.assertEqual(len(response.data['equipments']), line_count)
+            with self.assertQueryBudget(2):
+                self.client.get(f'/api/v1/estimate/by-number/{estimate.estimate_number}/')
+
+    def test_update(self):
+        for line_count in (1, 20):
+            estimate = self.make_estimate(line_count)
+            with self.assertQueryBudget(5):
+                self.client.patch(f'/api/v1/estimate/{estimate.id}/', {'note': 'Changed'}, format='json')
+            with self.assertQueryBudget(11):
+                response = self.client.patch(f'/api/v1/estimate/{estimate.id}/',
+                                             {'equipments': self.lines(line_count, quantity=2)}, format='json')
+            self.assertEqual(response.data['equipment_changes']['updated'], line_count)
+
+    def test_delete(self):
+        for line_count in (1, 20):
+            estimate = self.make_estimate(line_count)
+            with self.assertQueryBudget(6):
+                response = self.client.delete(f'/api/v1/estimate/{estimate.id}/')
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class EstimateSerializationTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.estimate: Estimate = Estimate.objects.create(note='Initial note', created_by=self.user)
+        for i, price_override in enumerate([None, Decimal('12.5')]):
+            equipment = Equipment.objects.create(name=f'Equipment {i}', price=Decimal('10.00'))
+            EstimateEquipment.objects.create(estimate=self.estimate, equipment=equipment, quantity=1.5,
+                                             price_override=price_override)
+
+    def test_single_pass_matches_drf_fields(self):
+        estimate = Estimate.objects.with_totals().prefetch_related('equipments').get(pk=self.estimate.pk)
+        serializer = EstimateSerializer(estimate)
+        self.assertEqual(serializer.data, ModelSerializer.to_representation(serializer, estimate))
+        self.assertEqual(serializer.data['equipments'], serializer.data['equipments_list'])
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        estimate = Estimate.objects.with_totals().prefetch_related('equipments').get(pk=self.estimate.pk)
+        data = EstimateSerializer(estimate).data
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+
+class EstimateConditionalRequestTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.estimate: Estimate = Estimate.objects.create(note='Initial note', created_by=self.user)
+        EstimateEquipment.objects.create(estimate=self.estimate, equipment=self.drill, quantity=1)
+        self.url = f'/api/v1/estimate/{self.estimate.id}/'
+
+    def test_if_none_match_returns_304_with_one_query(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_line_change_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.estimate.equipments.all().delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'note': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # A second writer still holding the old ETag is rejected
+        response = self.client.patch(self.url, {'note': 'Lost update'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.estimate.refresh_from_db()
+        self.assertEqual(self.estimate.note, 'First')
+
+
+class EstimateImportTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com', is_superuser=True)
+        self.customer: User = User.objects.create(email='customer@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+
+    def ndjson(self, *records):
+        return '\n'.join(record if isinstance(record, str) else json.dumps(record) for record in records)
+
+    def test_import_endpoint_streams_results(self):
+        body = self.ndjson(
+            {'note': 'First', 'equipments': [{'equipment': self.drill.id, 'quantity': 2}]},
+            'not json',
+            {'note': 'Second', 'created_by': str(self.customer.id)},
+            {'note': 'Bad line', 'equipments': [{'equipment': 999, 'quantity': 1}]},
+        )
+        response = self.client.post('/api/v1/estimate/import/?batch_size=1', body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'created', 'error'])
+        self.assertEqual([result['line'] for result in results], [1, 2, 3, 4])
+
+        first = Estimate.objects.get(pk=results[0]['id'])
+        self.assertEqual(first.created_by, self.user)
+        self.assertEqual(first.total, Decimal('20.00'))
+        self.assertEqual(first.estimate_number, results[0]['estimate_number'])
+        self.assertEqual(Estimate.objects.get(pk=results[2]['id']).created_by, self.customer)
+
+    def test_import_requires_superuser(self):
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post('/api/v1/estimate/import/', '{}', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as dump:
+            dump.write(self.ndjson(*({'note': f'Estimate {i}'} for i in range(5))))
+        self.addCleanup(os.remove, dump.name)
+        call_command('import_estimates', dump.name, owner=self.customer.email, batch_size=2,
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Estimate.objects.filter(created_by=self.customer).count(), 5)
+
+
+class SeedEstimatesTestCase(APITestCase):
+    def seed(self, **options):
+        call_command('seed_estimates', users=3, equipment=20, estimates=25, min_lines=0, max_lines=5,
+                     batch_size=10, seed=7, stdout=StringIO(), **options)
+
+    def test_seeded_rows(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Equipment.objects.count(), 20)
+        self.assertEqual(Estimate.objects.count(), 25)
+
+        for estimate in Estimate.objects.with_totals():
+            self.assertEqual(estimate.estimate_number, estimate_number_generator(estimate))
+            self.assertEqual(estimate.total, estimate.subtotal)
+            self.assertLessEqual(estimate.line_count, 5)
+        # The stored rows are served by the API like any other estimate
+        estimate = Estimate.objects.with_totals().filter(line_count__gt=0).first()
+        self.client.force_authenticate(user=estimate.created_by)
+        response = self.client.get(f'/api/v1/estimate/{estimate.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['equipments']), estimate.line_count)
+
+    def test_seed_is_reproducible(self):
+        self.seed()
+        first = list(Estimate.objects.order_by('pk').values_list('note', 'total', 'is_archived'))
+        self.seed()
+        second = list(Estimate.objects.order_by('pk').values_list('note', 'total', 'is_archived'))[25:]
+        self.assertEqual(first, second)
+
+
+class EstimateSearchTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.camera = Equipment.objects.create(name='Cinema Camera', price=Decimal('100.00'))
+        self.tripod = Equipment.objects.create(name='Tripod', price=Decimal('10.00'))
+
+    def create(self, note, *equipment):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/estimate/', {
+                'note': note, 'equipments': [{'equipment': item.id, 'quantity': 1} for item in equipment],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def search(self, query, **params):
+        response = self.client.get('/api/v1/estimate/', {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.data['results']]
+
+    def test_ranked_search(self):
+        wedding = self.create('Wedding shoot', self.tripod)
+        camera_note = self.create('Camera rental', self.tripod)
+        camera_line = self.create('Concert', self.camera)
+
+        self.assertEqual(self.search('wedding'), [wedding])
+        # Word prefixes of notes and equipment names, note matches first
+        self.assertEqual(self.search('cam'), [camera_note, camera_line])
+        self.assertEqual(self.search('tripod WEDD'), [wedding])
+        self.assertEqual(self.search('"unbalanced OR'), [])
+        self.assertEqual(self.search('***'), [])
+
+        # Other users' estimates are not searched
+        self.client.force_authenticate(user=User.objects.create(email='other@example.com'))
+        self.assertEqual(self.search('wedding'), [])
+
+    def test_index_follows_changes(self):
+        estimate_id = self.create('Wedding', self.tripod)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/v1/estimate/{estimate_id}/', {
+                'note': 'Birthday', 'equipments': [{'equipment': self.camera.id, 'quantity': 1}],
+            }, format='json')
+        self.assertEqual(self.search('wedding'), [])
+        self.assertEqual(self.search('birthday camera'), [estimate_id])
+        self.assertEqual(self.search('tripod'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.camera.name = 'Drone'
+            self.camera.save()
+        self.assertEqual(self.search('drone'), [estimate_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Equipment.objects.filter(pk=self.camera.pk).update(name='Crane')
+        self.assertEqual(self.search('drone'), [])
+        self.assertEqual(self.search('crane'), [estimate_id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/v1/estimate/{estimate_id}/')
+        self.assertEqual(self.search('birthday'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Estimate.deleted_objects.filter(pk=estimate_id).restore()
+        self.assertEqual(self.search('birthday'), [estimate_id])
+
+    def test_pagination(self):
+        ids = [self.create(f'Wedding {number}', self.tripod) for number in range(3)]
+        response = self.client.get('/api/v1/estimate/', {'q': 'wedding', 'page_size': 2})
+        found = [row['id'] for row in response.data['results']]
+        found += [row['id'] for row in self.client.get(response.data['next']).data['results']]
+        self.assertEqual(sorted(found), ids)
+        self.assertEqual(self.client.get('/api/v1/estimate/', {'q': 'wedding', 'cursor': 'bad'}).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_command(self):
+        estimate_id = self.create('Wedding', self.tripod)
+        # Written without the upkeep hooks
+        Estimate.objects.create(note='Unindexed', created_by=self.user)
+        self.assertEqual(self.search('unindexed'), [])
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(len(self.search('unindexed')), 1)
+        self.assertEqual(self.search('wedding tripod'), [estimate_id])
+
+    def test_fallback_without_fts(self):
+        wedding = self.create('Wedding shoot', self.tripod)
+        concert = self.create('Concert', self.camera)
+        with patch('estimate.search.fts_available', return_value=False):
+            self.assertEqual(self.search('cam'), [concert])
+            self.assertEqual(self.search('tripod WEDD'), [wedding])
+            self.assertEqual(self.search('shoot concert'), [])
+
+
+class EstimateArchiveTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('25.00'))
+
+    def create(self, note, archived=True, days=365):
+        response = self.client.post('/api/v1/estimate/', {'note': note, 'equipments': [
+            {'equipment': self.drill.id, 'quantity': 2}, {'equipment': self.saw.id, 'quantity': 1}]}, format='json')
+        estimate_id = response.data['id']
+        # A line removed earlier moves along with the rest, as history
+        self.client.patch(f'/api/v1/estimate/{estimate_id}/', {
+            'equipments': [{'equipment': self.drill.id, 'quantity': 2}]}, format='json')
+        Estimate.objects.filter(pk=estimate_id).update(
+            is_archived=archived, updated_at=timezone.now() - timedelta(days=days))
+        return estimate_id
+
+    def archive(self, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_estimates', stdout=StringIO(), **options)
+
+    def test_archive_moves_old_archived_estimates(self):
+        old = [self.create('Old'), self.create('Older')]
+        recent = self.create('Recent', days=10)
+        active = self.create('Active', archived=False)
+        deleted = self.create('Deleted')
+        Estimate.objects.filter(pk=deleted).delete()
+
+        # One estimate per transaction, like a run interrupted after the first batch and started again
+        self.archive(days=180, batch_size=1)
+
+        self.assertEqual(sorted(ArchivedEstimate.objects.values_list('pk', flat=True)), old)
+        self.assertEqual(set(Estimate.all_objects.values_list('pk', flat=True)), {recent, active, deleted})
+        self.assertFalse(EstimateEquipment.all_objects.filter(estimate__in=old).exists())
+        self.assertEqual(ArchivedEstimateEquipment.all_objects.filter(estimate__in=old).count(), 4)
+        self.assertEqual(ArchivedEstimateEquipment.objects.filter(estimate__in=old).count(), 2)
+
+        self.archive(days=180)
+        self.assertEqual(ArchivedEstimate.objects.count(), 2)
+
+    def test_detail_lookups_find_archived_estimates(self):
+        estimate_id = self.create('Old')
+        before = self.client.get(f'/api/v1/estimate/{estimate_id}/')
+        number = before.data['estimate_number']
+        self.archive()
+
+        self.assertFalse(Estimate.all_objects.filter(pk=estimate_id).exists())
+        for url in (f'/api/v1/estimate/{estimate_id}/', f'/api/v1/estimate/by-number/{number}/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, before.data)
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/v1/estimate/{estimate_id}/', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(f'/api/v1/estimate/async/{estimate_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['subtotal'], before.data['subtotal'])
+        self.assertEqual(response['ETag'], before['ETag'])
+
+        # Still the owner's only
+        self.client.force_authenticate(user=User.objects.create(email='other@example.com'))
+        self.assertEqual(self.client.get(f'/api/v1/estimate/{estimate_id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(f'/api/v1/estimate/by-number/{number}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.patch(f'/api/v1/estimate/{estimate_id}/', {'is_archived': False},
+                                           format='json').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(ArchivedEstimate.objects.filter(pk=estimate_id).exists())
+
+    def test_unarchive_moves_back(self):
+        estimate_id = self.create('Old wedding')
+        self.archive()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/v1/estimate/{estimate_id}/', {'is_archived': False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['is_archived'])
+        self.assertEqual(response.data['line_count'], 1)
+        self.assertFalse(ArchivedEstimate.objects.exists())
+        self.assertFalse(ArchivedEstimateEquipment.all_objects.exists())
+        self.assertEqual(EstimateEquipment.all_objects.filter(estimate=estimate_id).count(), 2)
+        # Back in the list and the search index
+        self.assertEqual([row['id'] for row in self.client.get('/api/v1/estimate/').data['results']], [estimate_id])
+        self.assertEqual([row['id'] for row in self.client.get('/api/v1/estimate/', {'q': 'wedding'}).data['results']],
+                         [estimate_id])
+
+    def test_async_writes_move_back(self):
+        edited, deleted = self.create('Edited'), self.create('Deleted')
+        self.archive()
+
+        response = self.client.patch(f'/api/v1/estimate/async/{edited}/', {'note': 'Changed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Estimate.objects.get(pk=edited).is_archived)
+        self.assertEqual(self.client.delete(f'/api/v1/estimate/async/{deleted}/').status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertTrue(Estimate.deleted_objects.filter(pk=deleted).exists())
+        self.assertFalse(ArchivedEstimate.objects.exists())
+
+
+class PurgeDeletedTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('25.00'))
+
+    def days_ago(self, days):
+        return timezone.now() - timedelta(days=days)
+
+    def estimate(self, user=None, deleted_days_ago=None, *equipment):
+        with self.captureOnCommitCallbacks(execute=True):
+            estimate = Estimate.objects.create(note='Purge', created_by=user or self.user)
+            for item in equipment or (self.drill,):
+                EstimateEquipment.objects.create(estimate=estimate, equipment=item, quantity=1)
+        if deleted_days_ago is not None:
+            estimate.delete()
+            # One timestamp, as a soft delete leaves on the estimate and its lines
+            deleted_at = self.days_ago(deleted_days_ago)
+            Estimate.all_objects.filter(pk=estimate.pk).update(deleted_at=deleted_at)
+            EstimateEquipment.all_objects.filter(estimate=estimate).update(deleted_at=deleted_at)
+        return estimate
+
+    def purge(self, **options):
+        output = StringIO()
+        call_command('purge_deleted', stdout=output, **options)
+        return output.getvalue()
+
+    def test_purge_respects_retention_and_references(self):
+        old = self.estimate(None, 100)
+        recent = self.estimate(None, 10)
+        live = self.estimate(None, None, self.drill, self.saw)
+        # Lines removed from a live estimate, long ago and recently
+        EstimateEquipment.objects.filter(estimate=live, equipment=self.drill).delete()
+        EstimateEquipment.all_objects.filter(estimate=live, equipment=self.drill).update(deleted_at=self.days_ago(40))
+        EstimateEquipment.objects.filter(estimate=live, equipment=self.saw).delete()
+
+        # Deleted long ago, but still quoted by a live estimate's line
+        Equipment.objects.filter(pk=self.saw.pk).update(deleted_at=self.days_ago(400))
+        unused = Equipment.objects.create(name='Unused', price=Decimal('1.00'))
+        Equipment.objects.filter(pk=unused.pk).update(deleted_at=self.days_ago(400))
+
+        # Users deleted long ago, with their estimates, one of which was deleted recently on its own
+        gone = User.objects.create(email='gone@example.com')
+        gone_estimate = self.estimate(gone, 400)
+        waiting = User.objects.create(email='waiting@example.com')
+        self.estimate(waiting, 10)
+        User.all_objects.filter(pk__in=[gone.pk, waiting.pk]).update(deleted_at=self.days_ago(400))
+
+        output = self.purge(batch_size=1)
+
+        self.assertEqual(set(Estimate.all_objects.values_list('pk', flat=True)),
+                         {recent.pk, live.pk} | set(Estimate.all_objects.filter(created_by=waiting).values_list('pk', flat=True)))
+        self.assertFalse(EstimateEquipment.all_objects.filter(estimate__in=[old.pk, gone_estimate.pk]).exists())
+        self.assertEqual(list(EstimateEquipment.all_objects.filter(estimate=live).values_list('equipment', flat=True)),
+                         [self.saw.pk])
+        self.assertEqual(set(Equipment.all_objects.values_list('pk', flat=True)), {self.drill.pk, self.saw.pk})
+        self.assertEqual(set(User.all_objects.values_list('pk', flat=True)), {self.user.pk, waiting.pk})
+        # Search index rows go with the estimates
+        self.assertFalse(EstimateSearch.objects.filter(pk__in=[old.pk, gone_estimate.pk]).exists())
+        self.assertTrue(EstimateSearch.objects.filter(pk=recent.pk).exists())
+        self.assertFalse(PurgeCheckpoint.objects.exists())
+        # Lines of deleted estimates went with their estimate, the line pass only took the live estimate's
+        self.assertIn('estimate.EstimateEquipment: 1 rows deleted', output)
+        self.assertIn('estimate.Estimate: 4 rows deleted', output)
+
+    def test_restore_after_line_retention(self):
+        estimate = self.estimate(None, 40, self.drill, self.saw)
+        self.purge()
+        Estimate.all_objects.get(pk=estimate.pk).restore()
+        self.assertEqual(Estimate.objects.with_totals().get(pk=estimate.pk).subtotal, Decimal('35.00'))
+
+    def test_users_with_archived_estimates_are_kept(self):
+        estimate = self.estimate()
+        Estimate.objects.filter(pk=estimate.pk).update(is_archived=True, updated_at=self.days_ago(365))
+        call_command('archive_estimates', stdout=StringIO())
+        self.user.delete()
+        User.all_objects.filter(pk=self.user.pk).update(deleted_at=self.days_ago(400))
+        self.purge()
+        self.assertTrue(User.all_objects.filter(pk=self.user.pk).exists())
+        self.assertTrue(ArchivedEstimate.objects.filter(pk=estimate.pk).exists())
+
+    @override_settings(SOFT_DELETE_RETENTION_DAYS={'estimate.Estimate': 90})
+    def test_resumes_from_checkpoint(self):
+        earlier = self.estimate()
+        estimates = [self.estimate(None, 100) for _ in range(3)]
+
+        output = self.purge(batch_size=1, max_seconds=0)
+        self.assertIn('Stopped at --max-seconds', output)
+        self.assertEqual(set(Estimate.all_objects.values_list('pk', flat=True)),
+                         {earlier.pk, estimates[1].pk, estimates[2].pk})
+        self.assertEqual(PurgeCheckpoint.objects.get(model='estimate.Estimate').last_pk, str(estimates[0].pk))
+
+        # Rows before the checkpoint are left for the next pass
+        earlier.delete()
+        Estimate.all_objects.filter(pk=earlier.pk).update(deleted_at=self.days_ago(100))
+        self.purge(batch_size=1)
+        self.assertEqual(list(Estimate.all_objects.values_list('pk', flat=True)), [earlier.pk])
+        self.assertFalse(PurgeCheckpoint.objects.exists())
+        self.purge()
+        self.assertFalse(Estimate.all_objects.exists())
+
+
+class EstimateBatchTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.other: User = User.objects.create(email='other@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+
+    def batch(self, payload):
+        return self.client.post('/api/v1/estimate/batch/', payload, format='json')
+
+    def test_update_by_ids(self):
+        mine = Estimate.objects.bulk_create([Estimate(note='Mine', created_by=self.user) for _ in range(500)])
+        theirs = Estimate.objects.create(note='Theirs', created_by=self.other)
+        deleted = Estimate.objects.create(note='Deleted', created_by=self.user)
+        deleted.delete()
+        ids = [estimate.pk for estimate in mine] + [theirs.pk, deleted.pk, 999999]
+
+        # Owned ids, the archive tables for the others, the change feed entries, the archived count of the
+        # rollups, one UPDATE
+        with self.assertQueryBudget(5):
+            response = self.batch({'action': 'update', 'ids': ids, 'changes': {'is_archived': True}})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 500)
+        self.assertEqual([row['id'] for row in response.data['results']], ids)
+        self.assertEqual({row['status'] for row in response.data['results'][:500]}, {'updated'})
+        self.assertEqual({row['status'] for row in response.data['results'][500:]}, {'not_found'})
+        self.assertEqual(Estimate.objects.filter(is_archived=True).count(), 500)
+        self.assertFalse(Estimate.all_objects.filter(pk__in=[theirs.pk, deleted.pk], is_archived=True).exists())
+        self.assertGreater(Estimate.objects.get(pk=mine[0].pk).updated_at, mine[0].updated_at)
+
+    def test_note_update_is_searchable(self):
+        estimate = Estimate.objects.create(note='Wedding', created_by=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.batch({'action': 'update', 'ids': [estimate.pk], 'changes': {'note': 'Concert'}})
+        self.assertEqual(response.data['results'], [{'id': estimate.pk, 'status': 'updated'}])
+        results = self.client.get('/api/v1/estimate/', {'q': 'concert'}).data['results']
+        self.assertEqual([row['id'] for row in results], [estimate.pk])
+
+    def test_delete_by_filter(self):
+        archived = Estimate.objects.create(note='Old', created_by=self.user, is_archived=True)
+        EstimateEquipment.objects.create(estimate=archived, equipment=self.drill, quantity=1)
+        active = Estimate.objects.create(note='Active', created_by=self.user)
+        theirs = Estimate.objects.create(note='Theirs', created_by=self.other, is_archived=True)
+
+        with self.assertQueryBudget(6):
+            response = self.batch({'action': 'delete', 'filter': {'is_archived': True}})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'id': archived.pk, 'status': 'deleted'}])
+        self.assertEqual(set(Estimate.objects.values_list('pk', flat=True)), {active.pk, theirs.pk})
+        self.assertFalse(EstimateEquipment.objects.filter(estimate=archived).exists())
+
+        with patch('estimate.views.BATCH_MAX_ESTIMATES', 1):
+            Estimate.objects.create(note='Another', created_by=self.user)
+            response = self.batch({'action': 'update', 'filter': {'is_archived': 'false'},
+                                   'changes': {'is_archived': True}})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Estimate.objects.filter(is_archived=True, created_by=self.user).exists())
+
+    def test_archive_tables(self):
+        estimate = Estimate.objects.create(note='Old', created_by=self.user, is_archived=True)
+        Estimate.objects.filter(pk=estimate.pk).update(updated_at=timezone.now() - timedelta(days=365))
+        call_command('archive_estimates', stdout=StringIO())
+
+        response = self.batch({'action': 'update', 'ids': [estimate.pk], 'changes': {'is_archived': False}})
+        self.assertEqual(response.data['results'], [{'id': estimate.pk, 'status': 'updated'}])
+        self.assertFalse(Estimate.objects.get(pk=estimate.pk).is_archived)
+        self.assertFalse(ArchivedEstimate.objects.exists())
+
+    def test_validation(self):
+        for payload in (
+            {'action': 'update', 'changes': {'is_archived': True}},
+            {'action': 'update', 'ids': [1], 'filter': {'is_archived': True}, 'changes': {'is_archived': True}},
+            {'action': 'update', 'ids': [1]},
+            {'action': 'update', 'ids': [1], 'changes': {}},
+            {'action': 'delete', 'ids': [1], 'changes': {'note': 'x'}},
+            {'action': 'delete', 'filter': {'archived': True}},
+            {'action': 'delete', 'ids': []},
+            {'action': 'restore', 'ids': [1]},
+        ):
+            self.assertEqual(self.batch(payload).status_code, status.HTTP_400_BAD_REQUEST, payload)
+
+
+@override_settings(ESTIMATE_CHANGES_POLL_SECONDS=0.01, ESTIMATE_CHANGES_MAX_WAIT=0.05,
+                   ESTIMATE_CHANGES_STREAM_SECONDS=0.05)
+class EstimateChangeFeedTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.other: User = User.objects.create(email='other@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('5.00'))
+
+    def feed(self, **params):
+        return self.client.get('/api/v1/estimate/changes/', params)
+
+    def actions(self, response):
+        return [(row['estimate'], row['action']) for row in response.data['results']]
+
+    def test_writes_are_recorded_in_order(self):
+        estimate_id = self.client.post('/api/v1/estimate/', {
+            'note': 'Wedding', 'equipments': [{'equipment': self.drill.id, 'quantity': 1}]}, format='json').data['id']
+        self.client.patch(f'/api/v1/estimate/{estimate_id}/', {'note': 'Concert'}, format='json')
+        EstimateEquipment.objects.get(estimate_id=estimate_id).delete()
+        self.client.post('/api/v1/estimate/batch/', {'action': 'update', 'ids': [estimate_id],
+                                                     'changes': {'is_archived': True}}, format='json')
+        self.client.delete(f'/api/v1/estimate/{estimate_id}/')
+        Estimate.all_objects.filter(pk=estimate_id).restore()
+        Estimate.objects.create(created_by=self.other)
+
+        response = self.feed()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.actions(response), [(estimate_id, 'created')] + [(estimate_id, 'updated')] * 3 + [
+            (estimate_id, 'deleted'), (estimate_id, 'updated')])
+        seqs = [row['seq'] for row in response.data['results']]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(response.data['last_seq'], seqs[-1])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.feed(since=response.data['last_seq']).data['results'], [])
+
+        # Superusers see every estimate, as in the list
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertEqual(len(self.feed().data['results']), 7)
+
+    def test_rolled_back_writes_are_not_recorded(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Estimate.objects.create(created_by=self.user)
+            raise RuntimeError
+        self.assertFalse(EstimateChange.objects.exists())
+
+    def test_paging(self):
+        estimates = [Estimate.objects.create(created_by=self.user) for _ in range(3)]
+        response = self.feed(limit=2)
+        self.assertEqual([row['estimate'] for row in response.data['results']], [estimates[0].pk, estimates[1].pk])
+        self.assertIn(f'since={response.data["last_seq"]}', response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['estimate'] for row in response.data['results']], [estimates[2].pk])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.feed(since='x').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compaction(self):
+        kept = Estimate.objects.create(created_by=self.user)
+        kept.note = 'Changed'
+        kept.save()
+        removed = Estimate.objects.create(created_by=self.user)
+        removed.delete()
+        call_command('compact_estimate_changes', stdout=StringIO())
+        self.assertEqual(self.actions(self.feed()), [(kept.pk, 'updated'), (removed.pk, 'deleted')])
+        self.assertEqual(self.feed().status_code, status.HTTP_200_OK)
+
+        # Deletions past the retention period raise the horizon
+        EstimateChange.objects.filter(action='deleted').update(changed_at=timezone.now() - timedelta(days=31))
+        call_command('compact_estimate_changes', '--days=30', stdout=StringIO())
+        horizon = EstimateChangeHorizon.objects.get().seq
+        response = self.feed()
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(response.data['horizon'], horizon)
+        self.assertEqual(response.data['last_seq'], EstimateChange.objects.get().pk)
+        self.assertEqual(self.feed(since=horizon).data['results'], [])
+
+    def test_long_poll(self):
+        estimate = Estimate.objects.create(created_by=self.user)
+        data = self.client.get('/api/v1/estimate/async/changes/', {'wait': 10}).json()
+        self.assertEqual([(row['estimate'], row['action']) for row in data['results']], [(estimate.pk, 'created')])
+        # Nothing new: answered empty once the (capped) wait is over
+        response = self.client.get('/api/v1/estimate/async/changes/', {'since': data['last_seq'], 'wait': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [])
+
+    async def test_event_stream_resumes_after_last_event_id(self):
+        first = await Estimate.objects.acreate(created_by=self.user)
+        second = await Estimate.objects.acreate(created_by=self.user)
+        seq = (await EstimateChange.objects.aget(estimate_id=first.pk)).pk
+        token = RefreshToken.for_user(self.user).access_token
+        response = await self.async_client.get('/api/v1/estimate/async/changes/', headers={
+            'Authorization': f'Bearer {token}', 'Accept': 'text/event-stream', 'Last-Event-ID': str(seq)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = [event for event in body.split('\n\n') if event.startswith('id:')]
+        self.assertEqual(len(events), 1)
+        self.assertIn('event: created', events[0])
+        self.assertEqual(json.loads(events[0].split('data: ')[1])['estimate'], second.pk)
+
+
+class EstimateRollupTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('25.00'))
+        self.today = timezone.localdate()
+
+    def create(self, **quantities):
+        return self.client.post('/api/v1/estimate/', {'note': 'Rollup', 'equipments': [
+            {'equipment': getattr(self, name).id, 'quantity': quantity} for name, quantity in quantities.items()]},
+            format='json').data['id']
+
+    def assertConsistent(self):
+        self.assertEqual(check(), [])
+
+    def test_write_paths_keep_rollups_consistent(self):
+        estimate_id = self.create(drill=2, saw=1)
+        self.assertConsistent()
+        self.assertEqual(list(EstimateRollup.objects.values_list('estimates', 'archived', 'total')),
+                         [(1, 0, Decimal('45.00'))])
+        self.assertEqual(dict(EquipmentRollup.objects.values_list('equipment', 'lines')),
+                         {self.drill.pk: 1, self.saw.pk: 1})
+
+        self.client.patch(f'/api/v1/estimate/{estimate_id}/', {
+            'equipments': [{'equipment': self.drill.id, 'quantity': 5}]}, format='json')
+        self.assertConsistent()
+        self.assertEqual(EquipmentRollup.objects.get(equipment=self.drill).quantity, 5)
+        self.client.patch(f'/api/v1/estimate/{estimate_id}/', {'is_archived': True}, format='json')
+        self.assertConsistent()
+        self.client.post('/api/v1/estimate/batch/', {'action': 'update', 'ids': [estimate_id],
+                                                     'changes': {'is_archived': False}}, format='json')
+        self.assertConsistent()
+
+        other_id = self.create(saw=3)
+        EstimateEquipment.objects.get(estimate_id=other_id).delete()
+        self.assertConsistent()
+        EstimateEquipment.objects.create(estimate_id=other_id, equipment=self.drill, quantity=4)
+        self.assertConsistent()
+        self.client.delete(f'/api/v1/estimate/{other_id}/')
+        self.assertConsistent()
+        Estimate.all_objects.filter(pk=other_id).restore()
+        self.assertConsistent()
+        Estimate.all_objects.get(pk=other_id).restore()
+        self.assertConsistent()
+
+        self.user.delete()
+        self.assertConsistent()
+        self.assertEqual(list(EstimateRollup.objects.values_list('estimates', 'total')), [(0, Decimal('0'))])
+        self.user.restore()
+        self.assertConsistent()
+
+    def test_orm_writes_keep_rollups_consistent(self):
+        estimate = Estimate.objects.create(note='ORM', created_by=self.user)
+        self.assertConsistent()
+        EstimateEquipment.objects.create(estimate=estimate, equipment=self.drill, quantity=2)
+        self.assertConsistent()
+        # The line already there is not counted again
+        EstimateEquipment.objects.create(estimate=estimate, equipment=self.saw, quantity=1)
+        self.assertConsistent()
+        self.assertEqual(dict(EquipmentRollup.objects.values_list('equipment', 'lines')),
+                         {self.drill.pk: 1, self.saw.pk: 1})
+        estimate.delete()
+        self.assertConsistent()
+        self.assertEqual(list(EstimateRollup.objects.values_list('estimates', 'total')), [(0, Decimal('0'))])
+
+    def test_archive_tables_keep_their_counts(self):
+        estimate_id = self.create(drill=1)
+        Estimate.objects.filter(pk=estimate_id).update(is_archived=True,
+                                                      updated_at=timezone.now() - timedelta(days=365))
+        before = list(EstimateRollup.objects.values_list('estimates', 'archived', 'total'))
+        call_command('archive_estimates', stdout=StringIO())
+        self.assertTrue(ArchivedEstimate.objects.filter(pk=estimate_id).exists())
+        self.assertEqual(list(EstimateRollup.objects.values_list('estimates', 'archived', 'total')), before)
+        self.assertConsistent()
+        # Writing to it moves it back, unchanged, then counts the change
+        self.client.patch(f'/api/v1/estimate/{estimate_id}/', {'is_archived': False}, format='json')
+        self.assertEqual(list(EstimateRollup.objects.values_list('estimates', 'archived')), [(1, 0)])
+        self.assertConsistent()
+
+    def test_check_and_rebuild(self):
+        self.create(drill=2, saw=1)
+        EstimateRollup.objects.update(total=Decimal('1.00'))
+        EquipmentRollup.objects.filter(equipment=self.saw).delete()
+        with self.assertRaisesMessage(CommandError, '2 rollup rows differ'):
+            call_command('check_rollups', stdout=StringIO())
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertConsistent()
+        self.assertEqual(EstimateRollup.objects.get().total, Decimal('45.00'))
+
+    def test_reports(self):
+        self.create(drill=2, saw=1)
+        self.create(drill=1)
+        self.assertEqual(self.client.get('/api/v1/estimate/reports/estimators/').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.user.is_superuser = True
+        self.user.save()
+
+        response = self.client.get('/api/v1/estimate/reports/estimators/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'user': self.user.pk, 'email': self.user.email, 'estimates': 2,
+                                                     'archived': 0, 'total': Decimal('55.00')}])
+        response = self.client.get('/api/v1/estimate/reports/days/', {'user': str(self.user.pk)})
+        self.assertEqual([(row['day'], row['estimates']) for row in response.data['results']], [(self.today, 2)])
+        response = self.client.get('/api/v1/estimate/reports/equipment/', {'limit': 1})
+        self.assertEqual(response.data['results'], [{'equipment': self.drill.pk, 'name': 'Drill', 'lines': 2,
+                                                     'quantity': 3.0}])
+
+        # Days outside the range are left out
+        yesterday = (self.today - timedelta(days=1)).isoformat()
+        response = self.client.get('/api/v1/estimate/reports/days/', {'from': yesterday, 'to': yesterday})
+        self.assertEqual(response.data['results'], [])
+        for params in ({'from': 'soon'}, {'to': '2024-02-30'}, {'from': '2020-01-01', 'to': '2024-01-01'},
+                       {'from': '2020-01-02', 'to': '2020-01-01'}):
+            response = self.client.get('/api/v1/estimate/reports/days/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EstimateAdminTestCase(APITestCase):
+    def setUp(self):
+        self.admin: User = User.objects.create_superuser(email='admin@example.com', password='secret')
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.client.force_login(self.admin)
+        self.equipment = [Equipment.objects.create(name=f'Tool {i}', price=Decimal('10.00')) for i in range(25)]
+        # Fills the process-wide caches (content types) the first admin page reads
+        self.client.get('/admin/estimate/estimate/add/')
+
+    def create(self, lines, **fields):
+        serializer = EstimateSerializer(data={'note': 'Admin', **fields, 'equipments': [
+            {'equipment': equipment.pk, 'quantity': 1} for equipment in self.equipment[:lines]]})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(created_by=self.user)
+
+    def change_data(self, estimate, quantity, added=0):
+        """POST data of the change form, every line set to ``quantity``, plus ``added`` new lines."""
+        lines = list(estimate.equipments.order_by('pk'))
+        new = [equipment for equipment in self.equipment if equipment.pk not in
+               {line.equipment_id for line in lines}][:added]
+        data = {'note': estimate.note, 'equipments-TOTAL_FORMS': len(lines) + len(new),
+                'equipments-INITIAL_FORMS': len(lines), 'equipments-MIN_NUM_FORMS': 0,
+                'equipments-MAX_NUM_FORMS': 1000}
+        for index, line in enumerate(lines):
+            data.update({f'equipments-{index}-id': line.pk, f'equipments-{index}-estimate': estimate.pk,
+                         f'equipments-{index}-equipment': line.equipment_id,
+                         f'equipments-{index}-quantity': quantity})
+        for index, equipment in enumerate(new, len(lines)):
+            data.update({f'equipments-{index}-equipment': equipment.pk, f'equipments-{index}-quantity': quantity})
+        return data
+
+    def count_queries(self, method, url, data=None):
+        equipment_catalog.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertIn(response.status_code, (status.HTTP_200_OK, status.HTTP_302_FOUND))
+        return len([query for query in queries.captured_queries
+                    if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))])
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.create(2)
+        few = self.count_queries('get', '/admin/estimate/estimate/')
+        for _ in range(30):
+            self.create(2)
+        self.assertEqual(self.count_queries('get', '/admin/estimate/estimate/'), few)
+        self.assertEqual(self.count_queries('get', '/admin/estimate/estimateequipment/'),
+                         self.count_queries('get', '/admin/estimate/estimateequipment/?p=1'))
+
+        deleted = self.create(1, note='Gone')
+        deleted.delete()
+        self.assertNotContains(self.client.get('/admin/estimate/estimate/'), 'Gone')
+        self.assertContains(self.client.get('/admin/estimate/estimate/?deleted=yes'), 'Gone')
+        number = Estimate.objects.first().estimate_number
+        response = self.client.get('/admin/estimate/estimate/', {'q': number})
+        self.assertEqual([estimate.estimate_number for estimate in response.context['cl'].result_list], [number])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create(1, note='Scaffolding')
+        response = self.client.get('/admin/estimate/estimate/', {'q': 'scaff'})
+        self.assertEqual([estimate.note for estimate in response.context['cl'].result_list], ['Scaffolding'])
+
+    def test_capped_count_estimates_large_tables(self):
+        for _ in range(5):
+            self.create(0)
+
+        class Paginator(CappedCountPaginator):
+            count_limit = 2
+
+        estimates = Estimate.objects.all()
+        pks = list(estimates.values_list('pk', flat=True))
+        self.assertEqual(Paginator(estimates, 2).count, max(pks) - min(pks) + 1)
+        self.assertEqual(CappedCountPaginator(estimates, 2).count, 5)
+
+    def test_change_form_queries_do_not_grow_with_lines(self):
+        small, large = self.create(2), self.create(20)
+        self.assertEqual(self.count_queries('get', f'/admin/estimate/estimate/{small.pk}/change/'),
+                         self.count_queries('get', f'/admin/estimate/estimate/{large.pk}/change/'))
+        self.assertEqual(
+            self.count_queries('post', f'/admin/estimate/estimate/{small.pk}/change/', self.change_data(small, 2, 1)),
+            self.count_queries('post', f'/admin/estimate/estimate/{large.pk}/change/', self.change_data(large, 2, 1)))
+        large.refresh_from_db()
+        self.assertEqual(large.equipments.count(), 21)
+        self.assertEqual(large.total, Decimal('420.00'))
+        self.assertEqual(check(), [])
+
+        # Removed lines and duplicates
+        data = self.change_data(small, 1)
+        data['equipments-1-DELETE'] = 'on'
+        self.client.post(f'/admin/estimate/estimate/{small.pk}/change/', data)
+        small.refresh_from_db()
+        self.assertEqual((small.equipments.count(), small.total), (2, Decimal('20.00')))
+        data = self.change_data(small, 1, 1)
+        data['equipments-1-equipment'] = data['equipments-0-equipment']
+        response = self.client.post(f'/admin/estimate/estimate/{small.pk}/change/', data)
+        self.assertContains(response, 'The same equipment can only be added once to an estimate.')
+        self.assertEqual(small.equipments.count(), 2)
+
+    def test_add_form(self):
+        response = self.client.post('/admin/estimate/estimate/add/', {
+            'note': 'Added', 'created_by': self.user.pk, 'equipments-TOTAL_FORMS': 2,
+            'equipments-INITIAL_FORMS': 0, 'equipments-MIN_NUM_FORMS': 0, 'equipments-MAX_NUM_FORMS': 1000,
+            'equipments-0-equipment': self.equipment[0].pk, 'equipments-0-quantity': 2,
+            'equipments-1-equipment': self.equipment[1].pk, 'equipments-1-quantity': 1,
+            'equipments-1-price_override': '4.00'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        estimate = Estimate.objects.get(note='Added')
+        self.assertEqual((estimate.created_by, estimate.total), (self.user, Decimal('24.00')))
+        self.assertEqual(estimate.estimate_number, estimate_number_generator(estimate))
+        self.assertTrue(EstimateChange.objects.filter(estimate_id=estimate.pk).exists())
+        self.assertEqual(check(), [])
+
+    def test_actions(self):
+        estimates = [self.create(1), self.create(2)]
+        pks = [estimate.pk for estimate in estimates]
+        for action, archived in (('archive', True), ('unarchive', False)):
+            self.client.post('/admin/estimate/estimate/', {'action': action, '_selected_action': pks})
+            self.assertEqual(Estimate.objects.filter(pk__in=pks, is_archived=archived).count(), 2)
+            self.assertEqual(check(), [])
+
+        Estimate.objects.filter(pk__in=pks).delete()
+        self.client.post('/admin/estimate/estimate/?deleted=yes', {'action': 'restore', '_selected_action': pks})
+        self.assertEqual(Estimate.objects.filter(pk__in=pks).count(), 2)
+        self.assertEqual(EstimateEquipment.objects.filter(estimate__in=pks).count(), 3)
+        self.assertEqual(check(), [])
+
+
+class EstimateExportTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.other: User = User.objects.create(email='other@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('4.50'))
+        self.estimate = Estimate.objects.create(note='Kitchen, "phase 1"', created_by=self.user)
+        EstimateEquipment.objects.create(estimate=self.estimate, equipment=self.drill, quantity=2)
+        EstimateEquipment.objects.create(estimate=self.estimate, equipment=self.saw, quantity=1,
+                                         price_override=Decimal('4.00'))
+        self.empty = Estimate.objects.create(note='Empty', created_by=self.user, is_archived=True)
+        Estimate.objects.create(note='Not mine', created_by=self.other)
+
+    def export(self, query):
+        response = self.client.get(f'/api/v1/estimate/export/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        rows = list(csv.DictReader(StringIO(self.export('format=csv'))))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row['estimate_id'] for row in rows}, {str(self.estimate.id), str(self.empty.id)})
+        lines = [row for row in rows if row['estimate_id'] == str(self.estimate.id)]
+        self.assertEqual(lines[0]['note'], 'Kitchen, "phase 1"')
+        self.assertEqual({row['equipment_id'] for row in lines}, {str(self.drill.id), str(self.saw.id)})
+        self.assertEqual([row['line_id'] for row in rows if row['estimate_id'] == str(self.empty.id)], [''])
+
+    def test_ndjson_export_applies_filters(self):
+        documents = [json.loads(line) for line in self.export('format=ndjson&is_archived=false').splitlines()]
+        self.assertEqual([document['id'] for document in documents], [self.estimate.id])
+        self.assertEqual(len(documents[0]['equipments']), 2)
+
+    def test_export_reads_in_chunks(self):
+        for i in range(4):
+            Estimate.objects.create(note=f'Estimate {i}', created_by=self.user)
+        # One cursor over the estimates, fetched two rows at a time, plus one lines query per chunk
+        with CaptureQueriesContext(connection) as queries:
+            body = self.export('format=ndjson&chunk_size=2')
+        self.assertEqual(len(body.splitlines()), 6)
+        self.assertEqual(len(queries), 1 + 3)
+
+    def test_unknown_format(self):
+        response = self.client.get('/api/v1/estimate/export/?format=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncEstimateViewTestCase(APITestCase):
+    def setUp(self):
+        self.user: User = User.objects.create(email='alireza.ghnaimati78@gmail.com')
+        self.other: User = User.objects.create(email='other@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+
+    def test_crud(self):
+        response = self.client.post('/api/v1/estimate/async/', {
+            'note': 'Async', 'equipments': [{'equipment': self.drill.id, 'quantity': 3}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        pk = response.json()['id']
+        self.assertEqual(Estimate.objects.get(pk=pk).total, Decimal('30.00'))
+
+        response = self.client.get(f'/api/v1/estimate/async/{pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['subtotal'], '30.00')
+        self.assertEqual(len(response.json()['equipments']), 1)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(f'/api/v1/estimate/async/{pk}/', HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.patch(f'/api/v1/estimate/async/{pk}/', {'note': 'Changed'}, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['note'], 'Changed')
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.patch(f'/api/v1/estimate/async/{pk}/', {'note': 'Stale'}, format='json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        results = self.client.get('/api/v1/estimate/async/').json()['results']
+        self.assertEqual([row['id'] for row in results], [pk])
+
+        self.assertEqual(self.client.delete(f'/api/v1/estimate/async/{pk}/').status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertTrue(Estimate.deleted_objects.filter(pk=pk).exists())
+        self.assertEqual(self.client.get(f'/api/v1/estimate/async/{pk}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_errors(self):
+        estimate = Estimate.objects.create(created_by=self.other)
+        self.assertEqual(self.client.get(f'/api/v1/estimate/async/{estimate.pk}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(f'/api/v1/estimate/async/{estimate.pk}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        response = self.client.post('/api/v1/estimate/async/', {'equipments': [{'equipment': 999, 'quantity': 1}]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('equipments', response.json())
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get('/api/v1/estimate/async/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('WWW-Authenticate', response)
+
+    async def test_jwt_authentication_on_event_loop(self):
+        estimate = await Estimate.objects.acreate(created_by=self.user)
+        token = RefreshToken.for_user(self.user).access_token
+        response = await self.async_client.get(f'/api/v1/estimate/async/{estimate.pk}/',
+                                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['id'], estimate.pk)
@@ -1,7 +1,23 @@
 from django.urls import path
-from .views import EstimateCreateView, EstimateDetailView
+from .async_views import AsyncEstimateChangesView, AsyncEstimateDetailView, AsyncEstimateListCreateView
+from .views import (DailyReportView, EquipmentReportView, EstimateBatchView, EstimateByNumberView,
+                    EstimateChangesView, EstimateDetailView, EstimateExportView, EstimateImportView,
+                    EstimateListCreateView, EstimatorReportView)
 
 urlpatterns = [
-    path('', EstimateCreateView.as_view(), name='create-estimate'),
+    path('', EstimateListCreateView.as_view(), name='estimate-list'),
     path('<int:pk>/', EstimateDetailView.as_view(), name='estimate-detail'),
-]
\ No newline at end of file
+    path('export/', EstimateExportView.as_view(), name='estimate-export'),
+    path('import/', EstimateImportView.as_view(), name='estimate-import'),
+    path('batch/', EstimateBatchView.as_view(), name='estimate-batch'),
+    path('changes/', EstimateChangesView.as_view(), name='estimate-changes'),
+    # Reporting, from the rollups (estimate.rollups); superusers only
+    path('reports/estimators/', EstimatorReportView.as_view(), name='estimate-report-estimators'),
+    path('reports/days/', DailyReportView.as_view(), name='estimate-report-days'),
+    path('reports/equipment/', EquipmentReportView.as_view(), name='estimate-report-equipment'),
+    # Async versions of the list and detail endpoints, for ASGI deployments (test.asgi)
+    path('async/', AsyncEstimateListCreateView.as_view(), name='estimate-async-list'),
+    path('async/<int:pk>/', AsyncEstimateDetailView.as_view(), name='estimate-async-detail'),
+    path('async/changes/', AsyncEstimateChangesView.as_view(), name='estimate-async-changes'),
+    path('by-number/<str:estimate_number>/', EstimateByNumberView.as_view(), name='estimate-by-number'),
+]
@@ -1,17 +1,65 @@
-from rest_framework import generics, permissions, throttling
-from rest_framework.exceptions import PermissionDenied
-from rest_framework.throttling import ScopedRateThrottle
-from .models import Estimate
-from .serializers import EstimateSerializer
+import json
+import uuid
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from user.authentication import TokenClaimsAuthentication
+from utils.permissions import IsSuperUser
+from utils.throttling import SharedScopedRateThrottle, SharedUserRateThrottle
+from .archive import find_archived, restore_estimates
+from .changes import changes_after, feed_page, feed_params, get_horizon, gone, visible_changes
+from .etags import check_if_match, estimate_etag, etag_matches, instance_etag
+from .exporters import EXPORT_FORMATS
+from .filters import filter_estimates
+from .importers import EstimateImporter
+from .models import ArchivedEstimate, EquipmentRollup, Estimate, EstimateRollup
+from .pagination import EstimateCursorPagination, EstimateSearchPagination
+from .rollups import REPORT_MAX_DAYS
+from .search import search_estimates
+from .serializers import BATCH_MAX_ESTIMATES, EstimateBatchSerializer, EstimateListSerializer, EstimateSerializer
 
 
-class EstimateCreateView(generics.CreateAPIView):
+class EstimateListCreateView(generics.ListCreateAPIView):
     queryset = Estimate.objects.all()
     serializer_class = EstimateSerializer
+    pagination_class = EstimateCursorPagination
     permission_classes = [permissions.IsAuthenticated]
-    throttle_classes = [throttling.UserRateThrottle, ScopedRateThrottle]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
     throttle_scope = 'user_minute'
 
+    def get_queryset(self):
+        queryset = self.queryset
+        # Superusers can list every estimate, everyone else only sees their own
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(created_by=self.request.user)
+        queryset = filter_estimates(queryset, self.request.query_params)
+        if self.search_query():
+            queryset = search_estimates(queryset, self.search_query())
+        return queryset
+
+    def search_query(self):
+        """``?q=``: words searched in the notes and equipment names, results ranked by relevance."""
+        return self.request.query_params.get('q', '').strip() if self.request.method == 'GET' else ''
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = EstimateSearchPagination() if self.search_query() else self.pagination_class()
+        return self._paginator
+
+    def get_serializer_class(self):
+        # Lines are not part of list rows; the stored total is enough for dashboards
+        if self.request.method == 'GET':
+            return EstimateListSerializer
+        return self.serializer_class
+
     def perform_create(self, serializer):
         # Automatically set the 'created_by' field to the current user
         serializer.save(created_by=self.request.user)
@@ -21,21 +69,301 @@ class EstimateDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Estimate.objects.all()
     serializer_class = EstimateSerializer
     permission_classes = [permissions.IsAuthenticated]
-    throttle_classes = [throttling.UserRateThrottle, ScopedRateThrottle]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
     throttle_scope = 'user_minute'
 
     def get_queryset(self):
         # Allow only the creator to access, update, or delete their estimates
-        return self.queryset.filter(created_by=self.request.user)
+        queryset = self.queryset.filter(created_by=self.request.user)
+        if self.request.method == 'DELETE':
+            return queryset
+        # Totals are annotated and lines prefetched, so a response costs two queries whatever the line count
+        return queryset.with_totals().with_version().prefetch_related('equipments')
+
+    def get_current_etag(self):
+        """ETag of the requested estimate from a single aggregate query, without loading it."""
+        row = (self.queryset.filter(created_by=self.request.user, pk=self.kwargs['pk']).with_version()
+               .values_list('pk', 'updated_at', 'lines_updated_at', 'equipment_updated_at').first())
+        return estimate_etag(*row) if row else None
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            pass
+        # Estimates moved to the archive tables by archive_estimates: reads are served from there,
+        # writes move the estimate back first (inside update()'s transaction) and go on as usual
+        lookup = {'pk': self.kwargs['pk'], 'created_by': self.request.user}
+        if self.request.method in permissions.SAFE_METHODS:
+            estimate = find_archived(**lookup)
+            if estimate is None:
+                raise Http404
+            return estimate
+        if not restore_estimates(ArchivedEstimate.objects.filter(**lookup)):
+            raise Http404
+        return super().get_object()
+
+    def retrieve(self, request, *args, **kwargs):
+        # Polling clients send the ETag they hold; an unchanged estimate is answered without serializing it
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            etag = self.get_current_etag()
+            if etag is not None and etag_matches(if_none_match, etag, weak=True):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        instance = self.get_object()
+        etag = instance_etag(instance)
+        # Estimates in the archive tables are not seen by get_current_etag()
+        if if_none_match and etag_matches(if_none_match, etag, weak=True):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, headers={'ETag': etag})
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        with transaction.atomic():
+            instance = self.get_object()
+            if_match = request.headers.get('If-Match')
+            if if_match:
+                check_if_match(instance, if_match)
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            self.perform_update(serializer)
+
+        # Unlike UpdateModelMixin the prefetched lines are kept: the serializer refreshes them with
+        # the rows it just wrote, so the response needs no extra query
+        data = serializer.data
+        # Report how many line rows the diff actually wrote
+        data['equipment_changes'] = self.equipment_changes
+        return Response(data, headers={'ETag': self.get_current_etag()})
 
     def perform_update(self, serializer):
         # Ensure the 'created_by' field is not modified
-        if serializer.instance.created_by != self.request.user:
+        if serializer.instance.created_by_id != self.request.user.pk:
             raise PermissionDenied("You do not have permission to update this estimate.")
         serializer.save()
+        self.equipment_changes = serializer.equipment_changes
 
     def perform_destroy(self, instance):
         # Prevent deletion by other users
-        if instance.created_by != self.request.user:
+        if instance.created_by_id != self.request.user.pk:
             raise PermissionDenied("You do not have permission to delete this estimate.")
         instance.delete()
+
+
+class EstimateByNumberView(generics.RetrieveAPIView):
+    queryset = Estimate.objects.all()
+    serializer_class = EstimateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
+    throttle_scope = 'user_minute'
+    lookup_field = 'estimate_number'
+    # Read-only: the user comes from the token claims, without a lookup
+    authentication_classes = [TokenClaimsAuthentication]
+
+    def get_queryset(self):
+        # Exact match on the unique estimate_number index, restricted to the creator's estimates
+        return (self.queryset.filter(created_by_id=self.request.user.pk).with_totals()
+                .prefetch_related('equipments'))
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Also finds estimates moved to the archive tables
+            estimate = find_archived(estimate_number=self.kwargs['estimate_number'], created_by_id=self.request.user.pk)
+            if estimate is None:
+                raise
+            return estimate
+
+
+class EstimateBatchView(APIView):
+    """
+    One change applied to many of the caller's estimates: ``{"action": "update", "ids": [...],
+    "changes": {"is_archived": true}}``, or ``"action": "delete"`` (a soft delete), with ``"filter"``
+    (the list endpoint's query parameters) instead of ``ids`` to select the estimates.
+
+    Runs a fixed number of set-based statements in one transaction, whatever the number of estimates,
+    with the ownership check in their WHERE clause, and reports the outcome of every id:
+    ``updated``/``deleted``, or ``not_found`` for ids that are missing, deleted or someone else's.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
+    throttle_scope = 'user_minute'
+
+    def post(self, request):
+        serializer = EstimateBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        action = serializer.validated_data['action']
+        owned = Estimate.objects.filter(created_by=request.user)
+
+        with transaction.atomic():
+            if 'ids' in serializer.validated_data:
+                requested = list(dict.fromkeys(serializer.validated_data['ids']))
+                found = set(owned.filter(pk__in=requested).values_list('pk', flat=True))
+                missing = [pk for pk in requested if pk not in found]
+                # Estimates in the archive tables are moved back first, as for single writes
+                if missing and restore_estimates(ArchivedEstimate.objects.filter(created_by=request.user,
+                                                                                 pk__in=missing)):
+                    found.update(owned.filter(pk__in=missing).values_list('pk', flat=True))
+            else:
+                matching = filter_estimates(owned, serializer.validated_data['filter'])
+                requested = list(matching.order_by('pk').values_list('pk', flat=True)[:BATCH_MAX_ESTIMATES + 1])
+                if len(requested) > BATCH_MAX_ESTIMATES:
+                    raise ValidationError({'filter': [f"Matches more than {BATCH_MAX_ESTIMATES} estimates."]})
+                found = set(requested)
+
+            targets = owned.filter(pk__in=found)
+            if found and action == 'delete':
+                targets.delete()
+            elif found:
+                # QuerySet.update() skips auto_now; updated_at feeds the ETags
+                targets.update(**serializer.validated_data['changes'], updated_at=timezone.now())
+
+        outcome = 'deleted' if action == 'delete' else 'updated'
+        return Response({
+            'action': action,
+            'count': len(found),
+            'results': [{'id': pk, 'status': outcome if pk in found else 'not_found'} for pk in requested],
+        })
+
+
+class EstimateChangesView(APIView):
+    """
+    The change feed (see estimate.changes): ``?since=<seq>`` returns the entries after that sequence
+    number, ``limit`` at a time, oldest first, with ``last_seq`` to pass as ``since`` next time. Same
+    visibility as the list endpoint. 410 Gone when entries after ``since`` were compacted away.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle, SharedScopedRateThrottle]
+    throttle_scope = 'user_minute'
+
+    def get(self, request):
+        since, limit = feed_params(request.query_params)
+        changes = visible_changes(request.user)
+        horizon = get_horizon(changes.db)
+        if since < horizon:
+            return Response(gone(horizon, changes.aggregate(last=Max('id'))['last']), status=status.HTTP_410_GONE)
+        return Response(feed_page(list(changes_after(changes, since, limit + 1)), since, limit, request))
+
+
+class RollupReportView(APIView):
+    """
+    Base of the reporting endpoints, which read the rollups (see estimate.rollups) for the days from
+    ``from`` to ``to`` (ISO dates, the last 30 days by default, at most REPORT_MAX_DAYS), so their cost
+    depends on the number of days, estimators and equipment, not on the number of estimates and lines.
+    Subclasses define get_results(request, start, end), the rows of the report.
+    """
+    permission_classes = [IsSuperUser]
+    throttle_classes = [SharedUserRateThrottle]
+
+    def get(self, request):
+        end = self.parse_day(request, 'to', timezone.localdate())
+        start = self.parse_day(request, 'from', end - timedelta(days=29))
+        if not timedelta(0) <= end - start < timedelta(days=REPORT_MAX_DAYS):
+            raise ValidationError({'from': [f"Must be on or before 'to', at most {REPORT_MAX_DAYS} days before it."]})
+        return Response({'from': start, 'to': end, 'results': list(self.get_results(request, start, end))})
+
+    @staticmethod
+    def parse_day(request, name, default):
+        if not request.query_params.get(name):
+            return default
+        try:
+            day = parse_date(request.query_params[name])
+        except ValueError:  # Well formed, but not a valid date, such as 2024-02-30
+            day = None
+        if day is None:
+            raise ValidationError({name: ['Must be an ISO 8601 date.']})
+        return day
+
+
+class EstimatorReportView(RollupReportView):
+    """Estimates, archived estimates and their total per estimator, highest total first."""
+
+    def get_results(self, request, start, end):
+        return (EstimateRollup.objects.filter(day__range=(start, end))
+                .values('user').annotate(email=F('user__email'), estimates=Sum('estimates'),
+                                         archived=Sum('archived'), total=Sum('total'))
+                .filter(estimates__gt=0).order_by('-total', 'user'))
+
+
+class DailyReportView(RollupReportView):
+    """Estimates, archived estimates and their total per day, of everyone or of ``?user=<id>``."""
+
+    def get_results(self, request, start, end):
+        rows = EstimateRollup.objects.filter(day__range=(start, end))
+        if request.query_params.get('user'):
+            try:
+                rows = rows.filter(user_id=uuid.UUID(request.query_params['user']))
+            except ValueError:
+                raise ValidationError({'user': ['Must be a valid UUID.']})
+        return (rows.values('day').annotate(estimates=Sum('estimates'), archived=Sum('archived'), total=Sum('total'))
+                .filter(estimates__gt=0).order_by('day'))
+
+
+class EquipmentReportView(RollupReportView):
+    """Lines and quantity per equipment, most used first; ``limit`` (at most 500) equipment."""
+
+    def get_results(self, request, start, end):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 50)), 500))
+        except ValueError:
+            limit = 50
+        return (EquipmentRollup.objects.filter(day__range=(start, end))
+                .values('equipment').annotate(name=F('equipment__name'), lines=Sum('lines'), quantity=Sum('quantity'))
+                .filter(lines__gt=0).order_by('-lines', 'equipment')[:limit])
+
+
+class EstimateImportView(APIView):
+    """
+    Bulk import of NDJSON estimates (one EstimateSerializer payload per line, optionally with
+    ``created_by``). The request body is read line by line while results stream back as NDJSON,
+    so neither side is held in memory.
+    """
+    permission_classes = [IsSuperUser]
+    throttle_classes = [SharedUserRateThrottle]
+
+    def post(self, request):
+        try:
+            batch_size = int(request.query_params.get('batch_size', 500))
+        except ValueError:
+            batch_size = 500
+        importer = EstimateImporter(default_user=request.user, batch_size=max(1, min(batch_size, 5000)))
+        # Iterating the underlying HttpRequest reads the body lazily, without DRF's parsers
+        results = (json.dumps(result) + '\n' for result in importer.run(request._request))
+        return StreamingHttpResponse(results, content_type='application/x-ndjson')
+
+
+class EstimateExportView(APIView):
+    """
+    Streams estimates with their lines as CSV (one row per line) or NDJSON (one document per
+    estimate), selected with ``?format=csv|ndjson``. The list filters apply; rows are read in
+    chunks of ``chunk_size`` estimates, so memory stays flat whatever the size of the export.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SharedUserRateThrottle]
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= picks the export format, not a renderer: fall back to the default renderer,
+        # which is only used for error responses
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        export_format = request.query_params.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'format': [f'Choose one of: {", ".join(EXPORT_FORMATS)}.']})
+        try:
+            chunk_size = int(request.query_params.get('chunk_size', 1000))
+        except ValueError:
+            chunk_size = 1000
+
+        queryset = Estimate.objects.all()
+        # Same visibility as the list endpoint
+        if not request.user.is_superuser:
+            queryset = queryset.filter(created_by=request.user)
+        queryset = filter_estimates(queryset, request.query_params)
+
+        export, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(export(queryset, max(1, min(chunk_size, 5000))), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="estimates.{export_format}"'
+        return response
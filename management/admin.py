@@ -1,7 +1,13 @@
 from django.contrib import admin
+from utils.admin import CappedCountPaginator
 from .models import Equipment
 
-# Register your models here.
 
-
-admin.site.register(Equipment)
\ No newline at end of file
+@admin.register(Equipment)
+class EquipmentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'price', 'updated_at')
+    # Also serves the equipment autocomplete of the estimate lines
+    search_fields = ('name',)
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
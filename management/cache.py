@@ -0,0 +1,110 @@
+import threading
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = 'management:equipment_catalog:version'
+
+# Columns kept per cached equipment
+CACHED_FIELDS = ('id', 'name', 'price')
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'EQUIPMENT_CACHE_ALIAS', 'default')]
+
+
+def _publish_version():
+    _shared_cache().set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def bump_catalog_version(using=None):
+    """
+    Invalidate every process' catalog, right away and again once the current transaction commits,
+    so a worker that reloads an entry before the commit cannot keep the old row.
+
+    The version is a random token rather than a counter, so concurrent bumps never collide and
+    an evicted key still reads as a change.
+    """
+    _publish_version()
+    transaction.on_commit(_publish_version, using=using)
+
+
+class EquipmentCatalog:
+    """
+    Process-local, size-bounded LRU cache of Equipment id -> (name, price).
+
+    Every lookup first compares the local version with the stamp in the shared Django cache
+    (one cache read), so a save or delete in any worker is picked up by the next request of
+    every other worker. Misses are loaded together with one query.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or getattr(settings, 'EQUIPMENT_CACHE_SIZE', 10000)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_many(self, ids):
+        """Return {id: Equipment} (id, name and price only) for the ids that exist and are not soft-deleted."""
+        from management.models import Equipment
+
+        self._check_version()
+        found, missing = {}, []
+        with self._lock:
+            for pk in ids:
+                entry = self._entries.get(pk)
+                if entry is None:
+                    missing.append(pk)
+                else:
+                    self._entries.move_to_end(pk)
+                    found[pk] = entry
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            # Deferred instances carrying only the cached columns, usable as foreign key values, tagged
+            # with the database they were read from (a replica, with utils.routers). They are shared
+            # between callers and must be treated as read-only.
+            rows = Equipment.objects.filter(pk__in=missing).order_by().values_list(*CACHED_FIELDS)
+            loaded = [Equipment.from_db(rows.db, CACHED_FIELDS, row) for row in rows]
+            with self._lock:
+                for equipment in loaded:
+                    self._entries[equipment.pk] = equipment
+                    found[equipment.pk] = equipment
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return found
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+        }
+
+    def _check_version(self):
+        shared_cache = _shared_cache()
+        version = shared_cache.get(VERSION_KEY)
+        if version is None:
+            # Never set or evicted: publish a stamp so every process agrees on it from now on
+            shared_cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = shared_cache.get(VERSION_KEY)
+        if version != self._version:
+            with self._lock:
+                self._entries.clear()
+                self._version = version
+
+
+equipment_catalog = EquipmentCatalog()
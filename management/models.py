@@ -1,14 +1,78 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.utils.translation import gettext_lazy as _
-from utils.models import BaseModel
+from utils.models import AllObjectsManager, BaseModel, DeletedManager, SoftDeleteManager, SoftDeleteQuerySet
+from .cache import bump_catalog_version
+from .signals import equipment_renamed, equipment_repriced
+
+
+class EquipmentQuerySet(SoftDeleteQuerySet):
+    """
+    Invalidates the equipment catalog cache on set-based writes (updates, soft deletes, restores) and
+    sends equipment_renamed and equipment_repriced for the ones changing names and prices.
+    """
+
+    def update(self, **kwargs):
+        if 'name' not in kwargs and 'price' not in kwargs:
+            rows = super().update(**kwargs)
+            if rows:
+                bump_catalog_version(using=self.db)
+            return rows
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Read before the UPDATE, which may take the rows out of the queryset
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            if rows:
+                bump_catalog_version(using=self.db)
+            if pks and 'name' in kwargs:
+                equipment_renamed.send(sender=self.model, pks=pks, using=self.db)
+            if pks and 'price' in kwargs:
+                equipment_repriced.send(sender=self.model, pks=pks, using=self.db)
+        return rows
+
+    def hard_delete(self):
+        deleted = super().hard_delete()
+        bump_catalog_version(using=self.db)
+        return deleted
+
+    def purgeable(self, deleted_before):
+        # Lines, deleted ones and those of archived estimates included, keep the equipment they quote
+        return super().purgeable(deleted_before).filter(estimate_equipments__isnull=True,
+                                                        archived_estimate_equipments__isnull=True)
 
 
 class Equipment(BaseModel):
     name = models.CharField(max_length=255, blank=False, verbose_name=_('Name'))
     price = models.DecimalField(max_digits=8, decimal_places=2, verbose_name=_('Price'))
 
+    objects = SoftDeleteManager.from_queryset(EquipmentQuerySet)()
+    all_objects = AllObjectsManager.from_queryset(EquipmentQuerySet)()
+    deleted_objects = DeletedManager.from_queryset(EquipmentQuerySet)()
+
     class Meta:
         ordering = ["name"]
+        default_manager_name = "objects"
+        # Partial index matching SoftDeleteManager's deleted_at IS NULL filter and the default ordering
+        indexes = [
+            models.Index(fields=['name'], condition=models.Q(deleted_at__isnull=True), name='equipment_live_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        # Also reached by BaseModel.delete(), so soft deletes invalidate the catalog cache too
+        using = kwargs.get('using') or router.db_for_write(Equipment, instance=self)
+        update_fields = kwargs.get('update_fields')
+        repriced = False
+        if not self._state.adding and (update_fields is None or 'price' in update_fields):
+            previous = Equipment.all_objects.using(using).filter(pk=self.pk).values_list('price', flat=True).first()
+            repriced = previous is not None and previous != self.price
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            bump_catalog_version(using=self._state.db)
+            if repriced:
+                equipment_repriced.send(sender=Equipment, pks=[self.pk], using=self._state.db)
+
+    def hard_delete(self, using=None, keep_parents=False):
+        super().hard_delete(using=using, keep_parents=keep_parents)
+        bump_catalog_version(using=using)
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent by EquipmentQuerySet.update() when it changes the name of equipment, with the ``pks`` of the
+# equipment and the database alias ``using``; Equipment.save() renames send pre_save/post_save instead
+equipment_renamed = Signal()
+# Sent by EquipmentQuerySet.update() and Equipment.save() when they change the price of equipment, with
+# the ``pks`` of the equipment and the database alias ``using``, in the transaction of the change
+equipment_repriced = Signal()
@@ -1,3 +1,62 @@
+from decimal import Decimal
 from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+from user.models import User
+from .cache import EquipmentCatalog
+from .models import Equipment
 
-# Create your tests here.
+
+class EquipmentCatalogTestCase(TestCase):
+    def setUp(self):
+        self.catalog = EquipmentCatalog(max_size=2)
+        self.drill = Equipment.objects.create(name='Drill', price=Decimal('10.00'))
+        self.saw = Equipment.objects.create(name='Saw', price=Decimal('25.50'))
+
+    def test_hits_do_not_query(self):
+        self.catalog.get_many([self.drill.pk, self.saw.pk])
+        with self.assertNumQueries(0):
+            equipments = self.catalog.get_many([self.drill.pk, self.saw.pk])
+        self.assertEqual(equipments[self.saw.pk].price, Decimal('25.50'))
+        self.assertEqual(self.catalog.stats()['hits'], 2)
+        self.assertEqual(self.catalog.stats()['misses'], 2)
+
+    def test_hits_share_deferred_instances(self):
+        first = self.catalog.get(self.drill.pk)
+        # Stored once and handed to every caller as is; only the cached columns are loaded
+        self.assertIs(self.catalog.get(self.drill.pk), first)
+        self.assertEqual(first.get_deferred_fields(), {'created_at', 'updated_at', 'deleted_at'})
+        self.assertEqual((first.name, first.price), ('Drill', Decimal('10.00')))
+
+    def test_size_is_bounded(self):
+        ladder = Equipment.objects.create(name='Ladder', price=Decimal('5.00'))
+        self.catalog.get_many([self.drill.pk, self.saw.pk, ladder.pk])
+        self.assertEqual(self.catalog.stats()['size'], 2)
+
+    def test_save_invalidates(self):
+        self.catalog.get(self.drill.pk)
+        self.drill.price = Decimal('12.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drill.save()
+        self.assertEqual(self.catalog.get(self.drill.pk).price, Decimal('12.00'))
+
+    def test_soft_delete_invalidates(self):
+        self.catalog.get_many([self.drill.pk, self.saw.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drill.delete()
+            Equipment.objects.filter(pk=self.saw.pk).delete()
+        self.assertEqual(self.catalog.get_many([self.drill.pk, self.saw.pk]), {})
+
+
+class EquipmentCacheStatsViewTestCase(APITestCase):
+    def test_superuser_only(self):
+        user = User.objects.create(email='staff@example.com', is_staff=True)
+        self.client.force_authenticate(user=user)
+        self.assertEqual(self.client.get('/api/v1/management/equipment-cache/').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        user.is_superuser = True
+        user.save()
+        response = self.client.get('/api/v1/management/equipment-cache/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hits', response.data)
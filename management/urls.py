@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import EquipmentCacheStatsView
+
+urlpatterns = [
+    path('equipment-cache/', EquipmentCacheStatsView.as_view(), name='equipment-cache-stats'),
+]
@@ -1,3 +1,12 @@
-from django.shortcuts import render
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from utils.permissions import IsSuperUser
+from .cache import equipment_catalog
 
-# Create your views here.
+
+class EquipmentCacheStatsView(APIView):
+    permission_classes = [IsSuperUser]
+
+    def get(self, request):
+        # Counters are per process: each worker reports its own catalog
+        return Response(equipment_catalog.stats())
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -46,14 +47,21 @@ INSTALLED_APPS = [
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication with the user served from user.cache
+        'user.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        # orjson-backed; falls back to DRF's JSONRenderer when orjson is not installed
+        'utils.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',
-        'rest_framework.throttling.AnonRateThrottle',
+        # Counters shared by all worker processes on the host, see THROTTLE_DATABASE
+        'utils.throttling.SharedUserRateThrottle',
+        'utils.throttling.SharedAnonRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'user_minute': '50/minute',
@@ -71,12 +79,19 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=14),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Adds the claims used by user.authentication.TokenClaimsAuthentication
+    'TOKEN_OBTAIN_SERIALIZER': 'user.serializers.TokenObtainPairSerializer',
 }
 
 AUTH_USER_MODEL = 'user.User'
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'utils.middleware.RequestMetricsMiddleware',
+    'utils.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before anything that reads the database
+    'utils.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -110,12 +125,95 @@ WSGI_APPLICATION = 'test.wsgi.application'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 DATABASES = {
+    # Primary: takes every write
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
 
+# Optional read replica serving safe-method requests (utils.routers, utils.middleware). Locally it can
+# be a second SQLite file, copied from the primary with `python manage.py refresh_replica`.
+if os.environ.get('DJANGO_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['DJANGO_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['utils.routers.PrimaryReplicaRouter']
+
+# After a write, requests with the same credentials keep reading from the primary for this long
+REPLICA_STICKY_SECONDS = 5
+REPLICA_STICKY_CACHE_ALIAS = 'shared'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Visible to every worker process on the host; holds cross-process invalidation stamps
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+    },
+}
+
+# Runs the tests with the 'shared' cache in local memory
+TEST_RUNNER = 'utils.test_runner.TestRunner'
+
+# Equipment catalog cache (management.cache.EquipmentCatalog)
+EQUIPMENT_CACHE_ALIAS = 'shared'
+EQUIPMENT_CACHE_SIZE = 10000
+
+# Authenticated user cache (user.cache); entries are also invalidated on every change to the user
+USER_CACHE_ALIAS = 'shared'
+USER_CACHE_TIMEOUT = 60
+
+# Archived estimates unchanged for this many days are moved to the archive tables by
+# `python manage.py archive_estimates` (estimate.archive)
+ESTIMATE_ARCHIVE_AFTER_DAYS = 180
+
+# Soft-deleted rows are removed for good by `python manage.py purge_deleted` (estimate.purge) once
+# they were deleted this many days ago. Models are purged in this order, rows before the rows they
+# reference.
+SOFT_DELETE_RETENTION_DAYS = {
+    'estimate.EstimateEquipment': 30,
+    'estimate.Estimate': 90,
+    'management.Equipment': 365,
+    'user.User': 365,
+}
+
+# Change feed (estimate.changes): deletions are kept this many days by
+# `python manage.py compact_estimate_changes`; the async feed polls the database every
+# ESTIMATE_CHANGES_POLL_SECONDS, holds long polls at most ESTIMATE_CHANGES_MAX_WAIT seconds (also the
+# interval of keep-alives on idle event streams) and ends event streams after
+# ESTIMATE_CHANGES_STREAM_SECONDS, when clients reconnect
+ESTIMATE_CHANGES_RETENTION_DAYS = 30
+ESTIMATE_CHANGES_POLL_SECONDS = 1
+ESTIMATE_CHANGES_MAX_WAIT = 25
+ESTIMATE_CHANGES_STREAM_SECONDS = 300
+
+# SQLite file holding the throttle token buckets (utils.throttling)
+THROTTLE_DATABASE = BASE_DIR / '.cache' / 'throttle.sqlite3'
+
+# Request instrumentation (utils.middleware.RequestMetricsMiddleware): SQLite file the per-endpoint
+# latency histograms of every worker are added to, how often each worker adds its own, and how many
+# executions of one query in a request get it logged as a likely N+1
+REQUEST_METRICS_DATABASE = BASE_DIR / '.cache' / 'metrics.sqlite3'
+REQUEST_METRICS_FLUSH_SECONDS = 10
+REQUEST_METRICS_REPEATED_QUERIES = 10
+
+# On-demand request profiles (utils.middleware.ProfilingMiddleware): where the last
+# PROFILER_MAX_PROFILES profiles are kept, and the seconds between stack samples (no shorter than
+# the interpreter's 5 ms switch interval while the request runs Python code)
+PROFILER_DIRECTORY = BASE_DIR / '.cache' / 'profiles'
+PROFILER_MAX_PROFILES = 50
+PROFILER_SAMPLE_INTERVAL = 0.005
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
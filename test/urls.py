@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from utils.views import ProfileDetailView, ProfileListView, RequestMetricsView
 
 urlpatterns = [
     # Admin panel
@@ -8,6 +9,13 @@ urlpatterns = [
 
     # Application-specific URLs
     path('api/v1/estimate/', include(('estimate.urls', 'estimate'), namespace='estimate')),
+    path('api/v1/management/', include(('management.urls', 'management'), namespace='management')),
+
+    # Request latency and query statistics (superusers only)
+    path('api/v1/metrics/', RequestMetricsView.as_view(), name='request-metrics'),
+    # Request profiles recorded on demand (superusers only)
+    path('api/v1/profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('api/v1/profiles/<str:profile_id>/', ProfileDetailView.as_view(), name='profile-detail'),
 
     # JWT Authentication endpoints
     path('api/v1/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
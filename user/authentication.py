@@ -0,0 +1,73 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .cache import aget_cached_user, get_cached_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that takes the user from user.cache instead of querying it on every request.
+
+    Cached users are invalidated whenever the user row changes (see User.save and UserQuerySet),
+    so deactivation, soft deletion, password and permission changes apply to the next request.
+    """
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = get_cached_user(user_id, lambda: self.user_model.objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id}).first())
+        return self.check_user(user, validated_token)
+
+    async def aauthenticate(self, request):
+        """Async authenticate(), used by utils.views.AsyncAPIView."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = await aget_cached_user(user_id, lambda: self.user_model.objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id}).afirst())
+        return self.check_user(user, validated_token)
+
+    # The checks of JWTAuthentication.get_user, around the cached lookup
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def check_user(self, user, validated_token):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+class TokenClaimsAuthentication(JWTStatelessUserAuthentication):
+    """
+    Authentication from the token claims alone: no database or cache access at all.
+
+    request.user is a TokenUser whose pk, is_staff and is_superuser come from the claims added by
+    user.serializers.TokenObtainPairSerializer. Changes to the user only apply once the access
+    token is refreshed, so use it on read-only endpoints that filter by ``request.user.pk``.
+    """
+
+    async def aauthenticate(self, request):
+        # Nothing to wait for: the token is all there is
+        return self.authenticate(request)
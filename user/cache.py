@@ -0,0 +1,94 @@
+import uuid
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = 'user:auth_version:{}'
+ENTRY_KEY = 'user:auth:{}'
+
+# Columns kept per cached user: what authentication and the permission checks read. The password
+# hash and the personal details stay out of the shared cache.
+CACHED_FIELDS = ('id', 'email', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'USER_CACHE_ALIAS', 'default')]
+
+
+def _publish_versions(pks):
+    _shared_cache().set_many({VERSION_KEY.format(pk): uuid.uuid4().hex for pk in pks}, timeout=None)
+
+
+def bump_user_versions(pks, using=None):
+    """
+    Invalidate the cached copies of the given users in every process, right away and again once
+    the current transaction commits, like management.cache.bump_catalog_version.
+    """
+    pks = [str(pk) for pk in pks]
+    if not pks:
+        return
+    _publish_versions(pks)
+    transaction.on_commit(lambda: _publish_versions(pks), using=using)
+
+
+def _to_entry(version, user):
+    return version, user._state.db, {name: getattr(user, name) for name in CACHED_FIELDS}
+
+
+def _from_entry(entry):
+    """A User with the cached columns only; the other ones are deferred, loaded if they are read."""
+    _, using, values = entry
+    model = apps.get_model(settings.AUTH_USER_MODEL)
+    # from_db() takes the values in the order of the model's columns
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(using, names, [values[name] for name in names])
+
+
+def get_cached_user(pk, load):
+    """
+    Return the user with primary key ``pk`` from the shared cache, calling ``load()`` on a miss.
+    Hits are built from CACHED_FIELDS; misses return the loaded user.
+
+    Entries are stored together with the user's version stamp and both are read with one get_many,
+    so a hit costs a single cache round trip and any change bumped since the entry was written
+    makes it a miss. USER_CACHE_TIMEOUT bounds how long an entry lives regardless.
+    """
+    shared_cache = _shared_cache()
+    version_key, entry_key = VERSION_KEY.format(pk), ENTRY_KEY.format(pk)
+    cached = shared_cache.get_many([version_key, entry_key])
+    version, entry = cached.get(version_key), cached.get(entry_key)
+    if version is not None and entry is not None and entry[0] == version:
+        return _from_entry(entry)
+
+    if version is None:
+        # Never set or evicted: publish a stamp so every process agrees on it from now on
+        shared_cache.add(version_key, uuid.uuid4().hex, timeout=None)
+        version = shared_cache.get(version_key)
+    # The stamp is read before loading: a change committed in between bumps it and voids this entry
+    user = load()
+    if user is not None:
+        shared_cache.set(entry_key, _to_entry(version, user), timeout=_timeout())
+    return user
+
+
+async def aget_cached_user(pk, aload):
+    """Async get_cached_user(), with ``aload`` a coroutine function."""
+    shared_cache = _shared_cache()
+    version_key, entry_key = VERSION_KEY.format(pk), ENTRY_KEY.format(pk)
+    cached = await shared_cache.aget_many([version_key, entry_key])
+    version, entry = cached.get(version_key), cached.get(entry_key)
+    if version is not None and entry is not None and entry[0] == version:
+        return _from_entry(entry)
+
+    if version is None:
+        await shared_cache.aadd(version_key, uuid.uuid4().hex, timeout=None)
+        version = await shared_cache.aget(version_key)
+    user = await aload()
+    if user is not None:
+        await shared_cache.aset(entry_key, _to_entry(version, user), timeout=_timeout())
+    return user
+
+
+def _timeout():
+    return getattr(settings, 'USER_CACHE_TIMEOUT', 60)
@@ -3,7 +3,8 @@ from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from utils.models import BaseModel
+from utils.models import AllObjectsManager, BaseModel, DeletedManager, SoftDeleteQuerySet
+from .cache import bump_user_versions
 import uuid
 
 # Validator for Iranian or American phone numbers
@@ -15,7 +16,28 @@ phone_regex = RegexValidator(
 )
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(SoftDeleteQuerySet):
+    """Invalidates the cached users (user.cache) on set-based writes (updates, soft deletes, restores)."""
+
+    def update(self, **kwargs):
+        pks = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        bump_user_versions(pks, using=self.db)
+        return rows
+
+    def hard_delete(self):
+        pks = list(self.values_list('pk', flat=True))
+        deleted = super().hard_delete()
+        bump_user_versions(pks, using=self.db)
+        return deleted
+
+    def purgeable(self, deleted_before):
+        # The estimates of a deleted user are purged first, after their own retention period. Archived
+        # estimates are not purged, so their users are kept.
+        return super().purgeable(deleted_before).filter(estimates__isnull=True, archived_estimates__isnull=True)
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     use_in_migrations = True
 
     def get_queryset(self):
@@ -60,13 +82,27 @@ class User(AbstractUser, BaseModel):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
     objects = UserManager()
+    all_objects = AllObjectsManager.from_queryset(UserQuerySet)()
+    deleted_objects = DeletedManager.from_queryset(UserQuerySet)()
+    soft_delete_cascade = ('estimates',)
 
     class Meta:
         verbose_name = _("User")
         verbose_name_plural = _("Users")
+        # Partial index matching UserManager's deleted_at IS NULL filter and the admin ordering
+        indexes = [
+            models.Index(fields=['-date_joined'], condition=models.Q(deleted_at__isnull=True),
+                         name='user_live_joined_idx'),
+        ]
 
     def __str__(self) -> str:
         return str(self.email)
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
+        # Covers password, is_active and permission changes as well as soft delete and restore
+        bump_user_versions([self.pk], using=kwargs.get('using'))
+
+    def hard_delete(self, using=None, keep_parents=False):
+        super().hard_delete(using=using, keep_parents=keep_parents)
+        bump_user_versions([self.pk], using=using)
@@ -0,0 +1,12 @@
+from rest_framework_simplejwt import serializers
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    """Adds the permission flags read by user.authentication.TokenClaimsAuthentication to the tokens."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        return token
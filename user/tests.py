@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from estimate.models import Estimate
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from user.cache import ENTRY_KEY
+from user.models import User
+from user.serializers import TokenObtainPairSerializer
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+    url = '/api/v1/estimate/'
+
+    def setUp(self):
+        self.user: User = User.objects.create_user(email='alireza.ghnaimati78@gmail.com', password='secret')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        return response, [query['sql'] for query in queries if User._meta.db_table in query['sql']
+                          and 'estimate' not in query['sql']]
+
+    def test_user_is_loaded_once(self):
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(queries, [])
+
+    def test_cache_holds_no_password(self):
+        self.user_queries()
+        entry = caches[settings.USER_CACHE_ALIAS].get(ENTRY_KEY.format(self.user.pk))
+        self.assertNotIn(self.user.password, str(entry))
+        # Writes by a cached user reference it as usual
+        response = self.client.post(self.url, {'note': 'Cached'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Estimate.objects.get(pk=response.data['id']).created_by, self.user)
+
+    def test_changes_apply_immediately(self):
+        self.user_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.user.is_superuser = True
+        self.user.save()
+        other = User.objects.create(email='other@example.com')
+        Estimate.objects.create(created_by=other)
+        self.assertEqual(len(self.client.get(self.url).data['results']), 1)
+
+    def test_soft_deleted_user_is_rejected(self):
+        self.user_queries()
+        self.user.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.restore()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+
+class TokenClaimsAuthenticationTestCase(APITestCase):
+    def test_by_number_lookup_uses_claims_only(self):
+        user = User.objects.create_user(email='alireza.ghnaimati78@gmail.com', password='secret')
+        estimate = Estimate.objects.create(created_by=user)
+        token = TokenObtainPairSerializer.get_token(user).access_token
+        self.assertIs(token['is_superuser'], False)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/v1/estimate/by-number/{estimate.estimate_number}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], estimate.id)
+        # The estimate and its lines; no user lookup
+        self.assertEqual(len(queries), 2)
@@ -1,3 +1,51 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
 
-# Register your models here.
+
+class CappedCountPaginator(Paginator):
+    """
+    Admin paginator for large tables. The count stops at ``count_limit`` rows (a COUNT over a LIMITed
+    subquery), so it costs the same on any table size; past the cap it is estimated from the primary
+    key span of the rows, two index lookups, and the last pages may come out empty.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        object_list = self.object_list.order_by()
+        count = object_list[:self.count_limit + 1].count()
+        if count <= self.count_limit:
+            return count
+        first = object_list.order_by('pk').values_list('pk', flat=True).first()
+        last = object_list.order_by('-pk').values_list('pk', flat=True).first()
+        try:
+            return max(count, last - first + 1)
+        except TypeError:  # Primary keys without a span, such as UUIDs
+            return count
+
+
+class SoftDeleteListFilter(admin.SimpleListFilter):
+    """
+    Shows the live rows unless soft-deleted ones are asked for, for admins listing the all_objects
+    manager; lists of live rows stay on the models' partial indexes.
+    """
+    title = _('deleted')
+    parameter_name = 'deleted'
+
+    def lookups(self, request, model_admin):
+        return (('yes', _('Yes')),)
+
+    def queryset(self, request, queryset):
+        return queryset.filter(deleted_at__isnull=self.value() != 'yes')
+
+    def choices(self, changelist):
+        # No "All" choice: the default is the live rows
+        for value, display in ((None, _('No')), ('yes', _('Yes'))):
+            yield {
+                'selected': self.value() == value,
+                'query_string': changelist.get_query_string({self.parameter_name: value} if value else {},
+                                                             [self.parameter_name]),
+                'display': display,
+            }
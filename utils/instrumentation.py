@@ -0,0 +1,266 @@
+import contextvars
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .sqlite import LocalSQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram: bucket i covers [BUCKET_BASE_MS * BUCKET_GROWTH**i, BUCKET_BASE_MS * BUCKET_GROWTH**(i+1))
+# milliseconds, so reported percentiles are within 10% of the true value from 0.1 ms up to about a minute
+BUCKET_BASE_MS = 0.1
+BUCKET_GROWTH = 1.1
+BUCKET_COUNT = 140
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_latency (
+    endpoint TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (endpoint, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS request_totals (
+    endpoint TEXT PRIMARY KEY,
+    requests INTEGER NOT NULL,
+    queries INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    db_ms REAL NOT NULL,
+    serialize_ms REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+ADD_LATENCY = """
+INSERT INTO request_latency (endpoint, bucket, count) VALUES (?, ?, ?)
+ON CONFLICT (endpoint, bucket) DO UPDATE SET count = count + excluded.count
+"""
+
+ADD_TOTALS = """
+INSERT INTO request_totals (endpoint, requests, queries, total_ms, db_ms, serialize_ms) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (endpoint) DO UPDATE SET
+    requests = requests + excluded.requests,
+    queries = queries + excluded.queries,
+    total_ms = total_ms + excluded.total_ms,
+    db_ms = db_ms + excluded.db_ms,
+    serialize_ms = serialize_ms + excluded.serialize_ms
+"""
+
+# Stats of the request being handled; None outside requests, where recording costs one lookup per query.
+# Context variables follow the request into sync_to_async threads, so async views are measured too.
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent, filled in by record_query() and TimedSerializerMixin."""
+    __slots__ = ('queries', 'db_time', 'serialize_time', 'serializing', 'shapes', 'repeated')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = False
+        # SQL text (with placeholders, so one shape per statement) -> executions
+        self.shapes = {}
+        # Shapes executed at least REQUEST_METRICS_REPEATED_QUERIES times -> call site of the first repeat over
+        self.repeated = {}
+
+
+def start_request():
+    """Begin collecting stats for the current context; pass the token to finish_request()."""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper (see install_query_recorder) counting and timing queries."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+        count = stats.shapes.get(sql, 0) + 1
+        stats.shapes[sql] = count
+        if count == settings.REQUEST_METRICS_REPEATED_QUERIES:
+            stats.repeated[sql] = call_site()
+
+
+def _add_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorder():
+    """Add record_query to every database connection, current and future; safe to call more than once."""
+    connection_created.connect(_add_recorder, dispatch_uid='utils.instrumentation.record_query')
+    for connection in connections.all(initialized_only=True):
+        _add_recorder(connection)
+
+
+def call_site():
+    """'path:line in function' of the innermost project frame on the stack, outside this module."""
+    root = os.path.join(str(settings.BASE_DIR), '')
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and filename != __file__ and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class TimedSerializerMixin:
+    """
+    Serializer mixin adding the time spent in to_representation() to the request's serializer time.
+    Only the outermost call is timed, so nested and list serializers are not counted twice.
+    """
+
+    def to_representation(self, instance):
+        stats = _current.get()
+        if stats is None or stats.serializing:
+            return super().to_representation(instance)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serialize_time += time.perf_counter() - started
+            stats.serializing = False
+
+
+def bucket_for(ms):
+    if ms <= BUCKET_BASE_MS:
+        return 0
+    return min(int(math.log(ms / BUCKET_BASE_MS, BUCKET_GROWTH)), BUCKET_COUNT - 1)
+
+
+def bucket_upper_bound(bucket):
+    return BUCKET_BASE_MS * BUCKET_GROWTH ** (bucket + 1)
+
+
+def percentile(histogram, total, fraction):
+    """Upper bound of the bucket holding the ``fraction`` quantile of a {bucket: count} histogram."""
+    rank = max(1, math.ceil(total * fraction))
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return round(bucket_upper_bound(bucket), 2)
+    return None
+
+
+class MetricsStore(LocalSQLiteStore):
+    """Per-endpoint latency histograms and totals, summed over every worker process on the host."""
+    schema = SCHEMA
+
+    def add(self, latency, totals):
+        """
+        Add ``latency`` ({(endpoint, bucket): count}) and ``totals`` ({endpoint: [requests, queries,
+        total_ms, db_ms, serialize_ms]}) to the stored values in one transaction.
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(ADD_LATENCY, ((*key, count) for key, count in latency.items()))
+            connection.executemany(ADD_TOTALS, ((endpoint, *values) for endpoint, values in totals.items()))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def report(self):
+        """One entry per endpoint, the endpoints taking the most time in total first."""
+        histograms = {}
+        for endpoint, bucket, count in self.connection.execute('SELECT endpoint, bucket, count FROM request_latency'):
+            histograms.setdefault(endpoint, {})[bucket] = count
+
+        report = []
+        rows = self.connection.execute(
+            'SELECT endpoint, requests, queries, total_ms, db_ms, serialize_ms FROM request_totals ORDER BY total_ms DESC')
+        for endpoint, requests, queries, total_ms, db_ms, serialize_ms in rows:
+            histogram = histograms.get(endpoint, {})
+            report.append({
+                'endpoint': endpoint,
+                'requests': requests,
+                'mean_ms': round(total_ms / requests, 2),
+                'p50_ms': percentile(histogram, requests, 0.50),
+                'p95_ms': percentile(histogram, requests, 0.95),
+                'p99_ms': percentile(histogram, requests, 0.99),
+                'queries_per_request': round(queries / requests, 2),
+                'db_ms_per_request': round(db_ms / requests, 2),
+                'serialize_ms_per_request': round(serialize_ms / requests, 2),
+            })
+        return report
+
+    def reset(self):
+        self.connection.executescript('DELETE FROM request_latency; DELETE FROM request_totals;')
+
+
+class MetricsRecorder:
+    """
+    Collects request measurements in memory and adds them to the MetricsStore at most every
+    REQUEST_METRICS_FLUSH_SECONDS, so a request normally costs a few dictionary updates.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._totals = {}
+        self._flushed_at = time.monotonic()
+
+    def record(self, endpoint, stats, elapsed):
+        total_ms = elapsed * 1000
+        key = (endpoint, bucket_for(total_ms))
+        with self._lock:
+            self._latency[key] = self._latency.get(key, 0) + 1
+            totals = self._totals.get(endpoint)
+            if totals is None:
+                totals = self._totals[endpoint] = [0, 0, 0.0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += stats.queries
+            totals[2] += total_ms
+            totals[3] += stats.db_time * 1000
+            totals[4] += stats.serialize_time * 1000
+            due = time.monotonic() - self._flushed_at >= settings.REQUEST_METRICS_FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            latency, totals = self._latency, self._totals
+            self._latency, self._totals = {}, {}
+            self._flushed_at = time.monotonic()
+        if totals:
+            get_store().add(latency, totals)
+
+    def discard(self):
+        with self._lock:
+            self._latency, self._totals = {}, {}
+
+
+recorder = MetricsRecorder()
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    """Store for settings.REQUEST_METRICS_DATABASE, created once per path and process."""
+    path = str(settings.REQUEST_METRICS_DATABASE)
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(path, MetricsStore(path))
+    return store
@@ -0,0 +1,231 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from . import instrumentation, profiling
+from .routers import PRIMARY_DATABASE, REPLICA_DATABASE, replica_configured, route_reads
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_KEY = 'db:read_primary:{}'
+
+
+def _sticky_cache():
+    return caches[getattr(settings, 'REPLICA_STICKY_CACHE_ALIAS', 'default')]
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Routes the reads of safe-method requests to the replica (see utils.routers).
+
+    Read-your-writes: after a successful write, later requests with the same credentials (the
+    Authorization header, or the session cookie) read from the primary for REPLICA_STICKY_SECONDS,
+    long enough for the replica to catch up. The marker lives in a cache every worker shares.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = self.sticky_key(request)
+        sticky = key is not None and request.method in SAFE_METHODS and _sticky_cache().get(key)
+        alias = self.read_database(request, sticky)
+        with route_reads(alias):
+            response = self.get_response(request)
+        self.route_stream(response, alias)
+        if self.wrote(request, response, key):
+            _sticky_cache().set(key, True, timeout=settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        key = self.sticky_key(request)
+        sticky = key is not None and request.method in SAFE_METHODS and await _sticky_cache().aget(key)
+        alias = self.read_database(request, sticky)
+        with route_reads(alias):
+            response = await self.get_response(request)
+        self.route_stream(response, alias)
+        if self.wrote(request, response, key):
+            await _sticky_cache().aset(key, True, timeout=settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    @staticmethod
+    def route_stream(response, alias):
+        """Streaming content is produced after the middleware returns; keep its reads on ``alias``."""
+        if not response.streaming:
+            return
+        content = response.streaming_content
+        if response.is_async:
+            async def routed():
+                with route_reads(alias):
+                    async for chunk in content:
+                        yield chunk
+        else:
+            def routed():
+                with route_reads(alias):
+                    yield from content
+        response.streaming_content = routed()
+
+    @staticmethod
+    def read_database(request, sticky):
+        if request.method in SAFE_METHODS and not sticky:
+            return REPLICA_DATABASE
+        return PRIMARY_DATABASE
+
+    @staticmethod
+    def sticky_key(request):
+        if not replica_configured():
+            return None
+        credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not credentials:
+            return None
+        return STICKY_KEY.format(hashlib.sha1(credentials.encode()).hexdigest())
+
+    @staticmethod
+    def wrote(request, response, key):
+        return key is not None and request.method not in SAFE_METHODS and response.status_code < 400
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures every request: database queries and time, serializer time (TimedSerializerMixin) and
+    the total time spent in the view and the middleware below this one.
+
+    The figures are sent back in a Server-Timing header, which browser developer tools display, and
+    added to per-endpoint latency histograms reported by RequestMetricsView. A query executed
+    REQUEST_METRICS_REPEATED_QUERIES times or more in one request, typically an N+1 pattern, is
+    logged with the line of project code that issued it. Streaming responses are measured up to
+    the point they are returned; the time spent producing their content is not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrumentation.install_query_recorder()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = instrumentation.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.finish_request(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = instrumentation.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.finish_request(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def finish(self, request, response, stats, elapsed):
+        response['Server-Timing'] = (
+            f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+            f'serialize;dur={stats.serialize_time * 1000:.2f}, '
+            f'view;dur={elapsed * 1000:.2f}')
+        for sql, site in stats.repeated.items():
+            instrumentation.logger.warning(
+                "%s %s executed the same query %d times, first repeated at %s: %s",
+                request.method, request.path, stats.shapes[sql], site, sql[:500])
+        instrumentation.recorder.record(self.endpoint(request), stats, elapsed)
+
+    @staticmethod
+    def endpoint(request):
+        """Method and URL pattern, e.g. 'GET /api/v1/estimate/<int:pk>/'; one label for unmatched URLs."""
+        match = getattr(request, 'resolver_match', None)
+        route = f'/{match.route}' if match is not None and match.route is not None else '(unmatched)'
+        return f'{request.method} {route}'
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests on demand: a superuser request with an X-Profile header or ?profile=1
+    runs under a StackSampler, and its profile is stored (see utils.profiling.ProfileStore) under the
+    id returned in the X-Profile-Id response header, for download from ProfileDetailView.
+
+    The superuser check authenticates the request with the default DRF authenticators, and only
+    happens for requests carrying the flag; others go straight through. Async requests sample
+    every thread of the process, since their ORM work runs in worker threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not profiling.requested(request) or not self.allowed(request):
+            return self.get_response(request)
+        sampler = self.sampler([threading.get_ident()], type(self).__call__.__code__)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        response['X-Profile-Id'] = self.save(request, response, sampler, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not profiling.requested(request) or not await sync_to_async(self.allowed)(request):
+            return await self.get_response(request)
+        sampler = self.sampler(None, type(self).__acall__.__code__)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(sampler.stop, thread_sensitive=False)()
+        response['X-Profile-Id'] = await sync_to_async(self.save, thread_sensitive=False)(
+            request, response, sampler, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def allowed(request):
+        authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        try:
+            user = Request(request, authenticators=authenticators).user
+        except exceptions.APIException:
+            # Invalid credentials: the view responds as usual, unprofiled
+            return False
+        return user.is_superuser
+
+    @staticmethod
+    def sampler(thread_ids, root_code):
+        sampler = profiling.StackSampler(thread_ids, settings.PROFILER_SAMPLE_INTERVAL, root_code)
+        sampler.start()
+        return sampler
+
+    @staticmethod
+    def save(request, response, sampler, elapsed):
+        return profiling.get_store().save({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status_code': response.status_code,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(elapsed * 1000, 2),
+            'samples': sampler.samples,
+            'stacks': sampler.stacks,
+        })
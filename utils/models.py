@@ -1,38 +1,137 @@
-from django.db import models
+from collections import Counter
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
-class SoftDeleteManager(models.Manager):
+def soft_delete_relations(model):
+    """Yield (child model, foreign key name) for every reverse relation listed in model.soft_delete_cascade."""
+    for name in model.soft_delete_cascade:
+        relation = model._meta.get_field(name)
+        yield relation.related_model, relation.field.name
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    """
+    QuerySet whose delete() marks rows as deleted instead of removing them.
+
+    Each model is handled with a single UPDATE, children listed in ``soft_delete_cascade`` first,
+    all inside one transaction. Use hard_delete() to really remove rows.
+    """
+
+    def delete(self):
+        """Soft delete the rows in this queryset and their cascaded children."""
+        with transaction.atomic(using=self.db, savepoint=False):
+            deleted = self._soft_delete(timezone.now())
+        return sum(deleted.values()), dict(deleted)
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def restore(self):
+        """
+        Undo a soft delete. Children are only restored when they were deleted together with their
+        parent, so lines removed individually earlier stay deleted.
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            restored = self._restore(timezone.now())
+        return sum(restored.values()), dict(restored)
+
+    restore.alters_data = True
+    restore.queryset_only = True
+
+    def hard_delete(self):
+        """Permanently delete the rows, using Django's regular cascade collector."""
+        return super().delete()
+
+    hard_delete.alters_data = True
+    hard_delete.queryset_only = True
+
+    def purgeable(self, deleted_before):
+        """
+        Rows soft-deleted before ``deleted_before`` that hard_delete() can remove without taking rows
+        still in use with them; see estimate.purge. Models referenced by other rows narrow this down.
+        """
+        return self.filter(deleted_at__lt=deleted_before)
+
+    def _soft_delete(self, now):
+        counter = Counter()
+        live = self.filter(deleted_at__isnull=True)
+        # Children go first, while their parents still match the live filter
+        for child_model, fk_name in soft_delete_relations(self.model):
+            children = child_model.all_objects.using(self.db).filter(**{f'{fk_name}__in': live.values('pk')})
+            counter.update(children._soft_delete(now))
+        counter[self.model._meta.label] += live.update(deleted_at=now, updated_at=now)
+        return counter
+
+    def _restore(self, now):
+        counter = Counter()
+        deleted = self.filter(deleted_at__isnull=False)
+        for child_model, fk_name in soft_delete_relations(self.model):
+            children = child_model.all_objects.using(self.db).filter(**{
+                f'{fk_name}__in': deleted.values('pk'),
+                f'{fk_name}__deleted_at': F('deleted_at'),
+            })
+            counter.update(children._restore(now))
+        counter[self.model._meta.label] += deleted.update(deleted_at=None, updated_at=now)
+        return counter
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
     """Manager that retrieves only non-deleted objects."""
 
     def get_queryset(self):
         return super().get_queryset().filter(deleted_at__isnull=True)
 
 
-class DeletedManager(models.Manager):
+class DeletedManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
     """Manager that retrieves only soft-deleted objects."""
 
     def get_queryset(self):
         return super().get_queryset().filter(deleted_at__isnull=False)
 
 
+class AllObjectsManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """Manager that retrieves deleted and non-deleted objects."""
+
+
 class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created at'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated at'))
     deleted_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Deleted at'))
 
+    # Reverse relation names whose rows are soft-deleted and restored together with this object
+    soft_delete_cascade = ()
+
     class Meta:
         abstract = True
 
     objects = SoftDeleteManager()  # Manager for non-deleted objects
-    all_objects = models.Manager()  # Manager for all objects (deleted and non-deleted)
+    all_objects = AllObjectsManager()  # Manager for all objects (deleted and non-deleted)
     deleted_objects = DeletedManager()  # Manager for only soft-deleted objects
 
     def delete(self, using=None, keep_parents=False):
-        """Soft delete the object by setting the deleted_at field."""
-        self.deleted_at = timezone.now()
-        self.save(update_fields=['deleted_at'])
+        """Soft delete the object by setting the deleted_at field, cascading to soft_delete_cascade."""
+        using = using or self._state.db
+        with transaction.atomic(using=using):
+            self.deleted_at = timezone.now()
+            self.save(using=using, update_fields=['deleted_at', 'updated_at'])
+            deleted = Counter({self._meta.label: 1})
+            for child_model, fk_name in soft_delete_relations(self):
+                children = child_model.all_objects.using(using).filter(**{fk_name: self})
+                deleted.update(children._soft_delete(self.deleted_at))
+        return sum(deleted.values()), dict(deleted)
+
+    def restore(self, using=None):
+        """Undo a soft delete, together with the children that were deleted at the same time."""
+        using = using or self._state.db
+        with transaction.atomic(using=using):
+            for child_model, fk_name in soft_delete_relations(self):
+                children = child_model.all_objects.using(using).filter(**{fk_name: self, 'deleted_at': self.deleted_at})
+                children._restore(timezone.now())
+            self.deleted_at = None
+            self.save(using=using, update_fields=['deleted_at', 'updated_at'])
 
     def hard_delete(self, using=None, keep_parents=False):
         """Permanently delete the object."""
@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from django.conf import settings
+
+# A request is profiled when it carries this header (any value) or ?profile=1, and its user is a superuser
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+
+PROFILE_ID = re.compile(r'^\d{20}-[0-9a-f]{8}$')
+
+
+def requested(request):
+    """Whether the request asks to be profiled; the only work a request without the flag pays for."""
+    return PROFILE_HEADER in request.META or (
+        PROFILE_PARAM in request.META.get('QUERY_STRING', '') and request.GET.get(PROFILE_PARAM) == '1')
+
+
+def _short_path(filename):
+    root = os.path.join(str(settings.BASE_DIR), '')
+    _, separator, package_path = filename.rpartition('site-packages' + os.sep)
+    if separator:
+        return package_path
+    if filename.startswith(root):
+        return filename[len(root):]
+    return filename
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the Python stacks of some threads every ``interval`` seconds and counts identical stacks,
+    i.e. a statistical profile in collapsed-stack form. The profiled threads run unmodified; the
+    cost is this thread holding the GIL briefly for every sample.
+
+    ``thread_ids`` None samples every other thread, labelling stacks with the thread name. Stacks
+    are cut below the first frame running ``root_code``, so the server's frames are left out.
+
+    While the profiled threads run Python code, the sampler only gets the GIL after the interpreter's
+    switch interval (sys.getswitchinterval(), 5 ms by default), so samples come at most that often.
+    The interval is left alone: lowering it would slow every other thread of the process and skew
+    the numbers being measured.
+    """
+
+    def __init__(self, thread_ids=None, interval=0.005, root_code=None):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.root_code = root_code
+        self.stacks = {}
+        self.samples = 0
+        self._labels = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        if self.thread_ids is None:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            targets = [(ident, names.get(ident, str(ident))) for ident in frames if ident != self.ident]
+        else:
+            targets = [(ident, None) for ident in self.thread_ids]
+        for ident, thread_name in targets:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = self.collapse(frame)
+            if thread_name is not None:
+                stack = f'{thread_name};{stack}' if stack else thread_name
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def collapse(self, frame):
+        labels = []
+        while frame is not None and frame.f_code is not self.root_code:
+            labels.append(self.label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)  # co_qualname is new in Python 3.11
+            label = f'{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'.replace(';', ',')
+            self._labels[code] = label
+        return label
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def to_collapsed(profile):
+    """Brendan Gregg's collapsed-stack format, read by flamegraph.pl and speedscope."""
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].items())
+
+
+def to_speedscope(profile):
+    """speedscope's JSON file format (https://www.speedscope.app), one sampled profile."""
+    frames, indexes = [], {}
+    samples, weights = [], []
+    sample_ms = profile['duration_ms'] / max(profile['samples'], 1)
+    for stack, count in profile['stacks'].items():
+        sample = []
+        for name in stack.split(';'):
+            if name not in indexes:
+                indexes[name] = len(frames)
+                frames.append({'name': name})
+            sample.append(indexes[name])
+        samples.append(sample)
+        weights.append(count * sample_ms)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': f"{profile['method']} {profile['path']}",
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': f"{profile['method']} {profile['path']}",
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+class ProfileStore:
+    """
+    The last ``limit`` profiles, one JSON file each in ``directory``. Ids start with the creation
+    time, so sorting the file names orders the profiles and the oldest are dropped first.
+    """
+
+    def __init__(self, directory, limit):
+        self.directory = str(directory)
+        self.limit = limit
+
+    def save(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+        profile = {'id': profile_id, **profile}
+        path = self.path(profile_id)
+        # Written aside and renamed, so a download never sees a partial file
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(profile, file)
+        os.replace(f'{path}.tmp', path)
+        for stale in self.ids()[:-self.limit]:
+            try:
+                os.remove(self.path(stale))
+            except FileNotFoundError:
+                # Removed by another worker
+                pass
+        return profile_id
+
+    def ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json') and PROFILE_ID.match(name[:-5]))
+
+    def get(self, profile_id):
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(self.path(profile_id)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def list(self):
+        """Profiles newest first, without their stacks."""
+        profiles = (self.get(profile_id) for profile_id in reversed(self.ids()))
+        return [{key: value for key, value in profile.items() if key != 'stacks'}
+                for profile in profiles if profile is not None]
+
+    def path(self, profile_id):
+        return os.path.join(self.directory, f'{profile_id}.json')
+
+
+def get_store():
+    return ProfileStore(settings.PROFILER_DIRECTORY, settings.PROFILER_MAX_PROFILES)
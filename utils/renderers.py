@@ -0,0 +1,47 @@
+import datetime
+from decimal import Decimal
+from django.utils.functional import Promise
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+
+def _default(obj):
+    """Mirror rest_framework.utils.encoders.JSONEncoder for the types orjson does not handle natively."""
+    if isinstance(obj, (Decimal, Promise)):
+        return str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, enabled through REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].
+
+    Decimals are rendered as strings, like DRF's own encoder. When orjson is not installed, or the
+    client asks for indented output in a way orjson cannot produce, it falls back to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent:
+            if indent != 2:
+                return super().render(data, accepted_media_type, renderer_context)
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
@@ -0,0 +1,56 @@
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+
+# Django requires a 'default' alias; it is the primary, which takes every write
+PRIMARY_DATABASE = 'default'
+REPLICA_DATABASE = 'replica'
+
+# Alias reads go to in the current request or block; None (outside requests) means the primary
+_read_database = contextvars.ContextVar('read_database', default=None)
+
+
+def replica_configured():
+    return REPLICA_DATABASE in settings.DATABASES
+
+
+@contextmanager
+def route_reads(alias):
+    """
+    Send the reads inside the block to ``alias``, e.g. ``with route_reads(REPLICA_DATABASE):`` in a
+    management command producing a report. Writes always go to the primary.
+    """
+    token = _read_database.set(alias)
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to the primary and reads to whatever ReplicaRoutingMiddleware or route_reads()
+    selected: the replica for safe-method requests, the primary everywhere else.
+
+    The first write of a request pins its remaining reads to the primary, so a request always
+    sees its own writes. Without a 'replica' entry in DATABASES everything uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_database.get()
+        if alias == REPLICA_DATABASE and not replica_configured():
+            return PRIMARY_DATABASE
+        return alias or PRIMARY_DATABASE
+
+    def db_for_write(self, model, **hints):
+        if _read_database.get() == REPLICA_DATABASE:
+            _read_database.set(PRIMARY_DATABASE)
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives the schema together with the data (see refresh_replica)
+        return db == PRIMARY_DATABASE
@@ -0,0 +1,30 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class LocalSQLiteStore:
+    """
+    Base for small stores kept in a SQLite file next to the application, shared by every worker
+    process on the host without a separate server. Subclasses set ``schema``. Connections are per
+    thread, as sqlite3 requires.
+    """
+    schema = ''
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit; WAL lets readers and the single writer proceed concurrently, and the data
+            # is not worth an fsync per request
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(self.schema)
+            self._local.connection = connection
+        return connection
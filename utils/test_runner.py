@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that points the 'shared' cache at local memory for the run, so tests neither write
+    to the project's .cache directory nor bump the stamps of a development server using it.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.shared_cache = override_settings(CACHES={
+            **settings.CACHES,
+            'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-shared'},
+        })
+        self.shared_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.shared_cache.disable()
+        super().teardown_test_environment(**kwargs)
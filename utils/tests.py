@@ -1,3 +1,290 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.db import router
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from estimate.models import Estimate
+from user.models import User
+from utils import instrumentation, profiling
+from utils.middleware import ReplicaRoutingMiddleware, RequestMetricsMiddleware
+from utils.routers import route_reads
+from utils.throttling import SharedScopedRateThrottle, TokenBucketStore
 
-# Create your tests here.
+
+def consume_many(path, count):
+    """Run in a worker process: spend `count` checks on one bucket and return how many were allowed."""
+    store = TokenBucketStore(path)
+    return sum(store.consume('shared', capacity=60, rate=0.001)[0] for _ in range(count))
+
+
+class TokenBucketStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'throttle.sqlite3')
+        self.store = TokenBucketStore(self.path)
+
+    def test_bucket_empties_and_refills(self):
+        results = [self.store.consume('key', capacity=3, rate=1, now=100) for _ in range(4)]
+        self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+        self.assertAlmostEqual(results[-1][1], 1.0)
+
+        # Half a second refills half a token: still refused, with the wait shrinking accordingly
+        allowed, wait = self.store.consume('key', capacity=3, rate=1, now=100.5)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 0.5)
+        self.assertTrue(self.store.consume('key', capacity=3, rate=1, now=101)[0])
+        # Refilling never exceeds the capacity
+        self.assertEqual(sum(self.store.consume('key', capacity=3, rate=1, now=200)[0] for _ in range(5)), 3)
+
+    def test_buckets_are_independent(self):
+        self.assertTrue(self.store.consume('a', capacity=1, rate=1, now=100)[0])
+        self.assertFalse(self.store.consume('a', capacity=1, rate=1, now=100)[0])
+        self.assertTrue(self.store.consume('b', capacity=1, rate=1, now=100)[0])
+
+    def test_purge_drops_refilled_buckets(self):
+        self.store.consume('idle', capacity=2, rate=1, now=100)
+        self.store.consume('busy', capacity=2, rate=1, now=100)
+        self.store.consume('busy', capacity=2, rate=1, now=100)
+        # 'idle' is full again after one second, 'busy' after two
+        self.assertEqual(self.store.purge(now=101.5), 1)
+        self.assertTrue(self.store.consume('busy', capacity=2, rate=1, now=101.5)[0])
+
+    def test_limit_is_shared_across_processes(self):
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            allowed = sum(pool.map(consume_many, [self.path] * 4, [40] * 4))
+        self.assertEqual(allowed, 60)
+
+
+class SharedScopedRateThrottleTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(THROTTLE_DATABASE=os.path.join(directory.name, 'throttle.sqlite3'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    @patch.object(SharedScopedRateThrottle, 'THROTTLE_RATES', {'user_minute': '2/minute'})
+    def test_scoped_rate(self):
+        view = SimpleNamespace(throttle_scope='user_minute')
+        request = SimpleNamespace(user=SimpleNamespace(is_authenticated=True, pk=1))
+        results = [SharedScopedRateThrottle().allow_request(request, view) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+        throttle = SharedScopedRateThrottle()
+        self.assertFalse(throttle.allow_request(request, view))
+        self.assertAlmostEqual(throttle.wait(), 30, delta=1)
+        # Views without a scope are not throttled
+        self.assertTrue(SharedScopedRateThrottle().allow_request(request, SimpleNamespace()))
+
+
+@override_settings(REPLICA_STICKY_CACHE_ALIAS='default')
+class ReplicaRoutingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.patchers = [patch(target, return_value=True) for target in
+                         ('utils.routers.replica_configured', 'utils.middleware.replica_configured')]
+        for patcher in self.patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.reads = []
+
+    def handle(self, request, write=False, status_code=200):
+        """Run a request through the middleware, recording where its reads would go."""
+        def view(request):
+            self.reads.append(router.db_for_read(Estimate))
+            if write:
+                router.db_for_write(Estimate)
+                self.reads.append(router.db_for_read(Estimate))
+            return HttpResponse(status=status_code)
+
+        self.reads = []
+        ReplicaRoutingMiddleware(view)(request)
+        return self.reads
+
+    def test_safe_methods_read_from_replica(self):
+        self.assertEqual(self.handle(self.factory.get('/')), ['replica'])
+        self.assertEqual(self.handle(self.factory.post('/')), ['default'])
+        # Outside requests reads use the primary unless routed explicitly
+        self.assertEqual(router.db_for_read(Estimate), 'default')
+        with route_reads('replica'):
+            self.assertEqual(router.db_for_read(Estimate), 'replica')
+
+    def test_reads_after_a_write_use_the_primary(self):
+        self.assertEqual(self.handle(self.factory.get('/'), write=True), ['replica', 'default'])
+
+    def test_sticky_after_write(self):
+        token, other = {'HTTP_AUTHORIZATION': 'Bearer one'}, {'HTTP_AUTHORIZATION': 'Bearer two'}
+        self.handle(self.factory.post('/', **token), status_code=400)
+        self.assertEqual(self.handle(self.factory.get('/', **token)), ['replica'])
+
+        self.handle(self.factory.post('/', **token), status_code=201)
+        self.assertEqual(self.handle(self.factory.get('/', **token)), ['default'])
+        self.assertEqual(self.handle(self.factory.get('/', **other)), ['replica'])
+
+    def test_streaming_content_keeps_the_route(self):
+        def view(request):
+            return StreamingHttpResponse(router.db_for_read(Estimate) for _ in range(2))
+
+        response = ReplicaRoutingMiddleware(view)(self.factory.get('/'))
+        self.assertEqual(b''.join(response.streaming_content), b'replicareplica')
+
+    def test_without_replica(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.assertEqual(self.handle(self.factory.get('/')), ['default'])
+
+
+class RequestMetricsTestCase(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(REQUEST_METRICS_DATABASE=os.path.join(directory.name, 'metrics.sqlite3'))
+        override.enable()
+        self.addCleanup(override.disable)
+        instrumentation.recorder.discard()
+
+        self.user = User.objects.create_user(email='user@example.com')
+        self.superuser = User.objects.create_superuser(email='admin@example.com', password='password')
+        Estimate.objects.create(created_by=self.user)
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('estimate:estimate-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="[1-9]\d* queries", serialize;dur=[\d.]+, view;dur=[\d.]+$')
+
+    def test_metrics_endpoint(self):
+        self.client.force_authenticate(user=self.user)
+        for _ in range(3):
+            self.client.get(reverse('estimate:estimate-list'))
+        self.assertEqual(self.client.get(reverse('request-metrics')).status_code, 403)
+
+        self.client.force_authenticate(user=self.superuser)
+        report = {entry['endpoint']: entry for entry in self.client.get(reverse('request-metrics')).data}
+        entry = report['GET /api/v1/estimate/']
+        self.assertEqual(entry['requests'], 3)
+        self.assertGreater(entry['queries_per_request'], 0)
+        self.assertLessEqual(entry['p50_ms'], entry['p95_ms'])
+        self.assertLessEqual(entry['p95_ms'], entry['p99_ms'])
+        # The 403 above is counted under its own endpoint
+        self.assertEqual(report['GET /api/v1/metrics/']['requests'], 1)
+
+        self.assertEqual(self.client.delete(reverse('request-metrics')).status_code, 204)
+        self.assertEqual([entry['endpoint'] for entry in self.client.get(reverse('request-metrics')).data],
+                         ['DELETE /api/v1/metrics/'])
+
+    @override_settings(REQUEST_METRICS_REPEATED_QUERIES=5)
+    def test_repeated_queries_are_logged(self):
+        def view(request):
+            for estimate in Estimate.objects.all():
+                for _ in range(5):
+                    User.objects.filter(pk=estimate.created_by_id).exists()
+            return HttpResponse()
+
+        with self.assertLogs('utils.instrumentation', 'WARNING') as logs:
+            RequestMetricsMiddleware(view)(RequestFactory().get('/report/'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('GET /report/ executed the same query 5 times', logs.output[0])
+        self.assertIn('utils/tests.py', logs.output[0])
+
+    def test_percentiles(self):
+        histogram = {instrumentation.bucket_for(ms): 0 for ms in (1, 10, 100)}
+        for ms, count in ((1, 90), (10, 9), (100, 1)):
+            histogram[instrumentation.bucket_for(ms)] += count
+        self.assertAlmostEqual(instrumentation.percentile(histogram, 100, 0.5), 1, delta=0.1)
+        self.assertAlmostEqual(instrumentation.percentile(histogram, 100, 0.95), 10, delta=1)
+        self.assertAlmostEqual(instrumentation.percentile(histogram, 100, 0.99), 10, delta=1)
+        self.assertAlmostEqual(instrumentation.percentile(histogram, 100, 1), 100, delta=10)
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class StackSamplerTestCase(SimpleTestCase):
+    def test_samples_collapsed_stacks(self):
+        worker = threading.Thread(target=busy_wait, args=(0.2,))
+        worker.start()
+        sampler = profiling.StackSampler([worker.ident], interval=0.001)
+        sampler.start()
+        worker.join()
+        sampler.stop()
+
+        self.assertGreater(sampler.samples, 10)
+        stack = max(sampler.stacks, key=sampler.stacks.get)
+        self.assertRegex(stack.split(';')[-1], r'^busy_wait \(utils/tests.py:\d+\)$')
+
+    def test_store_keeps_the_latest_profiles(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = profiling.ProfileStore(directory.name, limit=3)
+        ids = [store.save({'path': f'/{number}/', 'stacks': {}}) for number in range(5)]
+        self.assertEqual(store.ids(), ids[2:])
+        self.assertEqual([profile['path'] for profile in store.list()], ['/4/', '/3/', '/2/'])
+        self.assertIsNone(store.get(ids[0]))
+        self.assertIsNone(store.get('../settings'))
+
+
+class ProfilingMiddlewareTestCase(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILER_DIRECTORY=directory.name, PROFILER_SAMPLE_INTERVAL=0.001)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(email='user@example.com')
+        self.superuser = User.objects.create_superuser(email='admin@example.com', password='password')
+        Estimate.objects.create(created_by=self.superuser)
+
+    def credentials(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def test_profile_recorded_for_superusers(self):
+        self.credentials(self.superuser)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('estimate:estimate-list')))
+        response = self.client.get(reverse('estimate:estimate-list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile_id = response['X-Profile-Id']
+        response = self.client.get(reverse('estimate:estimate-list'), {'profile': '1'})
+        self.assertIn('X-Profile-Id', response)
+
+        profiles = self.client.get(reverse('profile-list')).data
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(profiles[1]['id'], profile_id)
+        self.assertEqual((profiles[1]['method'], profiles[1]['path']), ('GET', '/api/v1/estimate/'))
+
+        url = reverse('profile-detail', args=[profile_id])
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        for line in response.content.decode().splitlines():
+            self.assertRegex(line, r' \d+$')
+        speedscope = json.loads(self.client.get(url, {'format': 'speedscope'}).content)
+        self.assertEqual(speedscope['profiles'][0]['type'], 'sampled')
+        self.assertEqual(self.client.get(url, {'format': 'svg'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('profile-detail', args=['missing'])).status_code, 404)
+
+    def test_flag_ignored_for_other_users(self):
+        self.credentials(self.user)
+        response = self.client.get(reverse('estimate:estimate-list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get(reverse('profile-list')).status_code, 403)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        response = self.client.get(reverse('estimate:estimate-list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(profiling.get_store().ids(), [])
@@ -0,0 +1,138 @@
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, SimpleRateThrottle, UserRateThrottle
+from .sqlite import LocalSQLiteStore
+
+# Rows idle past their refill time are equivalent to a full bucket; they are purged every PURGE_EVERY checks
+PURGE_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS throttle_bucket (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    allowed INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS throttle_bucket_expires_idx ON throttle_bucket (expires_at);
+"""
+
+# Tokens in the bucket after refilling it for the time elapsed since the last check. Elapsed time is
+# clamped at zero: checks from different workers can reach the database slightly out of order.
+REFILLED = 'MIN(:capacity, tokens + MAX(:now - updated_at, 0) * :rate)'
+
+# One statement per check: refill, take a token if one is available and report whether it was. SET
+# expressions all see the old row, so `allowed` is computed from the refilled value before it is
+# decremented. SQLite serializes writers, which makes the check atomic across every process using
+# the file.
+CONSUME = f"""
+INSERT INTO throttle_bucket (key, tokens, allowed, updated_at, expires_at)
+VALUES (:key, :capacity - 1, 1, :now, :now + 1 / :rate)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = {REFILLED} - ({REFILLED} >= 1),
+    allowed = {REFILLED} >= 1,
+    updated_at = MAX(updated_at, :now),
+    expires_at = :now + (:capacity - {REFILLED} + ({REFILLED} >= 1)) / :rate
+RETURNING tokens, allowed
+"""
+
+
+class TokenBucketStore(LocalSQLiteStore):
+    """
+    Token buckets kept in a SQLite file, shared by every worker process on the host.
+
+    Each bucket is one fixed-size row, and a check is a single UPSERT on its primary key, so the
+    cost does not grow with the rate.
+    """
+    schema = SCHEMA
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._checks = 0
+
+    def consume(self, key, capacity, rate, now=None):
+        """
+        Take one token from the bucket ``key`` holding up to ``capacity`` tokens refilled at ``rate``
+        tokens per second. Returns (allowed, seconds until the next token is available).
+        """
+        now = time.time() if now is None else now
+        tokens, allowed = self.connection.execute(
+            CONSUME, {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}).fetchone()
+
+        self._checks += 1
+        if self._checks % PURGE_EVERY == 0:
+            self.purge(now)
+        return bool(allowed), max(0.0, (1 - tokens) / rate)
+
+    def purge(self, now=None):
+        """Delete buckets that have refilled completely; a missing row behaves the same."""
+        now = time.time() if now is None else now
+        return self.connection.execute('DELETE FROM throttle_bucket WHERE expires_at < ?', (now,)).rowcount
+
+    def reset(self):
+        self.connection.execute('DELETE FROM throttle_bucket')
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    """Store for settings.THROTTLE_DATABASE, created once per path and process."""
+    path = str(settings.THROTTLE_DATABASE)
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(path, TokenBucketStore(path))
+    return store
+
+
+class SharedRateThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle whose counters live in a TokenBucketStore instead of the Django cache.
+
+    With a per-process cache such as LocMemCache every worker counts separately, so the effective
+    limit is the rate times the number of workers; here all workers on the host share one bucket.
+    A rate of ``N/period`` becomes a bucket of N tokens refilled at N per period: bursts up to the
+    full rate are allowed, after which requests are admitted at the steady rate.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.wait_seconds = get_store().consume(
+            self.key, self.num_requests, self.num_requests / self.duration, self.timer())
+        return allowed
+
+    async def aallow_request(self, request, view):
+        # SQLite may wait on another worker's write lock; keep that off the event loop
+        return await sync_to_async(self.allow_request, thread_sensitive=False)(request, view)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class SharedAnonRateThrottle(SharedRateThrottle, AnonRateThrottle):
+    """Drop-in replacement for AnonRateThrottle."""
+
+
+class SharedUserRateThrottle(SharedRateThrottle, UserRateThrottle):
+    """Drop-in replacement for UserRateThrottle."""
+
+
+class SharedScopedRateThrottle(SharedRateThrottle, ScopedRateThrottle):
+    """Drop-in replacement for ScopedRateThrottle."""
+
+    def allow_request(self, request, view):
+        # Scope resolution from ScopedRateThrottle.allow_request, which this class bypasses
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
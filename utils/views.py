@@ -1,3 +1,165 @@
-from django.shortcuts import render
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from . import instrumentation, profiling
+from .permissions import IsSuperUser
+from .renderers import ORJSONRenderer
 
-# Create your views here.
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of DRF's APIView for Django's async request path (ASGI).
+
+    Requests are wrapped in DRF's Request, and DRF's authentication, permission, throttle and
+    exception handler classes are reused, so async endpoints behave like their sync APIView
+    versions. Authenticators and throttles with an ``aauthenticate``/``aallow_request`` coroutine
+    are awaited; others run in a worker thread. Handlers are coroutines returning ``self.render()``.
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+    renderer_class = ORJSONRenderer
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Like APIView: token authentication does not use the CSRF cookie
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request, parsers=[parser() for parser in self.parser_classes],
+                          authenticators=[authenticator() for authenticator in self.authentication_classes])
+        self.request = request
+        try:
+            await self.initial(request)
+            method = request.method.lower()
+            handler = getattr(self, method, None) if method in self.http_method_names else None
+            if handler is None:
+                raise exceptions.MethodNotAllowed(request.method)
+            return await handler(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(exc)
+
+    async def initial(self, request):
+        await self.perform_authentication(request)
+        self.check_permissions(request)
+        await self.check_throttles(request)
+
+    async def perform_authentication(self, request):
+        for authenticator in request.authenticators:
+            if hasattr(authenticator, 'aauthenticate'):
+                result = await authenticator.aauthenticate(request)
+            else:
+                result = await sync_to_async(authenticator.authenticate)(request)
+            if result is not None:
+                # What Request._authenticate records, so successful_authenticator works as usual
+                request._authenticator = authenticator
+                request.user, request.auth = result
+                return
+        request._authenticator = None
+        request.user, request.auth = AnonymousUser(), None
+
+    def check_permissions(self, request):
+        for permission in (permission_class() for permission_class in self.permission_classes):
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(detail=getattr(permission, 'message', None),
+                                                  code=getattr(permission, 'code', None))
+
+    async def check_throttles(self, request):
+        durations = []
+        for throttle in (throttle_class() for throttle_class in self.throttle_classes):
+            if hasattr(throttle, 'aallow_request'):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = await sync_to_async(throttle.allow_request)(request, self)
+            if not allowed:
+                durations.append(throttle.wait())
+        if durations:
+            raise exceptions.Throttled(max((duration for duration in durations if duration is not None), default=None))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            # WWW-Authenticate header for 401 responses, else coerce to 403, as APIView does
+            authenticators = self.request.authenticators
+            auth_header = authenticators[0].authenticate_header(self.request) if authenticators else None
+            if auth_header:
+                exc.auth_header = auth_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+
+        context = {'view': self, 'args': self.args, 'kwargs': self.kwargs, 'request': self.request}
+        response = api_settings.EXCEPTION_HANDLER(exc, context)
+        if response is None:
+            raise exc
+        headers = {name: value for name, value in response.items() if name.lower() != 'content-type'}
+        return self.render(response.data, status=response.status_code, headers=headers)
+
+    def render(self, data, status=status.HTTP_200_OK, headers=None):
+        content = b'' if data is None else self.renderer_class().render(data)
+        return HttpResponse(content, status=status, headers=headers, content_type=self.renderer_class.media_type)
+
+
+class RequestMetricsView(APIView):
+    """
+    Per-endpoint request counts, latency percentiles and average queries, database and serializer
+    time collected by RequestMetricsMiddleware from every worker. DELETE starts a new measurement.
+    """
+    permission_classes = [IsSuperUser]
+
+    def get(self, request):
+        # Other workers add their figures every REQUEST_METRICS_FLUSH_SECONDS; this one's are added now
+        instrumentation.recorder.flush()
+        return Response(instrumentation.get_store().report())
+
+    def delete(self, request):
+        instrumentation.recorder.discard()
+        instrumentation.get_store().reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProfileListView(APIView):
+    """Profiles recorded by ProfilingMiddleware, newest first, without their stacks."""
+    permission_classes = [IsSuperUser]
+
+    def get(self, request):
+        return Response(profiling.get_store().list())
+
+
+class ProfileDetailView(APIView):
+    """
+    Downloads one profile as collapsed stacks (``?format=collapsed``, the default, for flamegraph.pl
+    or speedscope) or in speedscope's own JSON format (``?format=speedscope``).
+    """
+    permission_classes = [IsSuperUser]
+    formats = {
+        'collapsed': (profiling.to_collapsed, 'text/plain; charset=utf-8', 'folded'),
+        'speedscope': (profiling.to_speedscope, 'application/json', 'speedscope.json'),
+    }
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= picks the profile format, not a renderer (see EstimateExportView)
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, profile_id):
+        profile_format = request.query_params.get('format', 'collapsed')
+        if profile_format not in self.formats:
+            raise exceptions.ValidationError({'format': [f'Choose one of: {", ".join(self.formats)}.']})
+        profile = profiling.get_store().get(profile_id)
+        if profile is None:
+            raise Http404
+        convert, content_type, extension = self.formats[profile_format]
+        content = convert(profile)
+        if not isinstance(content, str):
+            content = ORJSONRenderer().render(content)
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{profile_id}.{extension}"'
+        return response